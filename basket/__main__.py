@@ -7,35 +7,52 @@ and outputs the subtotal, the special offer discounts and the final price.
 Information about goods available for purchase (product names, units and
 price) are loaded (by default) from the json file ``goods.json``.  Special
 offers are are loaded (by default) from the json file ``offers.json``.
+They can be compiled with ``--compile`` into a binary catalogue file that
+``--catalogue`` loads lazily (see ``basket.binary``).
+
+With ``--batch`` many baskets are priced against the one loaded catalogue,
+reading baskets as JSON lines from a file (or ``-`` for stdin) and writing
+one JSON result line per basket to stdout (see ``basket.batch``).  Use
+``--workers`` to spread a batch across several processes.  With
+``--simulate`` a batch of past baskets is used instead to report how new
+offers would change their prices (see ``basket.simulate``).
+``--check-offers`` reports offers that can never apply or that compete for
+the same items (see ``basket.graph``).
+
+With ``--serve`` the catalogue is loaded once and kept in memory by an HTTP
+service that prices baskets posted to it as JSON (see ``basket.server``).
+Add ``--asyncio`` for an event loop based service that coalesces
+concurrent requests into micro-batches (see ``basket.async_server``).  The
+service reloads the goods and offers files when they change.
+
+Pricing a single basket is kept quick to start, since scripts may run the
+program once per order: a command line of items is parsed without
+``argparse``, only the goods and offers involving the items given are made,
+and the modules used by the other modes are imported when first needed.
 """
 
 
-import argparse
+import contextlib
+import functools
 import json
+import os
 import sys
 import time
+import types
 
 from basket import product
 from basket import offer
 from basket import basket
+from basket import engine
+from basket import logs
+from basket import profiling
+from basket import receipt
+from basket import stream
 
 
-LOGGING = False
-
-# Log levels
-INFO = 'INFO'
-ERROR = 'ERROR'
-
-
-def log(message, level=INFO):
-    """Simple logger.
-
-    :param str message: Log message
-    :param str level: Log level
-    """
-    if LOGGING:
-        now = time.strftime('%Y-%m-%d %H:%M:%S')
-        print('{} {}: {}'.format(now, level, message))
+# Formats of the results of a batch: JSON lines, or those of
+# ``columnar.FORMATS``, which is only imported when used
+OUTPUT_FORMATS = ('jsonl', 'csv', 'tsv', 'parquet', 'arrow')
 
 
 def parse_args(argv=None):
@@ -43,6 +60,7 @@ def parse_args(argv=None):
 
     :param list argv: Args to parse.
     """
+    import argparse  # pylint: disable=import-outside-toplevel
     parser = argparse.ArgumentParser(prog='basket')
     parser.add_argument(
         '-v',
@@ -50,6 +68,27 @@ def parse_args(argv=None):
         action='version',
         version='%(prog)s 0.1',
     )
+    _add_catalogue_arguments(parser)
+    parser.add_argument(
+        'items',
+        metavar='item',
+        type=str,
+        nargs='*',
+        help='One or more items for the basket.  Only items listed in '
+             'goods.json are accepted.')
+    _add_batch_arguments(parser)
+    _add_serve_arguments(parser)
+    _add_output_arguments(parser)
+    args = parser.parse_args(argv)
+    _validate_args(parser, args)
+    return args
+
+
+def _add_catalogue_arguments(parser):
+    """Add the arguments choosing the goods and offers.
+
+    :param parser: ``argparse.ArgumentParser`` instance.
+    """
     parser.add_argument(
         '--goods',
         help='Path of the goods json file',
@@ -63,85 +102,715 @@ def parse_args(argv=None):
         dest='offers',
     )
     parser.add_argument(
-        'items',
-        metavar='item',
-        type=str,
-        nargs='+',
-        help='One or more items for the basket.  Only items listed in '
-             'goods.json are accepted.')
+        '--compile',
+        help='Compile the goods and offers into a binary catalogue file '
+             'for --catalogue, then exit',
+        default=None,
+        dest='compile',
+    )
+    parser.add_argument(
+        '--check-offers',
+        help='Report the offers that can never apply, as a product is not '
+             'in stock or another offer always replaces them, and those '
+             'competing for the same items, then exit',
+        action='store_true',
+        dest='check_offers',
+    )
+    parser.add_argument(
+        '--catalogue',
+        help='Path of a binary catalogue file made with --compile, used '
+             'instead of the goods and offers json files',
+        default=None,
+        dest='catalogue',
+    )
+    parser.add_argument(
+        '--strategy',
+        help='How offers competing for the same items are allocated: in '
+             'order, later offers replacing earlier ones (ordered), the '
+             'largest discount earned for each item (best), or the lowest '
+             'price with each item counting towards one offer (exclusive) '
+             '(default ordered)',
+        choices=engine.STRATEGIES,
+        default=engine.ORDERED,
+        dest='strategy',
+    )
+
+
+def _add_batch_arguments(parser):
+    """Add the arguments for pricing a batch of baskets.
+
+    :param parser: ``argparse.ArgumentParser`` instance.
+    """
+    parser.add_argument(
+        '--batch',
+        help='Price baskets read as JSON lines from a file (or - for '
+             'stdin), writing a JSON result line per basket',
+        default=None,
+        dest='batch',
+    )
+    parser.add_argument(
+        '--output-format',
+        help='Format of the results of --batch: a JSON line per basket '
+             '(jsonl), or a table of the id, subtotal, discount and total '
+             'of each basket and the units and discount of each offer, as '
+             'csv, tsv, parquet or arrow (default jsonl)',
+        choices=OUTPUT_FORMATS,
+        default='jsonl',
+        dest='output_format',
+    )
+    parser.add_argument(
+        '--simulate',
+        help='Report how replacing the offers with those in this json file '
+             'would change the prices of the baskets given with --batch, '
+             'repricing only the baskets the changed offers could affect',
+        default=None,
+        dest='simulate',
+    )
+    parser.add_argument(
+        '--workers',
+        help='Number of worker processes used with --batch, 0 for one per '
+             'CPU (default 1)',
+        default=1,
+        type=int,
+        dest='workers',
+    )
+    parser.add_argument(
+        '--chunk-size',
+        help='Number of baskets priced per task by each worker '
+             '(default 1000)',
+        default=1000,
+        type=int,
+        dest='chunk_size',
+    )
+    parser.add_argument(
+        '--cache-size',
+        help='Most baskets whose prices are cached with --batch or --serve, '
+             '0 for no cache (default 10000)',
+        default=10000,
+        type=int,
+        dest='cache_size',
+    )
+
+
+def _add_serve_arguments(parser):
+    """Add the arguments for running the pricing service.
+
+    :param parser: ``argparse.ArgumentParser`` instance.
+    """
+    parser.add_argument(
+        '--serve',
+        help='Run an HTTP service pricing baskets posted to /price',
+        default=False,
+        action='store_true',
+        dest='serve',
+    )
+    parser.add_argument(
+        '--host',
+        help='Host address the service listens on (default 127.0.0.1)',
+        default='127.0.0.1',
+        dest='host',
+    )
+    parser.add_argument(
+        '--port',
+        help='Port the service listens on (default 8080)',
+        default=8080,
+        type=int,
+        dest='port',
+    )
+    parser.add_argument(
+        '--reload-interval',
+        help='Seconds between checks for changed goods and offers files '
+             'with --serve, 0 to never reload (default 1)',
+        default=1.0,
+        type=float,
+        dest='reload_interval',
+    )
+    parser.add_argument(
+        '--asyncio',
+        help='Serve with asyncio, pricing concurrent requests in batches',
+        default=False,
+        action='store_true',
+        dest='asyncio',
+    )
+    parser.add_argument(
+        '--max-batch',
+        help='Most baskets priced together with --asyncio (default 128)',
+        default=128,
+        type=int,
+        dest='max_batch',
+    )
+    parser.add_argument(
+        '--batch-window',
+        help='Longest time in milliseconds a basket waits for others to be '
+             'priced with it with --asyncio (default 2)',
+        default=2.0,
+        type=float,
+        dest='batch_window',
+    )
+    parser.add_argument(
+        '--max-in-flight',
+        help='Most baskets awaiting pricing before requests are held back '
+             'with --asyncio (default 1024)',
+        default=1024,
+        type=int,
+        dest='max_in_flight',
+    )
+
+
+def _add_output_arguments(parser):
+    """Add the arguments for what is printed besides prices.
+
+    :param parser: ``argparse.ArgumentParser`` instance.
+    """
+    parser.add_argument(
+        '--profile',
+        help='Print the time spent in each phase of pricing, and the work '
+             'done per basket, to stderr on exit (disables the price cache)',
+        default=False,
+        action='store_true',
+        dest='profile',
+    )
+    parser.add_argument(
+        '--profile-output',
+        help='Profile with cProfile, saving the statistics to a file for '
+             'pstats (implies --profile)',
+        default=None,
+        dest='profile_output',
+    )
+    parser.add_argument(
+        '--expand-discounts',
+        help='Print a discount line per discounted item, rather than one '
+             'per distinct discount with the number of items it applies to',
+        action='store_true',
+        dest='expand_discounts',
+    )
+    parser.add_argument(
+        '--log-level',
+        help='Lowest level of message to log (default off, or info with '
+             '--verbose)',
+        choices=sorted(logs.LEVELS, key=logs.LEVELS.get),
+        default=None,
+        dest='log_level',
+    )
     parser.add_argument(
         '--verbose',
-        help='Verbose output',
+        help='Verbose output, the same as --log-level info',
         default=False,
         action='store_true',
         dest='verbose',
     )
-    return parser.parse_args(argv)
 
 
-def load_json(json_file_path):
-    """Load json data.
+# Smallest value of each numeric argument, and the error if it is less
+_ARGUMENT_MINIMUMS = (
+    ('reload_interval', 0, '--reload-interval cannot be negative'),
+    ('max_batch', 1, '--max-batch must be at least 1'),
+    ('batch_window', 0, '--batch-window cannot be negative'),
+    ('max_in_flight', 1, '--max-in-flight must be at least 1'),
+    ('workers', 0, '--workers cannot be negative'),
+    ('chunk_size', 1, '--chunk-size must be at least 1'),
+    ('cache_size', 0, '--cache-size cannot be negative'),
+)
+
+
+def _validate_args(parser, args):
+    """Check the parsed arguments can be used together.
+
+    Exits through ``parser.error`` at the first that cannot.
+
+    :param parser: ``argparse.ArgumentParser`` instance.
+    :param args: Parsed command line arguments.
+    """
+    _validate_modes(parser, args)
+    _validate_options(parser, args)
+    for dest, minimum, message in _ARGUMENT_MINIMUMS:
+        if getattr(args, dest) < minimum:
+            parser.error(message)
+    if args.profile_output is not None:
+        args.profile = True
+    if args.profile:
+        # Price every basket so that each phase is measured
+        args.cache_size = 0
+    if args.profile and args.batch is not None and args.workers != 1:
+        parser.error('--profile can only be used with a single worker')
+
+
+def _validate_modes(parser, args):
+    """Check a single mode of running is asked for.
+
+    :param parser: ``argparse.ArgumentParser`` instance.
+    :param args: Parsed command line arguments.
+    """
+    batch = args.batch is not None
+    if batch and args.serve:
+        parser.error('--batch cannot be used with --serve')
+    if args.compile is not None and (args.items or batch or args.serve):
+        parser.error('--compile cannot be used with items, --batch or '
+                     '--serve')
+    catalogue_file = args.compile is not None or args.catalogue is not None
+    if args.check_offers and (
+            args.items or batch or args.serve or catalogue_file):
+        parser.error('--check-offers cannot be used with items, --batch, '
+                     '--serve, --compile or --catalogue')
+    if args.compile is not None and args.catalogue is not None:
+        parser.error('--compile cannot be used with --catalogue')
+    if not (args.items or batch or args.serve or
+            args.compile is not None or args.check_offers):
+        parser.error('at least one item is required unless using --batch, '
+                     '--serve, --compile or --check-offers')
+    if args.items and batch:
+        parser.error('items cannot be given with --batch')
+    if args.items and args.serve:
+        parser.error('items cannot be given with --serve')
+    if args.asyncio and not args.serve:
+        parser.error('--asyncio can only be used with --serve')
+
+
+def _validate_options(parser, args):
+    """Check the options given apply to the mode asked for.
+
+    :param parser: ``argparse.ArgumentParser`` instance.
+    :param args: Parsed command line arguments.
+    """
+    if args.output_format != 'jsonl' and (
+            args.batch is None or args.simulate is not None):
+        parser.error('--output-format can only be used with --batch')
+    if args.output_format in ('parquet', 'arrow'):
+        import importlib.util  # pylint: disable=import-outside-toplevel
+        if importlib.util.find_spec('pyarrow') is None:
+            parser.error('--output-format {} requires PyArrow'.format(
+                args.output_format))
+    if args.expand_discounts and (args.batch is not None or args.serve or
+                                  args.compile is not None):
+        parser.error('--expand-discounts cannot be used with --batch, '
+                     '--serve or --compile')
+    if args.simulate is not None and args.batch is None:
+        parser.error('--simulate requires --batch')
+    if args.simulate is not None and args.catalogue is not None:
+        parser.error('--simulate cannot be used with --catalogue')
+
+
+# Options ``parse_plain_items`` accepts, and the argument each sets: those
+# taking a value, and flags
+_PLAIN_VALUES = {'--goods': 'goods', '--offers': 'offers'}
+_PLAIN_FLAGS = {'--expand-discounts': 'expand_discounts',
+                '--verbose': 'verbose'}
+
+# The arguments ``parse_args`` gives when only items and the options of
+# ``parse_plain_items`` are given, but for those
+_PLAIN_DEFAULTS = {
+    'goods': 'goods.json',
+    'offers': 'offers.json',
+    'compile': None,
+    'check_offers': False,
+    'catalogue': None,
+    'strategy': engine.ORDERED,
+    'batch': None,
+    'output_format': 'jsonl',
+    'simulate': None,
+    'workers': 1,
+    'chunk_size': 1000,
+    'cache_size': 10000,
+    'serve': False,
+    'host': '127.0.0.1',
+    'port': 8080,
+    'reload_interval': 1.0,
+    'asyncio': False,
+    'max_batch': 128,
+    'batch_window': 2.0,
+    'max_in_flight': 1024,
+    'profile': False,
+    'profile_output': None,
+    'expand_discounts': False,
+    'log_level': None,
+    'verbose': False,
+}
+
+
+def parse_plain_items(argv=None):
+    """Parse command line arguments giving only the items of a basket,
+    without ``argparse``.
+
+    Importing ``argparse`` and setting up its parser takes longer than
+    pricing a small basket, so the single basket cold path is parsed here
+    where it can be: a run of items, with any of ``--goods``, ``--offers``,
+    ``--expand-discounts`` and ``--verbose`` before or after them.
+
+    :param list argv: Args to parse, by default those of the program.
+    :return: Parsed arguments as from ``parse_args``, or None if ``argv``
+      holds anything else, to be parsed by ``parse_args``.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    parsed = dict(_PLAIN_DEFAULTS, items=[])
+    # argparse only takes the items as a single run
+    args_after_items = False
+    args = iter(argv)
+    for arg in args:
+        if not arg.startswith('-'):
+            if args_after_items:
+                return None
+            parsed['items'].append(arg)
+            continue
+        args_after_items = bool(parsed['items'])
+        if arg in _PLAIN_FLAGS:
+            parsed[_PLAIN_FLAGS[arg]] = True
+            continue
+        option, equals, value = arg.partition('=')
+        if option not in _PLAIN_VALUES:
+            return None
+        if not equals:
+            value = next(args, '-')
+            if value.startswith('-'):
+                return None
+        parsed[_PLAIN_VALUES[option]] = value
+    if not parsed['items']:
+        return None
+    return types.SimpleNamespace(**parsed)
+
+
+def load_array(json_file_path, build, build_phase='build'):
+    """Load a json file holding an array, one element at a time.
+
+    Each element is passed to ``build`` as soon as it is parsed, so only
+    what is built from the file is kept in memory rather than all its data.
+    If the file is not a valid json array nothing should be kept, as it
+    could only be partly read.
 
     :param str json_file_path: Path to json file to load.
+    :param build: Callable taking each element of the array and the
+      ``stream.ArrayReader`` reading it, whose position is that of the
+      element while ``build`` runs.
+    :param str build_phase: Name of the profiling phase building takes,
+      parsing being ``load_json``.
+    :return bool: True if the whole file was read.
     """
-    data = None
     try:
         with open(json_file_path) as f:
-            data = json.load(f)
+            reader = stream.ArrayReader(f)
+            if profiling.ACTIVE is not None:
+                build_profiled(profiling.ACTIVE, reader, build, build_phase)
+            else:
+                for element in reader:
+                    build(element, reader)
     except EnvironmentError:
-        log('No such file or directory: {}'.format(json_file_path), ERROR)
-    except ValueError as e:  # JSONDecodeError only supported from 3.5
-        log('Failed to parse data file {}: {}'.format(
-            json_file_path, e), ERROR)
+        logs.error('No such file or directory: %s', json_file_path)
+    except ValueError as e:
+        logs.error('Failed to parse data file %s: %s', json_file_path, e)
+    else:
+        return True
+    return False
+
+
+def build_profiled(profile, reader, build, build_phase):
+    """Build from each element of an array as ``load_array`` does, timing
+    parsing and building as separate phases.
+
+    :param profile: ``profiling.Profile`` to record in.
+    :param reader: ``stream.ArrayReader`` of the array.
+    :param build: Callable as for ``load_array``.
+    :param str build_phase: Name of the phase building takes.
+    """
+    parsing = building = 0.0
+    start = time.perf_counter()
+    try:
+        for element in reader:
+            parsed = time.perf_counter()
+            parsing += parsed - start
+            build(element, reader)
+            start = time.perf_counter()
+            building += start - parsed
+    finally:
+        profile.add_time('load_json', parsing)
+        profile.add_time(build_phase, building)
+
+
+def load_json(json_file_path):
+    """Load json data holding an array.
+
+    The elements are all kept, so ``load_array`` is to be preferred where
+    they are only needed one at a time.
+
+    :param str json_file_path: Path to json file to load.
+    :return list: The elements of the array, or None if the file cannot be
+      read.
+    """
+    data = []
+    if not load_array(json_file_path, lambda element, reader:
+                      data.append(element), 'load_json'):
+        return None
     return data
 
 
-def load_goods(goods_file_path):
+def load_goods(goods_file_path, names=None):
     """Load goods definitions.
 
     Load goods definition data describing the goods this program will
     accept including product names, units and price.
 
     :param str goods_file_path: Path to goods file.
-    :return dict: Dictionary of product.Product instances.
+    :param names: Optional set of the (lower case) names of the only
+      products to load.
+    :return dict: Dictionary of product.Product instances, or None if the
+      file cannot be read.
     """
     goods = {}
-    data = load_json(goods_file_path)
-    if data is None:
-        log('No stock found in goods data', INFO)
-    else:
-        # Build products list
-        for prod in data:
-            try:
-                p = product.Product(prod['name'], prod['price'], prod['unit'])
-                goods[p.name] = p
-            except ValueError as e:
-                log('Failed to load a product with data: {} ({})'.format(
-                    prod, e), ERROR)
+
+    def build(prod, reader):
+        try:
+            if names is not None and prod['name'].lower() not in names:
+                return
+            p = product.Product(prod['name'], prod['price'], prod['unit'])
+            goods[p.name] = p
+        except product.SkuLimitError:
+            # Fails the whole file rather than dropping the new products
+            raise
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logs.error('Failed to load a product with data at %s: %s (%s)',
+                       stream.position(reader), prod, e)
+
+    if not load_array(goods_file_path, build, 'build_products'):
+        return None
+    if not goods:
+        logs.info('No stock found in goods data')
     return goods
 
 
-def load_offers(offers_file_path):
+def load_offers(offers_file_path, names=None):
     """Load offers.
 
     Load offers data that specifies discounts that can be applied
     to goods purchased.
 
     :param str offers_file_path: Path to offers file.
-    :return list: List of offer.Offer instances.
+    :param names: Optional set of (lower case) product names.  If given,
+      only the offers whose qualifying and discounted products are both
+      named are loaded, as no others can apply to a basket of them.
+    :return list: List of offer.Offer instances, or None if the file cannot
+      be read.
     """
     offers = []
-    data = load_json(offers_file_path)
-    if data:
-        for prod_offer in data:
-            try:
-                offers.append(offer.Offer(prod_offer))
-            except (ValueError, KeyError) as e:
-                log('Failed to load offer with data: {} ({})'.format(
-                    prod_offer, e), ERROR)
+
+    def build(prod_offer, reader):
+        try:
+            if names is not None and not (
+                    prod_offer['qualifying_product'].lower() in names and
+                    prod_offer['discounted_product'].lower() in names):
+                return
+            offers.append(offer.Offer(prod_offer))
+        except product.SkuLimitError:
+            raise
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logs.error('Failed to load offer with data at %s: %s (%s)',
+                       stream.position(reader), prod_offer, e)
+
+    if not load_array(offers_file_path, build, 'build_offers'):
+        return None
     return offers
 
 
+def load_catalogue(goods_file_path, offers_file_path, strategy=engine.ORDERED):
+    """Load a catalogue of goods and offers.
+
+    :param str goods_file_path: Path to goods file.
+    :param str offers_file_path: Path to offers file.
+    :param str strategy: How competing offers are allocated, one of
+      ``engine.STRATEGIES``.
+    :return: ``catalogue.Catalogue`` instance.
+    """
+    # A file that cannot be read has been logged, and is taken as empty
+    goods = load_goods(goods_file_path) or {}
+    offers = load_offers(offers_file_path) or []
+    from basket import catalogue  # pylint: disable=import-outside-toplevel
+    with profiling.phase('compile_offers'):
+        return catalogue.Catalogue(goods, offers, strategy=strategy)
+
+
+def load_compiled(catalogue_file_path, strategy=engine.ORDERED):
+    """Open a binary catalogue file.
+
+    :param str catalogue_file_path: Path to a file made by
+      ``compile_catalogue``.
+    :param str strategy: How competing offers are allocated, one of
+      ``engine.STRATEGIES``.
+    :return: ``binary.MappedCatalogue`` instance, or None if the file
+      cannot be opened.
+    """
+    from basket import binary  # pylint: disable=import-outside-toplevel
+    try:
+        return binary.load(catalogue_file_path, strategy)
+    except EnvironmentError:
+        logs.error('No such file or directory: %s', catalogue_file_path)
+    except ValueError as e:
+        logs.error('Failed to open catalogue file %s: %s',
+                   catalogue_file_path, e)
+    return None
+
+
+def catalogue_loader(args):
+    """The function loading the catalogue asked for.
+
+    :param args: Parsed command line arguments.
+    :return: Picklable callable returning the catalogue, loaded from
+      ``args.catalogue`` if given and otherwise from ``args.goods`` and
+      ``args.offers``.
+    """
+    if args.catalogue is not None:
+        return functools.partial(load_compiled, args.catalogue,
+                                 args.strategy)
+    return functools.partial(load_catalogue, args.goods, args.offers,
+                             args.strategy)
+
+
+def compile_catalogue(args):
+    """Compile the goods and offers into a binary catalogue file.
+
+    :param args: Parsed command line arguments.
+    """
+    from basket import binary  # pylint: disable=import-outside-toplevel
+    goods = load_goods(args.goods)
+    offers = load_offers(args.offers)
+    if goods is None or offers is None:
+        return
+    binary.write_catalogue(args.compile, goods, offers)
+    logs.info('Compiled %d goods and %d offers into %s', len(goods),
+              len(offers), args.compile)
+
+
+def check_offers(args):
+    """Report the offers that are unavailable, shadowed or conflict.
+
+    :param args: Parsed command line arguments.
+    """
+    from basket import graph  # pylint: disable=import-outside-toplevel
+    goods = load_goods(args.goods)
+    offers = load_offers(args.offers)
+    if goods is None or offers is None:
+        return
+    with profiling.phase('analyse_offers'):
+        report = graph.OfferGraph(goods, offers, args.strategy).report()
+    print(json.dumps(report, indent=2))
+
+
+def make_cache(cache_size):
+    """Make a pricing cache.
+
+    :param int cache_size: Most baskets to cache the prices of.
+    :return: ``cache.PricingCache`` instance, or None if ``cache_size`` is 0.
+    """
+    from basket import cache  # pylint: disable=import-outside-toplevel
+    return cache.PricingCache(cache_size) if cache_size else None
+
+
+def price_batch(args, compiled=None):
+    """Price a batch of baskets.
+
+    Baskets are read from ``args.batch``, a path to a JSON lines file or
+    ``-`` to read from stdin.  With a single worker the catalogue is loaded
+    here, otherwise each worker process loads its own.
+
+    :param args: Parsed command line arguments.
+    :param compiled: ``binary.MappedCatalogue`` instance already opened
+      from ``args.catalogue`` to use here, or None to load the catalogue.
+    """
+    from basket import batch  # pylint: disable=import-outside-toplevel
+    batch_file = open_batch(args.batch)
+    if batch_file is None:
+        return
+    workers = args.workers or os.cpu_count() or 1
+    load = catalogue_loader(args)
+    # Results are written to stdout, so messages go to stderr meanwhile
+    with batch_file as f, logs.output_to('stderr'):
+        if args.output_format != 'jsonl':
+            price_batch_columns(args, f, load, workers, compiled)
+        elif workers == 1:
+            shop = load() if compiled is None else compiled
+            batch.write_results(batch.price_lines(
+                shop, f, make_cache(args.cache_size)), sys.stdout)
+        else:
+            for text in batch.price_lines_parallel(
+                    load, f, workers, args.chunk_size, args.cache_size):
+                sys.stdout.write(text)
+
+
+def open_batch(batch_path):
+    """Open the file of baskets to price.
+
+    :param str batch_path: Path to a JSON lines file, or ``-`` for stdin.
+    :return: Context manager giving the file, and leaving stdin open, or
+      None if the file cannot be opened.
+    """
+    if batch_path == '-':
+        return contextlib.nullcontext(sys.stdin)
+    try:
+        return open(batch_path)
+    except EnvironmentError:
+        logs.error('No such file or directory: %s', batch_path)
+        return None
+
+
+def price_batch_columns(args, f, load, workers, compiled=None):
+    """Price a batch of baskets, writing the results as a table to stdout.
+
+    :param args: Parsed command line arguments.
+    :param f: File of JSON lines to read baskets from.
+    :param load: Callable returning the catalogue.
+    :param int workers: Number of worker processes.
+    :param compiled: ``binary.MappedCatalogue`` instance to use here, or
+      None to call ``load``.
+    """
+    from basket import batch  # pylint: disable=import-outside-toplevel
+    from basket import columnar  # pylint: disable=import-outside-toplevel
+    # The offers decide the columns, whichever process prices the baskets
+    shop = load() if compiled is None else compiled
+    if shop is None:
+        return
+    columns = columnar.offer_columns(shop.offers)
+    if args.output_format in columnar.BINARY_FORMATS:
+        out = sys.stdout.buffer
+    else:
+        out = sys.stdout
+    with columnar.ColumnarWriter(out, columnar.column_names(shop.offers),
+                                 args.output_format) as writer:
+        if workers == 1:
+            for chunk in batch.chunk_lines(f, args.chunk_size):
+                writer.write_rows(columnar.price_rows(shop, chunk, columns))
+        else:
+            for rows in batch.price_lines_parallel(
+                    load, f, workers, args.chunk_size,
+                    task=columnar.price_chunk_rows):
+                writer.write_rows(rows)
+    out.flush()
+
+
+def simulate_offers(args):
+    """Report how replacing the offers would change the prices of a batch
+    of baskets.
+
+    The baskets are read from ``args.batch`` as for ``price_batch``, and
+    the new offers from ``args.simulate``.  The report is written to stdout
+    as JSON.
+
+    :param args: Parsed command line arguments.
+    """
+    from basket import simulate  # pylint: disable=import-outside-toplevel
+    batch_file = open_batch(args.batch)
+    if batch_file is None:
+        return
+    with batch_file as f, logs.output_to('stderr'):
+        goods = load_goods(args.goods)
+        old_offers = load_offers(args.offers)
+        new_offers = load_offers(args.simulate)
+        if goods is None or old_offers is None or new_offers is None:
+            return
+        with profiling.phase('load_history'):
+            history = simulate.load_history(goods, f)
+        with profiling.phase('simulate'):
+            report = simulate.simulate(goods, old_offers, new_offers,
+                                       history, args.strategy)
+    print(json.dumps(report, indent=2))
+
+
 def main(argv=None):
     """Program entry point.
 
@@ -153,29 +822,149 @@ def main(argv=None):
     we query ``basket`` for a sub-total, discounts that could be applied
     and total price, which is output.
 
+    With ``--profile`` all this is recorded by a ``profiling.Profile``,
+    whose summary is printed to stderr once done.
+
     :param list argv: Command line arguments.
     """
     # Parse arguments
-    args = parse_args(argv)
-    global LOGGING
-    LOGGING = args.verbose
+    args = parse_plain_items(argv)
+    if args is None:
+        args = parse_args(argv)
+    logs.configure()
+    if args.log_level is not None:
+        log_level = logs.LEVELS[args.log_level]
+    else:
+        log_level = logs.INFO if args.verbose else logs.OFF
+
+    with logs.verbosity(log_level):
+        if not args.profile:
+            run(args)
+            return
+        with profiling.Profile(args.profile_output is not None) as profile:
+            run(args)
+    print(profile.summary(), file=sys.stderr)
+    if args.profile_output is not None:
+        profile.dump_stats(args.profile_output)
+
+
+def run(args):
+    """Price the baskets asked for on the command line.
+
+    :param args: Parsed command line arguments.
+    """
+    if args.compile is not None:
+        compile_catalogue(args)
+        return
+
+    if args.check_offers:
+        check_offers(args)
+        return
+
+    compiled = None
+    if args.catalogue is not None:
+        compiled = load_compiled(args.catalogue, args.strategy)
+        if compiled is None:
+            return
+
+    if args.simulate is not None:
+        simulate_offers(args)
+    elif args.batch is not None:
+        price_batch(args, compiled)
+    elif args.serve and args.asyncio:
+        serve_async(args, serving_catalogue(args, compiled))
+    elif args.serve:
+        serve(args, serving_catalogue(args, compiled))
+    else:
+        price_items(args, compiled)
+
+
+def serving_catalogue(args, compiled):
+    """The catalogue a pricing service prices baskets with.
+
+    :param args: Parsed command line arguments.
+    :param compiled: ``binary.MappedCatalogue`` instance opened from
+      ``args.catalogue``, or None.
+    :return: Catalogue, or ``catalogue.CatalogueManager`` instance
+      reloading the goods and offers files when they change.
+    """
+    if compiled is not None:
+        return compiled  # Compiled catalogues are not reloaded
+    if args.reload_interval:
+        from basket import catalogue  # pylint: disable=import-outside-toplevel
+        return catalogue.CatalogueManager(
+            args.goods, args.offers, load_goods, load_offers,
+            args.reload_interval, args.strategy)
+    return load_catalogue(args.goods, args.offers, args.strategy)
 
-    # Load available goods and offers
-    goods = load_goods(args.goods)
-    offers = load_offers(args.offers)
 
-    # Make a basket and fill
-    shopping_basket = basket.Basket(goods, offers)
-    for item in args.items:
-        if not shopping_basket.add(item):
-            log('Item \'{}\' not in stock'.format(item), INFO)
+def serve(args, shop):
+    """Run the HTTP pricing service.
 
-    # Print the results
+    :param args: Parsed command line arguments.
+    :param shop: Catalogue to price baskets with.
+    """
+    from basket import server  # pylint: disable=import-outside-toplevel
+    logs.info('Serving on %s:%d', args.host, args.port)
+    server.serve(shop, args.host, args.port, make_cache(args.cache_size),
+                 logs.level())
+
+
+def serve_async(args, shop):
+    """Run the asyncio pricing service.
+
+    :param args: Parsed command line arguments.
+    :param shop: Catalogue to price baskets with.
+    """
+    from basket import async_server  # pylint: disable=import-outside-toplevel
+    logs.info('Serving on %s:%d', args.host, args.port)
+    async_server.serve(shop, args.host, args.port, args.max_batch,
+                       args.batch_window / 1000, args.max_in_flight,
+                       make_cache(args.cache_size))
+
+
+def price_items(args, compiled):
+    """Price the basket of the items given on the command line.
+
+    :param args: Parsed command line arguments.
+    :param compiled: ``binary.MappedCatalogue`` instance opened from
+      ``args.catalogue``, or None to load the goods and offers files.
+    """
+    # Make a basket from the available goods and offers, and fill
+    if compiled is not None:
+        shopping_basket = compiled.new_basket()
+    else:
+        # Only the goods and offers involving the items can affect the price
+        names = {item.lower() for item in args.items}
+        goods = load_goods(args.goods, names) or {}
+        offers = load_offers(args.offers, names) or []
+        with profiling.phase('compile_offers'):
+            plan = engine.compile_offers(goods, offers, args.strategy)
+            shopping_basket = basket.Basket(goods, offers, plan)
+    with profiling.phase('add_items'):
+        for item in args.items:
+            if not shopping_basket.add(item):
+                logs.info('Item \'%s\' not in stock', item)
+    with profiling.phase('calculate_discounts'):
+        shopping_basket.calculate_discounts()
+    if profiling.ACTIVE is not None:
+        profiling.ACTIVE.record_basket(shopping_basket)
+    with profiling.phase('format_output'):
+        print_receipt(shopping_basket, args.expand_discounts)
+
+
+def print_receipt(shopping_basket, expand_discounts=False):
+    """Print the subtotal, discounts and total of a basket.
+
+    :param shopping_basket: Basket whose discounts are calculated.
+    :param bool expand_discounts: Print a line per discounted item rather
+      than per distinct discount.
+    """
     print('Subtotal: £{:.2f}'.format(shopping_basket.subtotal/100))
-    shopping_basket.calculate_discounts()
-    if shopping_basket.discounted_items:
-        for item in shopping_basket.discounted_items:
-            print(item.discount_message)
+    messages = receipt.render_discounts(shopping_basket.discount_lines,
+                                        expand_discounts)
+    if messages:
+        print('\n'.join(messages))
     else:
         print('(No offers available)')
     print('Total: £{:.2f}'.format(shopping_basket.total/100))
@@ -0,0 +1,396 @@
+"""Async server module.
+
+An asyncio front end for the pricing service in ``basket.server``, for
+when many clients price baskets concurrently.  It speaks the same
+HTTP/JSON protocol (``POST /price`` and ``GET /health``) but serves every
+connection from a single event loop.
+
+Baskets arriving close together are coalesced into micro-batches by a
+``Coalescer``, which prices each batch in one pass in a worker thread,
+against one version of the shared catalogue (pricing identical baskets in
+a batch only once), leaving the event loop free to serve connections
+meanwhile.  A limit on the number of baskets in flight applies
+backpressure: once reached, no further request bodies are read from
+connections until earlier ones complete, so at most that many bodies are
+held in memory at once.
+"""
+
+import asyncio
+import contextvars
+import json
+
+from basket import batch
+from basket import logs
+from basket import server
+
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+}
+
+# Most header lines read from a request
+MAX_HEADERS = 100
+
+
+class RequestError(Exception):
+    """Raised when an HTTP request cannot be served."""
+
+    def __init__(self, status, message):
+        """
+        :param int status: HTTP status code of the error response.
+        :param str message: Error message.
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class Coalescer:
+    """Class that coalesces pricing requests into micro-batches.
+
+    A batch is priced once it holds ``max_batch`` baskets, or
+    ``batch_window`` seconds after its first basket arrived, whichever
+    comes first.
+    """
+
+    def __init__(self, catalogue, max_batch=128, batch_window=0.002,
+                 max_in_flight=1024, pricing_cache=None):
+        """
+        :param catalogue: ``catalogue.Catalogue`` to price against, or a
+          ``catalogue.CatalogueManager`` providing the current one.
+        :param int max_batch: Largest number of baskets priced together.
+        :param float batch_window: Longest time in seconds a basket waits
+          for others to join its batch.
+        :param int max_in_flight: Largest number of baskets waiting to be
+          priced before further requests are held back.
+        :param pricing_cache: Optional ``cache.PricingCache``.
+        """
+        self.catalogue = catalogue
+        self.pricing_cache = pricing_cache
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.batches = 0
+        self.baskets = 0
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def price(self, items):
+        """Price a basket as part of the next micro-batch.
+
+        Waits while ``max_in_flight`` baskets are already being priced.
+
+        :param list items: List of ``(item, quantity)`` tuples.
+        :return dict: Pricing result as from ``batch.price``.
+        """
+        async with self.in_flight:
+            return await self.submit(items)
+
+    async def submit(self, items):
+        """Price a basket as part of the next micro-batch, for a caller
+        already holding one of the ``in_flight`` slots.
+
+        :param list items: List of ``(item, quantity)`` tuples.
+        :return dict: Pricing result as from ``batch.price``.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((items, future))
+        if len(self._pending) >= self.max_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.batch_window, self.flush)
+        return await future
+
+    def flush(self):
+        """Price all pending baskets now.
+
+        :return: ``asyncio.Task`` pricing the baskets, or None if there are
+          none.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return None
+        self.batches += 1
+        self.baskets += len(pending)
+        task = asyncio.get_running_loop().create_task(
+            self._price_batch(pending))
+        # The loop only holds weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _price_batch(self, pending):
+        """Price a batch of baskets, resolving the future of each.
+
+        :param list pending: List of ``(items, future)`` tuples.
+        """
+        # Getting the catalogue can mean reloading the files, and pricing
+        # the batch holds the thread for a while, so both are done outside
+        # the event loop, in the context of the loop for its logs.  Baskets
+        # whose requests were cancelled meanwhile are not priced.
+        baskets = [None if future.done() else items
+                   for items, future in pending]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                None, contextvars.copy_context().run, self._price_all,
+                baskets)
+        except Exception as e:  # pylint: disable=broad-except
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(pending, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _price_all(self, baskets):
+        """Price baskets against one version of the catalogue.
+
+        :param list baskets: List of lists of ``(item, quantity)`` tuples,
+          or None in place of a basket not to price.
+        :return list: The pricing result of each basket as from
+          ``batch.price``, or the exception raised pricing it.
+        """
+        shop = self.catalogue.current()
+        priced = {}
+        results = []
+        for items in baskets:
+            if items is None:
+                results.append(None)
+                continue
+            key = tuple(items)
+            if key not in priced:
+                try:
+                    priced[key] = batch.price(shop, items,
+                                              self.pricing_cache)
+                except Exception as e:  # pylint: disable=broad-except
+                    priced[key] = e
+            results.append(priced[key])
+        return results
+
+
+class AsyncPricingServer:
+    """Asyncio HTTP server pricing baskets against a shared catalogue."""
+
+    def __init__(self, coalescer):
+        """
+        :param coalescer: ``Coalescer`` pricing the baskets received.
+        """
+        self.coalescer = coalescer
+
+    async def respond(self, method, path, body):
+        """Respond to a request.
+
+        Baskets are priced with ``Coalescer.submit``, so the caller must
+        hold one of the coalescer's ``in_flight`` slots for a ``POST``.
+
+        :param str method: HTTP method.
+        :param str path: Request path.
+        :param bytes body: Request body.
+        :return tuple: HTTP status code and response data.
+        """
+        if method == 'GET' and path == '/health':
+            return 200, {'status': 'ok'}
+        if method != 'POST' or path != '/price':
+            return 404, {'error': 'Not found'}
+        try:
+            text = body.decode('utf-8')
+        except UnicodeDecodeError:
+            return 400, {'error': 'Basket is not UTF-8 encoded'}
+        try:
+            basket_id, items = batch.parse_basket(text)
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        try:
+            priced = await self.coalescer.submit(items)
+        except Exception as e:  # pylint: disable=broad-except
+            logs.error('Failed to price basket %s: %s', basket_id, e)
+            return 500, {'error': 'Failed to price basket'}
+        result = {'id': basket_id}
+        result.update(priced)
+        return 200, result
+
+    async def handle_connection(self, reader, writer):
+        """Serve the requests made on a connection until it is closed.
+
+        :param reader: ``asyncio.StreamReader`` of the connection.
+        :param writer: ``asyncio.StreamWriter`` of the connection.
+        """
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await read_head(reader)
+                    if head is None:
+                        break
+                    method, path, headers, keep_alive = head
+                    status, data = await self.serve_request(
+                        reader, method, path, headers)
+                except RequestError as e:
+                    status, data = e.status, {'error': str(e)}
+                    keep_alive = False
+                writer.write(format_response(status, data, keep_alive))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve_request(self, reader, method, path, headers):
+        """Read the body of a request and respond to it.
+
+        A ``POST`` body is only read once an ``in_flight`` slot is free, and
+        the slot is held until its basket is priced.  Any other body is
+        read and discarded, so the next request on the connection starts
+        where expected.
+
+        :param reader: ``asyncio.StreamReader`` of the connection.
+        :param str method: HTTP method.
+        :param str path: Request path.
+        :param dict headers: Request headers, with lower case names.
+        :return tuple: HTTP status code and response data.
+        :raises: RequestError if the body cannot be read.
+        """
+        if method != 'POST':
+            await read_body(reader, headers, required=False)
+            return await self.respond(method, path, b'')
+        async with self.coalescer.in_flight:
+            body = await read_body(reader, headers)
+            return await self.respond(method, path, body)
+
+    async def start(self, host='127.0.0.1', port=8080):
+        """Start listening for connections.
+
+        :param str host: Host address to listen on.
+        :param int port: Port to listen on.
+        :return: ``asyncio.Server`` instance.
+        """
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+async def read_head(reader):
+    """Read the request line and headers of an HTTP request.
+
+    :param reader: ``asyncio.StreamReader`` to read from.
+    :return: None at the end of the stream, otherwise a tuple of the
+      method, path, headers (with lower case names) and whether to keep
+      the connection alive.
+    :raises: RequestError if the request cannot be served.
+    """
+    try:
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        try:
+            method, path, version = request_line.decode('latin-1').split()
+        except ValueError:
+            raise RequestError(400, 'Malformed request line') from None
+        headers = {}
+        for _ in range(MAX_HEADERS + 1):
+            line = await reader.readline()
+            if not line.strip():
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise RequestError(431, 'Too many headers')
+    except ValueError as e:  # A line exceeded the reader's limit
+        raise RequestError(400, 'Request line too long') from e
+    keep_alive = (version == 'HTTP/1.1' and
+                  headers.get('connection', '').lower() != 'close')
+    return method, path, headers, keep_alive
+
+
+async def read_body(reader, headers, required=True):
+    """Read the body of an HTTP request.
+
+    :param reader: ``asyncio.StreamReader`` to read from.
+    :param dict headers: Request headers, with lower case names.
+    :param bool required: Whether a ``Content-Length`` must be given.  If
+      not, a request without one has no body.
+    :return bytes: The body.
+    :raises: RequestError if the body cannot be read.
+    """
+    if not required and 'content-length' not in headers:
+        return b''
+    try:
+        length = int(headers.get('content-length', ''))
+    except ValueError:
+        raise RequestError(411, 'Content-Length required') from None
+    if length < 0:
+        raise RequestError(400, 'Invalid Content-Length')
+    if length > server.MAX_BODY_SIZE:
+        raise RequestError(413, 'Basket too large')
+    return await reader.readexactly(length)
+
+
+def format_response(status, data, keep_alive):
+    """Format an HTTP response.
+
+    :param int status: HTTP status code.
+    :param dict data: Response data.
+    :param bool keep_alive: Whether the connection is kept open.
+    :return bytes: The response.
+    """
+    body = json.dumps(data).encode('utf-8')
+    head = ('HTTP/1.1 {} {}\r\n'
+            'Server: basket/0.1\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: {}\r\n'
+            'Connection: {}\r\n\r\n').format(
+                status, REASONS[status], len(body),
+                'keep-alive' if keep_alive else 'close')
+    return head.encode('latin-1') + body
+
+
+async def run(catalogue, host='127.0.0.1', port=8080, max_batch=128,
+              batch_window=0.002, max_in_flight=1024, pricing_cache=None):
+    """Serve pricing requests forever.
+
+    :param catalogue: ``catalogue.Catalogue`` to price against, or a
+      ``catalogue.CatalogueManager`` providing the current one.
+    :param str host: Host address to listen on.
+    :param int port: Port to listen on.
+    :param int max_batch: Largest number of baskets priced together.
+    :param float batch_window: Longest time in seconds a basket waits for
+      others to join its batch.
+    :param int max_in_flight: Largest number of baskets waiting to be
+      priced before further requests are held back.
+    :param pricing_cache: Optional ``cache.PricingCache``.
+    """
+    coalescer = Coalescer(catalogue, max_batch, batch_window, max_in_flight,
+                          pricing_cache)
+    pricing_server = await AsyncPricingServer(coalescer).start(host, port)
+    async with pricing_server:
+        await pricing_server.serve_forever()
+
+
+def serve(catalogue, host='127.0.0.1', port=8080, max_batch=128,
+          batch_window=0.002, max_in_flight=1024, pricing_cache=None):
+    """Serve pricing requests until interrupted.
+
+    See ``run`` for a description of the parameters.
+    """
+    try:
+        asyncio.run(run(catalogue, host, port, max_batch, batch_window,
+                        max_in_flight, pricing_cache))
+    except KeyboardInterrupt:
+        pass
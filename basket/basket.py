@@ -2,90 +2,363 @@
 
 import copy
 
+from basket import engine
+from basket import receipt
+
+
+class LineItem:
+    """Class that encapsulates a product held in a basket in some quantity.
+
+    Each product is held once regardless of how many units are bought.
+    Discounts are allocated to units as ``[product, quantity]`` pairs,
+    where ``product`` is a copy of the product with the offer applied that
+    is shared by every unit receiving that offer.
+    """
+
+    __slots__ = ('product', 'quantity', 'allocations', '_discounted')
+
+    def __init__(self, product):
+        """
+        :param product: The ``product.Product`` being purchased.
+        """
+        self.product = product
+        self.quantity = 0
+        self.allocations = ()
+        self._discounted = None
+
+    def _discounted_product(self, offer):
+        """A copy of the product with an offer applied.
+
+        :param offer: ``offer.Offer`` instance.
+        :return: ``product.Product`` instance shared by every unit of this
+          line receiving the offer.
+        """
+        if self._discounted is None:
+            self._discounted = {}
+        try:
+            return self._discounted[offer]
+        except KeyError:
+            discounted = copy.copy(self.product)
+            discounted.apply_offer(offer)
+            self._discounted[offer] = discounted
+            return discounted
+
+    def allocate(self, allocation):
+        """Allocate offers to the leading units of this line.
+
+        Replaces any offers previously applied.
+
+        :param list allocation: ``(rule, quantity)`` tuples covering the
+          leading units in order, as from ``engine.PricingPlan.allocate``.
+        """
+        self.allocations = tuple(
+            [self._discounted_product(rule.offer), quantity]
+            for rule, quantity in allocation)
+
+    def apply_offer(self, offer, quantity):
+        """Apply an offer to the first ``quantity`` units of this line.
+
+        As with ``product.Product.apply_offer``, a later offer replaces any
+        offer previously applied to the same units.
+
+        :param offer: ``offer.Offer`` instance.
+        :param int quantity: Number of units to discount.
+        """
+        quantity = min(quantity, self.quantity)
+        if quantity <= 0:
+            return
+        discounted = self._discounted_product(offer)
+
+        # Trim the units now covered by this offer from the allocations
+        # already made, which always cover the leading units of the line.
+        remaining = quantity
+        allocations = [[discounted, quantity]]
+        for allocation in self.allocations:
+            if allocation[1] <= remaining:
+                remaining -= allocation[1]
+                continue
+            allocations.append([allocation[0], allocation[1] - remaining])
+            remaining = 0
+        self.allocations = tuple(allocations)
+
+    def clear_offer(self):
+        """Remove any offers applied to this line."""
+        self.allocations = ()
+
+    @property
+    def discounted_items(self):
+        """Returns a list of discounted units.
+
+        :return: List with one (shared) product per discounted unit.
+        """
+        items = []
+        for discounted, quantity in self.allocations:
+            items.extend([discounted] * quantity)
+        return items
+
+    @property
+    def discount_amount(self):
+        """The amount of discount earned across all units.
+
+        :return: Discount amount in pence.
+        """
+        return sum(discounted.discount_amount * quantity
+                   for discounted, quantity in self.allocations)
+
+    @property
+    def total(self):
+        """The price of all units with discounts applied.
+
+        :return: Price in pence.
+        """
+        return self.subtotal - self.discount_amount
+
+    @property
+    def subtotal(self):
+        """The price of all units without discounts applied.
+
+        :return: Price in pence.
+        """
+        return self.product.price * self.quantity
+
 
 class Basket:
-    """Class that encapsulates a basket of goods to be purchased."""
-    def __init__(self, goods, offers):
+    """Class that encapsulates a basket of goods to be purchased.
+
+    The allocation of offers is kept up to date as items are added and
+    removed, re-evaluating only the offers involving the product changed
+    (see ``engine.Allocator``).  ``calculate_discounts`` then only has to
+    apply the allocations that have changed since it was last called.  With
+    the ``engine.EXCLUSIVE`` strategy the allocation is instead solved for
+    the whole basket when ``calculate_discounts`` is called.
+    """
+    def __init__(self, goods, offers, plan=None, debug=False):
         """
         :param dict goods: The goods available.
         :param list offers: The offers available.
+        :param plan: Optional ``engine.PricingPlan`` compiled from ``goods``
+          and ``offers``.  Supply one when pricing many baskets against the
+          same goods and offers so that they are only compiled once.
+        :param bool debug: Verify the discounts against a full
+          recalculation each time they are calculated.
         :return: None
         """
         self.goods = goods
         self.offers = offers
-        self.items = []
+        if plan is None:
+            plan = engine.compile_offers(goods, offers)
+        self.plan = plan
+        self.debug = debug
+        self.items = {}
         self.discounts = []
+        # [SKU id, quantity] runs of units in the order they were added
+        self._runs = []
+        self._allocator = plan.new_allocator()
+        self._changed = set()
+        self._subtotal = 0
+        self._discount = 0
 
     def calculate_discounts(self):
         """Calculate discounts.
 
-        Determine what the discounts are based on the current list if items.
-        First we reset any previously calculated discounts on products in
-        ``self.items``.  The for each offer we ascertain the number of
-        qualifying items and how that translates into discounts to apply.
-        Finally we assemble a list of products to apply the discounts to
-        and apply as many discounts as we have qualified for in this
-        particular offer.
+        Determine what the discounts are based on the current items.
+        The allocation of offers to units has been maintained by ``add``
+        and ``remove``, so only the lines whose allocations have changed
+        since discounts were last calculated need their discounts replaced.
         """
-        # Clear any previously applied offers
-        for p in self.items:
-            p.clear_offer()
+        allocator = self._allocator
+        self._changed |= allocator.settle()
+        allocations = allocator.allocations
+        for sku in self._changed:
+            line = self.items.get(sku)
+            if line is not None:
+                line.allocate(allocations.get(sku, ()))
+        self._changed.clear()
+        self._discount = allocator.discount
+        if self.debug:
+            self.verify_discounts()
 
-        for offer in self.offers:
-            # Do we have enough qualifying products for this offer?
-            qualifying = [p for p in self.items
-                          if p.name == offer.qualifying_product]
-            qty_qualifying = len(qualifying)
+    def verify_discounts(self):
+        """Verify the discounts against a full recalculation.
 
-            # And how many times can we apply the discount?
-            num_discounts = qty_qualifying // offer.qualifying_qty
-
-            if not num_discounts:
-                continue
-
-            # Apply discounts to each product discounted in the offer,
-            # up to the number of discounts earned (note the discounted
-            # product might not be the qualifying product).
-            prods_nominated_discount = [p for p in self.items
-                                        if p.name == offer.discounted_product]
-
-            for prod in prods_nominated_discount:
-                prod.apply_offer(offer)
-                num_discounts -= 1
-                if not num_discounts:
-                    break
+        :raises: AssertionError if the discounts calculated differ from
+          those of ``engine.PricingPlan.allocate``.
+        """
+        counts = {sku: line.quantity for sku, line in self.items.items()}
+        allocations = self.plan.allocate(counts)
+        if allocations != self._allocator.allocations:
+            raise AssertionError('Discounts differ from a full recalculation')
+        for sku, line in self.items.items():
+            expected = [(rule.offer, qty)
+                        for rule, qty in allocations.get(sku, ())]
+            actual = [(p._offer, qty)  # pylint: disable=protected-access
+                      for p, qty in line.allocations]
+            if expected != actual:
+                raise AssertionError(
+                    'Discounts on {} differ from a full recalculation'.format(
+                        line.product.name))
+        expected_total = (self.plan.subtotal(counts) -
+                          self.plan.discount(allocations))
+        if self.total != expected_total:
+            raise AssertionError(
+                'Total {} differs from a full recalculation ({})'.format(
+                    self.total, expected_total))
 
-    def add(self, item):
+    def add(self, item, quantity=1):
         """Add an item to the basket.
 
-        Adds a product to the list if it is in stock.  We take a
-        shallow copy of the corresponding item in the supplied goods list.
+        Adds a product to the basket if it is in stock.  Each product is
+        held once, on a ``LineItem`` (keyed by the product's SKU id)
+        recording the quantity purchased.
 
         :param str item: The name of an item to be added to the basket.
+        :param int quantity: The number of units to add.
         :return: True if the item is added and False otherwise.
+        :raises: ValueError if the quantity is less than 1.
         """
+        if quantity < 1:
+            raise ValueError('Unacceptable quantity for {}: {!r}'.format(
+                item, quantity))
         try:
-            self.items.append(copy.copy(self.goods[item.lower()]))
+            prod = self.goods[item.lower()]
         except KeyError:
             return False
+        try:
+            line = self.items[prod.sku]
+        except KeyError:
+            line = self.items[prod.sku] = LineItem(prod)
+            # A new line has no allocations yet, even if the product's
+            # allocation is unchanged since it was last removed
+            self._changed.add(prod.sku)
+        line.quantity += quantity
+        runs = self._runs
+        if runs and runs[-1][0] == prod.sku:
+            runs[-1][1] += quantity
+        else:
+            runs.append([prod.sku, quantity])
+        self._subtotal += prod.price * quantity
+        self._changed |= self._allocator.set_quantity(prod.sku, line.quantity)
         return True
 
+    def remove(self, item, quantity=1):
+        """Remove an item from the basket.
+
+        Removes up to ``quantity`` units of a product, the last added
+        first, and the product's line once no units are left.
+
+        :param str item: The name of an item to be removed from the basket.
+        :param int quantity: The number of units to remove.
+        :return: True if the item is removed and False if it is not in the
+          basket.
+        :raises: ValueError if the quantity is less than 1.
+        """
+        if quantity < 1:
+            raise ValueError('Unacceptable quantity for {}: {!r}'.format(
+                item, quantity))
+        prod = self.goods.get(item.lower())
+        line = None if prod is None else self.items.get(prod.sku)
+        if line is None:
+            return False
+        quantity = min(quantity, line.quantity)
+        line.quantity -= quantity
+        self._remove_units(prod.sku, quantity)
+        if not line.quantity:
+            del self.items[prod.sku]
+            self._changed.add(prod.sku)
+        self._subtotal -= prod.price * quantity
+        self._changed |= self._allocator.set_quantity(prod.sku, line.quantity)
+        return True
+
+    def _remove_units(self, sku, quantity):
+        """Remove the last added units of a product from the runs of units.
+
+        :param int sku: SKU id of the product.
+        :param int quantity: Number of units to remove.
+        """
+        runs = self._runs
+        for index in range(len(runs) - 1, -1, -1):
+            if not quantity:
+                break
+            run = runs[index]
+            if run[0] != sku:
+                continue
+            removed = min(quantity, run[1])
+            run[1] -= removed
+            quantity -= removed
+            if not run[1]:
+                del runs[index]
+                # Join the runs either side if of the same product
+                if 0 < index < len(runs) and (
+                        runs[index - 1][0] == runs[index][0]):
+                    runs[index - 1][1] += runs.pop(index)[1]
+
+    def _unit_allocations(self):
+        """The discounted products of the basket, in the order the units
+        they discount were added.
+
+        :return list: ``[SKU id, product, quantity]`` lists, as from
+          ``receipt.unit_order``.
+        """
+        return receipt.unit_order(
+            self._runs, {sku: line.allocations
+                         for sku, line in self.items.items()
+                         if line.allocations})
+
+    @property
+    def statistics(self):
+        """Counts of the work done maintaining the basket's discounts.
+
+        :return dict: The number of changes of quantity made to the
+          basket's lines (``items_scanned``), of offers evaluated as a
+          result (``offers_evaluated``), and the offers currently applied
+          (``offers_applied``), in the order of the offers.
+        """
+        allocator = self._allocator
+        rules = sorted({rule.position: rule
+                        for allocation in allocator.allocations.values()
+                        for rule, _ in allocation}.items())
+        return {
+            'items_scanned': allocator.updates,
+            'offers_evaluated': allocator.evaluated,
+            'offers_applied': [rule.offer for _, rule in rules],
+        }
+
     @property
     def discounted_items(self):
         """Returns a list of discounted items.
 
         :return: List of items in the basket with discounts applied
-          (if any).
+          (if any), one per discounted unit, in the order the units were
+          added.
         """
-        return [p for p in self.items if p.has_offer]
+        items = []
+        for _, discounted, quantity in self._unit_allocations():
+            items.extend([discounted] * quantity)
+        return items
+
+    @property
+    def discount_lines(self):
+        """Returns the discounts given, as lines of a receipt.
+
+        :return: List of ``receipt.DiscountLine`` instances for
+          ``receipt.render_discounts``, in the order the units they discount
+          were added.
+        """
+        items = self.items
+        return [receipt.DiscountLine(items[sku].product, discounted.offer,
+                                     quantity, discounted.discount_amount)
+                for sku, discounted, quantity in self._unit_allocations()]
 
     @property
     def total(self):
         """The total price of the basket with discounts applied.
 
+        Discounts are those found when ``calculate_discounts`` was last
+        called.
+
         :return: Price in pence.
         """
-        return sum(product.discounted_price for product in self.items)
+        return self._subtotal - self._discount
 
     @property
     def subtotal(self):
@@ -93,4 +366,4 @@ class Basket:
 
         :return: Price in pence.
         """
-        return sum(product.price for product in self.items)
+        return self._subtotal
@@ -0,0 +1,290 @@
+"""Batch module.
+
+Prices a stream of baskets against a single loaded catalogue.  Baskets
+are read as JSON lines, each being either a list of item names or an
+object with an ``items`` member (a list of item names or a mapping of
+item name to quantity) and an optional ``id``.  One JSON result line is
+written per basket, in input order.
+
+Large batches can be spread across a pool of worker processes with
+``price_lines_parallel``.  Each worker loads its own catalogue once and
+prices chunks of lines, and only a bounded number of chunks are in flight
+at any time so that inputs larger than memory can be streamed through.
+"""
+
+import collections
+import itertools
+import json
+import multiprocessing
+
+from basket import cache
+from basket import logs
+from basket import profiling
+
+
+# Most units a basket may hold.  A discount message is given per unit
+# discounted, so this bounds the work and memory a single basket can take.
+MAX_UNITS = 10000
+
+
+def parse_basket(line):
+    """Parse a basket from a JSON line.
+
+    :param str line: JSON text of the basket.
+    :return: Tuple of the basket id (or None) and a list of
+      ``(item, quantity)`` tuples.
+    :raises: ValueError if the line does not describe a basket, or the
+      basket holds more than ``MAX_UNITS`` units.
+    """
+    data = json.loads(line)
+    basket_id = None
+    if isinstance(data, dict):
+        basket_id = data.get('id')
+        data = data.get('items')
+    if isinstance(data, dict):
+        items = list(data.items())
+    elif isinstance(data, list):
+        items = [(item, 1) for item in data]
+    else:
+        raise ValueError('Basket has no list of items')
+    units = 0
+    for item, quantity in items:
+        if not isinstance(item, str):
+            raise ValueError('Unacceptable item: {!r}'.format(item))
+        if (isinstance(quantity, bool) or not isinstance(quantity, int)
+                or quantity < 1):
+            raise ValueError('Unacceptable quantity for {}: {!r}'.format(
+                item, quantity))
+        units += quantity
+        if units > MAX_UNITS:
+            raise ValueError('Basket holds more than {} units'.format(
+                MAX_UNITS))
+    return basket_id, items
+
+
+def price(catalogue, items, pricing_cache=None):
+    """Price a basket of items.
+
+    :param catalogue: ``catalogue.Catalogue`` to price against.
+    :param list items: List of ``(item, quantity)`` tuples.
+    :param pricing_cache: Optional ``cache.PricingCache`` to look the
+      basket up in before pricing it.
+    :return dict: The subtotal and total (in pence), the discount
+      messages and any items not in stock.
+    """
+    if pricing_cache is not None:
+        return pricing_cache.price(catalogue, items)
+    if profiling.ACTIVE is not None:
+        return _price_profiled(profiling.ACTIVE, catalogue, items)
+    priced = catalogue.price(items)
+    return {
+        'subtotal': priced.subtotal,
+        'discounts': priced.discounts,
+        'total': priced.total,
+        'unknown': list(priced.unknown),
+    }
+
+
+def _price_profiled(profile, catalogue, items):
+    """Price a basket of items as ``price`` does, recording each phase.
+
+    :param profile: ``profiling.Profile`` to record in.
+    :param catalogue: ``catalogue.Catalogue`` to price against.
+    :param list items: List of ``(item, quantity)`` tuples.
+    :return dict: As from ``price``.
+    """
+    shopping_basket = catalogue.new_basket()
+    unknown = []
+    with profile.phase('add_items'):
+        for item, quantity in items:
+            if not shopping_basket.add(item, quantity):
+                unknown.append(item)
+    with profile.phase('calculate_discounts'):
+        shopping_basket.calculate_discounts()
+    with profile.phase('format_output'):
+        result = {
+            'subtotal': shopping_basket.subtotal,
+            'discounts': [p.discount_message
+                          for p in shopping_basket.discounted_items],
+            'total': shopping_basket.total,
+            'unknown': unknown,
+        }
+    profile.record_basket(shopping_basket)
+    return result
+
+
+def parse_line(line_no, line):
+    """Parse a basket from a numbered JSON line, logging a line that cannot
+    be parsed.
+
+    :param int line_no: Line number, used as the id of baskets without one.
+    :param str line: JSON text of the basket.
+    :return: Tuple of the basket id and a list of ``(item, quantity)``
+      tuples.
+    :raises: ValueError if the line does not describe a basket.
+    """
+    try:
+        basket_id, items = parse_basket(line)
+    except ValueError as e:  # JSONDecodeError is a ValueError
+        logs.warning_limited('Failed to parse basket on line %d: %s',
+                             line_no, e, key='parse')
+        raise
+    return line_no if basket_id is None else basket_id, items
+
+
+def log_unknown(basket_id, unknown):
+    """Log the items of a basket that are not in stock, if any.
+
+    :param basket_id: Id of the basket.
+    :param unknown: Items not in stock.
+    """
+    if unknown:
+        logs.warning_limited('Items not in stock in basket %s: %s',
+                             basket_id, ', '.join(unknown), key='unknown')
+
+
+def price_line(catalogue, line_no, line, pricing_cache=None):
+    """Price a basket given as a JSON line.
+
+    :param catalogue: ``catalogue.Catalogue`` to price against.
+    :param int line_no: Line number, used as the id of baskets without one.
+    :param str line: JSON text of the basket.
+    :param pricing_cache: Optional ``cache.PricingCache``.
+    :return dict: Result including the basket ``id``, or an ``error``
+      message if the line could not be parsed.
+    """
+    try:
+        basket_id, items = parse_line(line_no, line)
+    except ValueError as e:
+        return {'id': None, 'line': line_no, 'error': str(e)}
+    result = {'id': basket_id}
+    result.update(price(catalogue, items, pricing_cache))
+    log_unknown(basket_id, result['unknown'])
+    return result
+
+
+def price_lines(catalogue, lines, pricing_cache=None):
+    """Price baskets given as JSON lines, skipping blank lines.
+
+    :param catalogue: ``catalogue.Catalogue`` to price against.
+    :param lines: Iterable of JSON lines, e.g. an open file.
+    :param pricing_cache: Optional ``cache.PricingCache``.
+    :return: Generator of result dicts, in input order.
+    """
+    for line_no, line in enumerate(lines, 1):
+        if line.strip():
+            yield price_line(catalogue, line_no, line, pricing_cache)
+
+
+def write_results(results, out):
+    """Write results as JSON lines.
+
+    :param results: Iterable of result dicts.
+    :param out: File like object to write to.
+    :return int: Number of results written.
+    """
+    count = 0
+    for result in results:
+        out.write(json.dumps(result) + '\n')
+        count += 1
+    return count
+
+
+def format_results(results):
+    """Format results as JSON lines.
+
+    :param results: Iterable of result dicts.
+    :return str: JSON lines text, one line per result.
+    """
+    return ''.join(json.dumps(result) + '\n' for result in results)
+
+
+def chunk_lines(lines, chunk_size):
+    """Group numbered non-blank lines into chunks.
+
+    :param lines: Iterable of JSON lines.
+    :param int chunk_size: Maximum number of lines per chunk.
+    :return: Generator of lists of ``(line_no, line)`` tuples.
+    """
+    numbered = ((line_no, line) for line_no, line in enumerate(lines, 1)
+                if line.strip())
+    while True:
+        chunk = list(itertools.islice(numbered, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# The catalogue and pricing cache (if any) of a worker process, made once
+# by ``_init_worker``.
+_WORKER_CATALOGUE = None
+_WORKER_CACHE = None
+
+def _init_worker(load_catalogue, cache_size, log_level=logs.OFF,
+                 log_output='stdout', configure_logs=False):
+    """Worker process initializer.
+
+    :param load_catalogue: Callable returning a ``catalogue.Catalogue``.
+    :param int cache_size: Size of the worker's pricing cache, 0 for none.
+    :param int log_level: Log level of the worker, see ``logs``.
+    :param str log_output: Stream the worker logs to, see ``logs``.
+    :param bool configure_logs: Set up the logger with ``logs.configure``,
+      as a worker not forked from the caller does not inherit it.
+    """
+    # pylint: disable=global-statement
+    global _WORKER_CATALOGUE, _WORKER_CACHE
+    if configure_logs:
+        logs.configure()
+    logs.set_verbosity(log_level)
+    logs.set_output(log_output)
+    _WORKER_CATALOGUE = load_catalogue()
+    _WORKER_CACHE = cache.PricingCache(cache_size) if cache_size else None
+
+
+def _price_chunk(chunk, task=None):
+    """Price a chunk of lines in a worker process.
+
+    :param list chunk: List of ``(line_no, line)`` tuples.
+    :param task: Callable pricing the chunk in place of the default, as
+      for ``price_lines_parallel``.
+    :return: JSON lines text of the results, or the result of ``task``.
+    """
+    if task is not None:
+        return task(_WORKER_CATALOGUE, chunk)
+    return format_results(
+        price_line(_WORKER_CATALOGUE, line_no, line, _WORKER_CACHE)
+        for line_no, line in chunk)
+
+
+def price_lines_parallel(load_catalogue, lines, workers, chunk_size=1000,
+                         cache_size=0, task=None):
+    """Price baskets given as JSON lines using a pool of processes.
+
+    :param load_catalogue: Picklable callable returning a
+      ``catalogue.Catalogue``, called once by each worker process.
+    :param lines: Iterable of JSON lines, e.g. an open file.
+    :param int workers: Number of worker processes.
+    :param int chunk_size: Number of lines priced per task.
+    :param int cache_size: Size of each worker's ``cache.PricingCache``,
+      0 for none.
+    :param task: Optional picklable callable taking a worker's catalogue
+      and a list of ``(line_no, line)`` tuples, and returning the results
+      for them in place of JSON lines text, e.g.
+      ``columnar.price_chunk_rows``.
+    :return: Generator of JSON lines text, or the results of ``task``, one
+      per chunk, in input order.
+    """
+    # At most two chunks per worker are queued or awaiting collection, which
+    # keeps the workers busy while bounding memory use.
+    max_pending = 2 * workers
+    # Workers log as the caller does
+    with multiprocessing.Pool(workers, _init_worker,
+                              (load_catalogue, cache_size, logs.level(),
+                               logs.output(), logs.configured())) as pool:
+        pending = collections.deque()
+        for chunk in chunk_lines(lines, chunk_size):
+            pending.append(pool.apply_async(_price_chunk, (chunk, task)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
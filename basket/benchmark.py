@@ -0,0 +1,431 @@
+"""Benchmark module.
+
+Times the pricing hot paths against a synthetic catalogue of configurable
+size: loading the goods and offers files, adding items to baskets,
+calculating discounts, totalling baskets and pricing a basket end to end
+with ``main``.  Baskets are generated with a long tailed distribution of
+sizes, mostly of a few items, and with some products far more popular than
+others.
+
+Start-up is measured too, as the time taken to run ``python -m basket``
+for one basket over that taken by the interpreter to start.  It should stay
+within ``STARTUP_BUDGET``.
+
+Results are written as JSON so that runs can be kept and compared, e.g.::
+
+    python -m basket.benchmark --output before.json
+    python -m basket.benchmark --compare before.json
+
+which exits with status 1 if any benchmark is slower than the baseline by
+more than ``--threshold``, or start-up is over budget.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from basket import __main__ as main
+
+
+# Most seconds pricing a basket from the command line may take over the
+# time taken by the interpreter to start.  It took 16ms (best of 20 runs,
+# Python 3.11), so this leaves room for slower machines.
+STARTUP_BUDGET = 0.03
+
+
+def make_goods(num_goods, rng):
+    """Make synthetic goods data.
+
+    :param int num_goods: Number of products.
+    :param rng: ``random.Random`` instance.
+    :return list: Product dicts as found in a goods file.
+    """
+    units = ['Tin', 'Loaf', 'Bottle', 'Bag', 'Bunch', 'Box', 'Jar', 'Pack']
+    return [{'name': 'Product{:05d}'.format(i),
+             'price': rng.randint(10, 2000),
+             'unit': rng.choice(units)}
+            for i in range(num_goods)]
+
+
+def make_offers(goods, num_offers, rng):
+    """Make synthetic offers data.
+
+    Half the offers discount the product bought, like "Apples 10% off", and
+    half discount another product when enough of one is bought, like "2
+    tins soup get you a half price loaf".
+
+    :param list goods: Product dicts, as from ``make_goods``.
+    :param int num_offers: Number of offers.
+    :param rng: ``random.Random`` instance.
+    :return list: Offer dicts as found in an offers file.
+    """
+    offers = []
+    for i in range(num_offers):
+        qualifying = rng.choice(goods)['name']
+        if i % 2:
+            discounted = rng.choice(goods)['name']
+            qualifying_qty = rng.randint(2, 4)
+        else:
+            discounted = qualifying
+            qualifying_qty = 1
+        offers.append({
+            'id': i + 1,
+            'title': 'Offer {}'.format(i + 1),
+            'qualifying_product': qualifying,
+            'qualifying_qty': qualifying_qty,
+            'discounted_product': discounted,
+            'discount_percent': rng.choice([5, 10, 20, 25, 33, 50]),
+        })
+    return offers
+
+
+def make_baskets(goods, num_baskets, rng, median_size=8, max_size=200):
+    """Make synthetic baskets.
+
+    Basket sizes are log-normally distributed and products are chosen with
+    a Zipf-like popularity, so a few products appear in most baskets.
+
+    :param list goods: Product dicts, as from ``make_goods``.
+    :param int num_baskets: Number of baskets.
+    :param rng: ``random.Random`` instance.
+    :param int median_size: Median number of items in a basket.
+    :param int max_size: Largest number of items in a basket.
+    :return list: Lists of item names.
+    """
+    names = [g['name'].lower() for g in goods]
+    weights = [1.0 / rank for rank in range(1, len(names) + 1)]
+    baskets = []
+    for _ in range(num_baskets):
+        size = int(rng.lognormvariate(0, 0.8) * median_size)
+        size = max(1, min(size, max_size))
+        baskets.append(rng.choices(names, weights, k=size))
+    return baskets
+
+
+def measure(func, repeat, setup=None):
+    """Time a function.
+
+    :param func: Callable to time.  It is called with the value returned
+      by ``setup`` if given, and with no arguments otherwise.
+    :param int repeat: Number of times to call ``func``.
+    :param setup: Optional callable run, untimed, before each call of
+      ``func``.
+    :return list: Seconds taken by each call.
+    """
+    times = []
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times, ops):
+    """Summarize the times taken by a benchmark.
+
+    :param list times: Seconds taken by each run.
+    :param int ops: Number of operations performed by each run.
+    :return dict: The fastest and mean run times in seconds, and the
+      fastest time per operation in microseconds.
+    """
+    best = min(times)
+    return {
+        'ops': ops,
+        'runs': len(times),
+        'best': best,
+        'mean': sum(times) / len(times),
+        'per_op_us': best / ops * 1e6 if ops else 0.0,
+    }
+
+
+def new_baskets(shop, baskets):
+    """Make an empty basket for each basket of items.
+
+    :param shop: ``catalogue.Catalogue`` to make the baskets from.
+    :param list baskets: Lists of item names.
+    :return list: ``basket.Basket`` instances.
+    """
+    return [shop.new_basket() for _ in baskets]
+
+
+def fill(filled, baskets):
+    """Add the items of each basket to a basket made for it.
+
+    :param list filled: ``basket.Basket`` instances, as from
+      ``new_baskets``.
+    :param list baskets: Lists of item names.
+    :return list: The baskets filled.
+    """
+    for shopping_basket, items in zip(filled, baskets):
+        for item in items:
+            shopping_basket.add(item)
+    return filled
+
+
+def calculate_discounts(filled):
+    """Calculate the discounts of baskets.
+
+    :param list filled: ``basket.Basket`` instances.
+    :return list: The baskets.
+    """
+    for shopping_basket in filled:
+        shopping_basket.calculate_discounts()
+    return filled
+
+
+def total(filled):
+    """Total baskets.
+
+    :param list filled: ``basket.Basket`` instances.
+    """
+    for shopping_basket in filled:
+        shopping_basket.total  # pylint: disable=pointless-statement
+
+
+def run_main(goods_path, offers_path, baskets):
+    """Price baskets with ``main``, one call each.
+
+    :param str goods_path: Path of the goods file.
+    :param str offers_path: Path of the offers file.
+    :param list baskets: Lists of item names.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        for items in baskets:
+            main.main(['--goods', goods_path, '--offers', offers_path] +
+                      items)
+
+
+def start_python(*argv):
+    """Run a new interpreter finding this copy of the package.
+
+    Bytecode is written and read as usual, even if ``PYTHONDONTWRITEBYTECODE``
+    is set here, since otherwise start-up would be timed compiling every
+    module of the package.
+
+    :param argv: Arguments of the interpreter.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+        os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    subprocess.run([sys.executable] + list(argv), env=env,
+                   stdout=subprocess.DEVNULL, check=True)
+
+
+def time_baskets(shop, baskets, repeat):
+    """Time adding items to baskets, calculating discounts and totalling.
+
+    :param shop: ``catalogue.Catalogue`` to price against.
+    :param list baskets: Lists of item names.
+    :param int repeat: Number of runs of each benchmark.
+    :return dict: Results of each benchmark, by name.
+    """
+    def empty():
+        return new_baskets(shop, baskets)
+
+    def filled():
+        return fill(empty(), baskets)
+
+    def calculated():
+        return calculate_discounts(filled())
+
+    num_items = sum(len(items) for items in baskets)
+    return {
+        'add': summarize(measure(lambda b: fill(b, baskets), repeat, empty),
+                         num_items),
+        'calculate_discounts': summarize(
+            measure(calculate_discounts, repeat, filled), len(baskets)),
+        'total': summarize(measure(total, repeat, calculated),
+                           len(baskets)),
+    }
+
+
+def time_commands(goods_path, offers_path, baskets, repeat):
+    """Time loading the files, pricing with ``main`` and starting up.
+
+    :param str goods_path: Path of the goods file.
+    :param str offers_path: Path of the offers file.
+    :param list baskets: Lists of item names priced with ``main``.  The
+      first is priced at start-up.
+    :param int repeat: Number of runs of each benchmark.
+    :return dict: Results of each benchmark, by name.
+    """
+    def start_up():
+        start_python('-m', 'basket', '--goods', goods_path,
+                     '--offers', offers_path, *baskets[0])
+
+    start_up()  # Untimed, to write the bytecode of the modules imported
+    return {
+        'load_goods': summarize(
+            measure(lambda: main.load_goods(goods_path), repeat), 1),
+        'load_offers': summarize(
+            measure(lambda: main.load_offers(offers_path), repeat), 1),
+        'main': summarize(
+            measure(lambda: run_main(goods_path, offers_path, baskets),
+                    repeat), len(baskets)),
+        'interpreter': summarize(
+            measure(lambda: start_python('-c', 'pass'), repeat), 1),
+        'startup': summarize(measure(start_up, repeat), 1),
+    }
+
+
+def run(num_goods=1000, num_offers=500, num_baskets=10000, repeat=5,
+        seed=0, main_baskets=50):
+    """Run the benchmarks.
+
+    :param int num_goods: Number of products in the catalogue.
+    :param int num_offers: Number of offers in the catalogue.
+    :param int num_baskets: Number of baskets priced.
+    :param int repeat: Number of runs of each benchmark.
+    :param int seed: Seed of the synthetic data.
+    :param int main_baskets: Number of baskets priced with ``main``.
+    :return dict: The configuration, environment and results of each
+      benchmark, by name.
+    """
+    rng = random.Random(seed)
+    goods_data = make_goods(num_goods, rng)
+    offers_data = make_offers(goods_data, num_offers, rng)
+    baskets = make_baskets(goods_data, num_baskets, rng)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        goods_path = os.path.join(tmp, 'goods.json')
+        offers_path = os.path.join(tmp, 'offers.json')
+        with open(goods_path, 'w') as f:
+            json.dump(goods_data, f)
+        with open(offers_path, 'w') as f:
+            json.dump(offers_data, f)
+        results = time_baskets(main.load_catalogue(goods_path, offers_path),
+                               baskets, repeat)
+        results.update(time_commands(goods_path, offers_path,
+                                     baskets[:main_baskets], repeat))
+
+    return {
+        'config': {
+            'goods': num_goods,
+            'offers': num_offers,
+            'baskets': num_baskets,
+            'items': sum(len(items) for items in baskets),
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'startup_overhead': (results['startup']['best'] -
+                             results['interpreter']['best']),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(baseline, current):
+    """Compare benchmark results against a baseline.
+
+    Benchmarks are compared by their fastest time per operation.
+
+    :param dict baseline: Results of an earlier run, as from ``run``.
+    :param dict current: Results of this run, as from ``run``.
+    :return list: ``(name, baseline, current, ratio)`` tuples, one per
+      benchmark in both runs, where ``ratio`` is the current time per
+      operation over the baseline's.
+    """
+    comparison = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None or not base['per_op_us']:
+            continue
+        comparison.append((name, base['per_op_us'], result['per_op_us'],
+                           result['per_op_us'] / base['per_op_us']))
+    return comparison
+
+
+def parse_args(argv=None):
+    """Parse command line arguments.
+
+    :param list argv: Args to parse.
+    """
+    parser = argparse.ArgumentParser(prog='basket.benchmark')
+    parser.add_argument('--goods', help='Number of products (default 1000)',
+                        default=1000, type=int, dest='goods')
+    parser.add_argument('--offers', help='Number of offers (default 500)',
+                        default=500, type=int, dest='offers')
+    parser.add_argument('--baskets', help='Number of baskets (default 10000)',
+                        default=10000, type=int, dest='baskets')
+    parser.add_argument('--repeat',
+                        help='Number of runs of each benchmark (default 5)',
+                        default=5, type=int, dest='repeat')
+    parser.add_argument('--seed', help='Seed of the synthetic data',
+                        default=0, type=int, dest='seed')
+    parser.add_argument('--output',
+                        help='Path to write the results to as JSON',
+                        default=None, dest='output')
+    parser.add_argument('--compare',
+                        help='Path of earlier results to compare against',
+                        default=None, dest='compare')
+    parser.add_argument('--threshold',
+                        help='Fraction slower than the baseline counted as '
+                             'a regression (default 0.1)',
+                        default=0.1, type=float, dest='threshold')
+    parser.add_argument('--startup-budget',
+                        help='Most milliseconds start-up may take over the '
+                             'interpreter\'s (default {:g})'.format(
+                                 STARTUP_BUDGET * 1000),
+                        default=STARTUP_BUDGET * 1000, type=float,
+                        dest='startup_budget')
+    args = parser.parse_args(argv)
+    if min(args.goods, args.baskets, args.repeat) < 1:
+        parser.error('--goods, --baskets and --repeat must be at least 1')
+    if args.offers < 0:
+        parser.error('--offers cannot be negative')
+    return args
+
+
+def main_benchmark(argv=None):
+    """Benchmark entry point.
+
+    Writes the results as JSON to stdout (and ``--output``), followed by a
+    comparison with ``--compare`` if given.
+
+    :param list argv: Command line arguments.
+    :return int: 1 if start-up is over budget or a benchmark regressed
+      against the baseline, and 0 otherwise.
+    """
+    args = parse_args(argv)
+    results = run(args.goods, args.offers, args.baskets, args.repeat,
+                  args.seed)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    status = 0
+    overhead = results['startup_overhead'] * 1000
+    if overhead > args.startup_budget:
+        status = 1
+        print('Start-up took {:.1f}ms over the interpreter, over the budget '
+              'of {:g}ms'.format(overhead, args.startup_budget),
+              file=sys.stderr)
+    if not args.compare:
+        return status
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    for name, base, current, ratio in compare(baseline, results):
+        regressed = ratio > 1 + args.threshold
+        status = status or int(regressed)
+        print('{:<20} {:>12.3f}us {:>12.3f}us {:>7.2f}x{}'.format(
+            name, base, current, ratio, '  REGRESSION' if regressed else ''),
+              file=sys.stderr)
+    return status
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main_benchmark())
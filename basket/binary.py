@@ -0,0 +1,528 @@
+"""Binary module.
+
+Compiles goods and offers into a binary catalogue file, and prices baskets
+against one by memory-mapping it.  Nothing is read from the file until it
+is needed: products, offers and the pricing rules for a product are made
+when the product is first looked up, so opening a catalogue takes the same
+time however many products and offers it holds.
+
+The file holds, all little-endian:
+
+- A header (``HEADER``) holding a magic number, the format version, the
+  number of goods and offers and the offset of each section.
+- A goods record (``GOOD``) per product, sorted by name so a product can
+  be found by binary search.  Each holds the product's price, its name and
+  unit (as offsets into the string table), and where in the offer index
+  its qualifying and discounted offers are listed.
+- An offer record (``OFFER``) per offer, in the order of the offers.
+- The offer index, the positions of offers as unsigned 32-bit integers.
+  Offers involving products not in the goods never apply, so are only
+  listed in the offer records.
+- The string table, holding each distinct string once as UTF-8.  Offer ids
+  are held as JSON text so that they keep their type.
+"""
+
+import collections.abc
+import json
+import mmap
+import os
+import struct
+
+from basket import basket
+from basket import engine
+from basket import offer
+from basket import product
+from basket import receipt
+
+
+MAGIC = b'BSKT'
+VERSION = 1
+
+# magic, version, (reserved), goods, offers, and the offsets of the goods,
+# offers, offer index and string table sections
+HEADER = struct.Struct('<4sHHIIIIII')
+
+# name offset and length, price, unit offset and length, and the start and
+# count in the offer index of the qualifying and discounted offers
+GOOD = struct.Struct('<IIqIIIIII')
+
+# id, title and qualifying product offsets and lengths, qualifying qty,
+# discounted product offset and length, and discount percent
+OFFER = struct.Struct('<IIIIIIqIId')
+
+INDEX = struct.Struct('<I')
+
+# The name offset and length leading a goods record
+NAME = struct.Struct('<II')
+
+
+class StringTable:
+    """Class that builds the string table of a catalogue file."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = {}
+
+    def add(self, text):
+        """Add a string to the table, if not already there.
+
+        :param str text: String to add.
+        :return tuple: Offset and length of the string's UTF-8 bytes.
+        """
+        try:
+            return self.offsets[text]
+        except KeyError:
+            encoded = text.encode('utf-8')
+            location = self.offsets[text] = (len(self.data), len(encoded))
+            self.data += encoded
+            return location
+
+
+def write_catalogue(file_path, goods, offers):
+    """Compile goods and offers into a catalogue file.
+
+    The file is written alongside and then moved into place, so that
+    catalogues already open on the old file are unaffected.  If writing
+    fails nothing is left behind.
+
+    :param str file_path: Path of the file to write.
+    :param dict goods: The goods available.
+    :param list offers: The offers available.
+    """
+    strings = StringTable()
+    offer_records, qualifying, discounted = _offer_records(goods, offers,
+                                                           strings)
+    good_records, index = _good_records(goods, qualifying, discounted,
+                                        strings)
+    header = _header(len(good_records), len(offer_records), len(index))
+
+    temp_path = file_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(header)
+            f.write(b''.join(good_records))
+            f.write(b''.join(offer_records))
+            f.write(struct.pack('<{}I'.format(len(index)), *index))
+            f.write(strings.data)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _header(goods_count, offers_count, index_count):
+    """Pack the header of a catalogue file.
+
+    :param int goods_count: Number of goods records.
+    :param int offers_count: Number of offer records.
+    :param int index_count: Number of positions in the offer index.
+    :return bytes: The header.
+    """
+    goods_offset = HEADER.size
+    offers_offset = goods_offset + GOOD.size * goods_count
+    index_offset = offers_offset + OFFER.size * offers_count
+    strings_offset = index_offset + INDEX.size * index_count
+    return HEADER.pack(MAGIC, VERSION, 0, goods_count, offers_count,
+                       goods_offset, offers_offset, index_offset,
+                       strings_offset)
+
+
+def _offer_records(goods, offers, strings):
+    """Pack the offer records of a catalogue file.
+
+    :param dict goods: The goods available.
+    :param list offers: The offers available.
+    :param strings: ``StringTable`` to add the offers' strings to.
+    :return tuple: The offer records, and dicts of the positions of the
+      offers each product (by name) qualifies for and is discounted by.
+      Offers involving products not in the goods are left out of the dicts.
+    """
+    qualifying = {name: [] for name in goods}
+    discounted = {name: [] for name in goods}
+    records = []
+    for position, o in enumerate(offers):
+        if o.qualifying_product in goods and o.discounted_product in goods:
+            qualifying[o.qualifying_product].append(position)
+            discounted[o.discounted_product].append(position)
+        records.append(OFFER.pack(
+            *strings.add(json.dumps(o.offer_id)), *strings.add(o.title),
+            *strings.add(o.qualifying_product), o.qualifying_qty,
+            *strings.add(o.discounted_product), o.discount_percent))
+    return records, qualifying, discounted
+
+
+def _good_records(goods, qualifying, discounted, strings):
+    """Pack the goods records and offer index of a catalogue file.
+
+    :param dict goods: The goods available.
+    :param dict qualifying: Positions of the offers each product qualifies
+      for, as from ``_offer_records``.
+    :param dict discounted: Positions of the offers discounting each
+      product, as from ``_offer_records``.
+    :param strings: ``StringTable`` to add the goods' strings to.
+    :return tuple: The goods records sorted by name, and the offer index.
+    """
+    index = []
+    records = []
+    for name in sorted(goods, key=lambda name: name.encode('utf-8')):
+        p = goods[name]
+        qualifying_start = len(index)
+        index.extend(qualifying[name])
+        discounted_start = len(index)
+        index.extend(discounted[name])
+        records.append(GOOD.pack(
+            *strings.add(p.name), p.price, *strings.add(p.unit),
+            qualifying_start, len(qualifying[name]),
+            discounted_start, len(discounted[name])))
+    return records, index
+
+
+class MappedCatalogue:
+    """Class that encapsulates a memory-mapped catalogue file.
+
+    It can be used wherever a ``catalogue.Catalogue`` is.  Products and
+    offers are made from the file as they are looked up, and kept.
+    """
+
+    def __init__(self, file_path, version=1, strategy=engine.ORDERED):
+        """
+        :param str file_path: Path of a file written by
+          ``write_catalogue``.
+        :param int version: Version number of this catalogue.
+        :param str strategy: How competing offers are allocated, one of
+          ``engine.STRATEGIES``.
+        :raises: ValueError if the file is not a catalogue file, is
+          truncated, or the strategy is not recognised.
+        """
+        if strategy not in engine.STRATEGIES:
+            raise ValueError('Unknown strategy {!r}'.format(strategy))
+        with open(file_path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # An empty file cannot be mapped
+                raise ValueError(
+                    'Not a catalogue file: {}'.format(file_path)) from None
+        self.file_path = file_path
+        try:
+            (self.num_goods, self.num_offers, self._goods_offset,
+             self._offers_offset, self._index_offset,
+             self._strings_offset) = self._read_header(file_path)
+        except ValueError:
+            self._map.close()
+            raise
+        self._index_count = ((self._strings_offset - self._index_offset) //
+                             INDEX.size)
+        self.version = version
+        self._products = {}
+        self._offers = {}
+        self.goods = MappedGoods(self)
+        self.offers = MappedOffers(self)
+        self.plan = MappedPlan(self, strategy)
+
+    def _read_header(self, file_path):
+        """Read the header of the file.
+
+        :param str file_path: Path of the file, for error messages.
+        :return tuple: The number of goods and offers, and the offsets of
+          the goods, offers, offer index and string table.
+        :raises: ValueError if the file is not a catalogue file, or its
+          sections do not fit the file.
+        """
+        if len(self._map) < HEADER.size:
+            raise ValueError('Not a catalogue file: {}'.format(file_path))
+        magic, file_version, _, *header = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError('Not a catalogue file: {}'.format(file_path))
+        if file_version != VERSION:
+            raise ValueError('Unsupported catalogue file version {}: {}'
+                             .format(file_version, file_path))
+        (goods_count, offers_count, goods_offset, offers_offset,
+         index_offset, strings_offset) = header
+        # The sections follow one another as written by write_catalogue
+        if (goods_offset != HEADER.size or
+                offers_offset != goods_offset + GOOD.size * goods_count or
+                index_offset != offers_offset + OFFER.size * offers_count or
+                strings_offset < index_offset or
+                (strings_offset - index_offset) % INDEX.size or
+                strings_offset > len(self._map)):
+            raise self._corrupt()
+        return header
+
+    def _corrupt(self):
+        """The error raised on finding the file is truncated or corrupt.
+
+        :return: ValueError instance.
+        """
+        return ValueError('Corrupt catalogue file: {}'.format(
+            self.file_path))
+
+    def current(self):
+        """The catalogue to price against, this catalogue itself.
+
+        :return: ``MappedCatalogue`` instance.
+        """
+        return self
+
+    def new_basket(self):
+        """Make an empty basket priced against this catalogue.
+
+        :return: ``basket.Basket`` instance.
+        """
+        return basket.Basket(self.goods, self.offers, self.plan)
+
+    def price(self, items):
+        """Price a basket of items against this catalogue, changing
+        nothing.  Safe to call from any number of threads at once.
+
+        :param items: Iterable of ``(item, quantity)`` tuples.
+        :return: ``receipt.Receipt`` instance.
+        :raises: ValueError if a quantity is not an integer of at least 1.
+        """
+        return receipt.price(self.goods, self.plan, items)
+
+    def close(self):
+        """Unmap the file.  The catalogue cannot be used afterwards."""
+        self._map.close()
+
+    def _string(self, offset, length):
+        """A string from the string table.
+
+        :param int offset: Offset in the string table.
+        :param int length: Length in bytes.
+        :return str: The string.
+        """
+        start = self._strings_offset + offset
+        if start + length > len(self._map):
+            raise self._corrupt()
+        try:
+            return self._map[start:start + length].decode('utf-8')
+        except UnicodeDecodeError:
+            raise self._corrupt() from None
+
+    def _good(self, index):
+        """A goods record.
+
+        :param int index: Position of the record.
+        :return tuple: The record's fields.
+        """
+        return GOOD.unpack_from(self._map,
+                                self._goods_offset + index * GOOD.size)
+
+    def find(self, name):
+        """Find the goods record of a product.
+
+        :param str name: Product name (lower case).
+        :return int: Position of the product's record, or -1 if the product
+          is not in the goods.
+        """
+        key = name.encode('utf-8')
+        strings = self._strings_offset
+        low, high = 0, self.num_goods
+        while low < high:
+            middle = (low + high) // 2
+            offset, length = NAME.unpack_from(
+                self._map, self._goods_offset + middle * GOOD.size)
+            start = strings + offset
+            found = self._map[start:start + length]
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return middle
+        return -1
+
+    def product(self, name):
+        """A product in the goods.
+
+        :param str name: Product name (lower case).
+        :return: ``product.Product`` instance, or None if the product is not
+          in the goods.
+        """
+        try:
+            return self._products[name]
+        except KeyError:
+            pass
+        index = self.find(name)
+        if index < 0:
+            return None
+        name_offset, name_length, price, unit_offset, unit_length = (
+            self._good(index)[:5])
+        p = product.Product(self._string(name_offset, name_length), price,
+                            self._string(unit_offset, unit_length))
+        return self._products.setdefault(name, p)
+
+    def offer(self, position):
+        """An offer.
+
+        :param int position: Position of the offer in the offers.
+        :return: ``offer.Offer`` instance.
+        """
+        try:
+            return self._offers[position]
+        except KeyError:
+            pass
+        if not 0 <= position < self.num_offers:
+            raise IndexError('Offer position out of range')
+        (id_offset, id_length, title_offset, title_length, qualifying_offset,
+         qualifying_length, qualifying_qty, discounted_offset,
+         discounted_length, discount_percent) = OFFER.unpack_from(
+             self._map, self._offers_offset + position * OFFER.size)
+        o = offer.Offer({
+            'id': json.loads(self._string(id_offset, id_length)),
+            'title': self._string(title_offset, title_length),
+            'qualifying_product': self._string(qualifying_offset,
+                                               qualifying_length),
+            'qualifying_qty': qualifying_qty,
+            'discounted_product': self._string(discounted_offset,
+                                               discounted_length),
+            'discount_percent': discount_percent,
+        })
+        return self._offers.setdefault(position, o)
+
+    def offer_positions(self, name):
+        """The positions of the offers that apply to a product.
+
+        :param str name: Product name (lower case).
+        :return tuple: Tuples of the positions of the offers the product
+          qualifies for and is discounted by, in order.
+        """
+        index = self.find(name)
+        if index < 0:
+            return (), ()
+        (qualifying_start, qualifying_count, discounted_start,
+         discounted_count) = self._good(index)[5:]
+        return (self._positions(qualifying_start, qualifying_count),
+                self._positions(discounted_start, discounted_count))
+
+    def _positions(self, start, count):
+        """Offer positions from the offer index.
+
+        :param int start: Start in the offer index.
+        :param int count: Number of positions.
+        :return tuple: The positions.
+        :raises: ValueError if the positions are outside the offer index or
+          the offers.
+        """
+        if start + count > self._index_count:
+            raise self._corrupt()
+        positions = struct.unpack_from('<{}I'.format(count), self._map,
+                                       self._index_offset + start * INDEX.size)
+        if positions and max(positions) >= self.num_offers:
+            raise self._corrupt()
+        return positions
+
+
+class MappedGoods(collections.abc.Mapping):
+    """Class that maps product names to the products of a
+    ``MappedCatalogue``."""
+
+    def __init__(self, catalogue):
+        """
+        :param catalogue: ``MappedCatalogue`` holding the goods.
+        """
+        self._catalogue = catalogue
+
+    def __getitem__(self, name):
+        p = self._catalogue.product(name)
+        if p is None:
+            raise KeyError(name)
+        return p
+
+    def __len__(self):
+        return self._catalogue.num_goods
+
+    def __iter__(self):
+        catalogue = self._catalogue
+        for index in range(catalogue.num_goods):
+            # pylint: disable=protected-access
+            yield catalogue._string(*catalogue._good(index)[:2])
+
+
+class MappedOffers(collections.abc.Sequence):
+    """Class that holds the offers of a ``MappedCatalogue``, in order."""
+
+    def __init__(self, catalogue):
+        """
+        :param catalogue: ``MappedCatalogue`` holding the offers.
+        """
+        self._catalogue = catalogue
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        return self._catalogue.offer(position)
+
+    def __len__(self):
+        return self._catalogue.num_offers
+
+
+class MappedPlan(engine.PricingPlan):
+    """Class that encapsulates the pricing rules of a ``MappedCatalogue``.
+
+    The prices and rules of a product are read from the catalogue file the
+    first time the product's SKU id is priced.  Rules are indexed by the
+    position of their offer.
+    """
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, catalogue, strategy=engine.ORDERED):
+        """
+        :param catalogue: ``MappedCatalogue`` holding the goods and offers.
+        :param str strategy: How competing offers are allocated, one of
+          ``engine.STRATEGIES``.
+        """
+        self._catalogue = catalogue
+        self.strategy = strategy
+        self.prices = _LazyTable(self._price)
+        self.rules = _LazyTable(self._rule)
+        self.by_qualifying = _LazyTable(lambda sku: self._positions(sku)[0])
+        self.by_discounted = _LazyTable(lambda sku: self._positions(sku)[1])
+
+    def _price(self, sku):
+        p = self._catalogue.product(product.sku_name(sku))
+        return 0 if p is None else p.price
+
+    def _rule(self, position):
+        o = self._catalogue.offer(position)
+        return engine.Rule(position, o, self.prices[o.discounted_sku])
+
+    def _positions(self, sku):
+        return self._catalogue.offer_positions(product.sku_name(sku))
+
+
+class _LazyTable:
+    """Table whose entries are made when first looked up."""
+
+    __slots__ = ('_entries', '_make')
+
+    def __init__(self, make):
+        """
+        :param make: Callable making the entry for a key.
+        """
+        self._entries = {}
+        self._make = make
+
+    def __getitem__(self, key):
+        try:
+            return self._entries[key]
+        except KeyError:
+            return self._entries.setdefault(key, self._make(key))
+
+
+def load(file_path, strategy=engine.ORDERED):
+    """Open a catalogue file.
+
+    :param str file_path: Path of a file written by ``write_catalogue``.
+    :param str strategy: How competing offers are allocated, one of
+      ``engine.STRATEGIES``.
+    :return: ``MappedCatalogue`` instance.
+    :raises: ValueError if the file is not a catalogue file or is truncated
+      or corrupt, and EnvironmentError if it cannot be opened.
+    """
+    return MappedCatalogue(file_path, strategy=strategy)
@@ -0,0 +1,132 @@
+"""Cache module.
+
+Caches the prices of baskets so that a basket holding the same items as
+one priced before (in any order) is not priced again.  Baskets are keyed
+by the quantity of each item they hold.  The cache holds the prices for
+one catalogue version at a time and is cleared when a newer version is
+seen, e.g. after a ``catalogue.CatalogueManager`` reloads the goods or
+offers.
+"""
+
+import collections
+import threading
+
+from basket import receipt
+
+
+class PricingCache:
+    """Class that caches basket prices, evicting the least recently used
+    once it holds ``maxsize`` baskets."""
+
+    def __init__(self, maxsize=10000):
+        """
+        :param int maxsize: Most baskets to hold prices for.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.catalogue = None
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Remove all cached prices."""
+        with self._lock:
+            self._entries.clear()
+
+    def price(self, catalogue, items):
+        """Price a basket of items, using the cached prices if possible.
+
+        :param catalogue: ``catalogue.Catalogue`` to price against.
+        :param list items: List of ``(item, quantity)`` tuples.
+        :return dict: The subtotal and total (in pence), the discount
+          messages and any items not in stock, as from ``batch.price``.
+        """
+        runs = []
+        counts = {}
+        unknown = []
+        for item, quantity in items:
+            name = item.lower()
+            if name in catalogue.goods:
+                runs.append((name, quantity))
+                counts[name] = counts.get(name, 0) + quantity
+            else:
+                unknown.append(item)
+        subtotal, total, allocations = self._entry(catalogue, counts)
+        # The discounts are listed in the order of the units they discount,
+        # as when the basket is priced without the cache
+        discounts = []
+        for _, message, quantity in receipt.unit_order(runs, allocations):
+            discounts.extend([message] * quantity)
+        return {
+            'subtotal': subtotal,
+            'discounts': discounts,
+            'total': total,
+            'unknown': unknown,
+        }
+
+    def _entry(self, catalogue, counts):
+        """The cached prices of a basket, pricing it if not cached.
+
+        :param catalogue: ``catalogue.Catalogue`` to price against.
+        :param dict counts: Quantity of each item in stock, by name.
+        :return tuple: As from ``price_counts``.
+        """
+        key = tuple(sorted(counts.items()))
+        with self._lock:
+            cacheable = self._use(catalogue)
+            entry = self._entries.get(key) if cacheable else None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = price_counts(catalogue, counts)
+        if cacheable:
+            with self._lock:
+                if self.catalogue is catalogue:
+                    self._entries[key] = entry
+                    if len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+        return entry
+
+    def _use(self, catalogue):
+        """Make sure the cache holds prices for a catalogue.
+
+        Must be called holding ``self._lock``.
+
+        :param catalogue: ``catalogue.Catalogue`` about to be priced
+          against.
+        :return bool: True if prices for the catalogue can be cached, and
+          False if the catalogue is older than the one cached.
+        """
+        if catalogue is self.catalogue:
+            return True
+        if self.catalogue is not None and (
+                catalogue.version <= self.catalogue.version):
+            return False
+        self.catalogue = catalogue
+        self._entries.clear()
+        return True
+
+
+def price_counts(catalogue, counts):
+    """Price a basket given the quantity of each item.
+
+    :param catalogue: ``catalogue.Catalogue`` to price against.
+    :param dict counts: Quantity of each item in stock, by name.
+    :return tuple: The subtotal and total (in pence), and a dict of the
+      ``(message, quantity)`` pairs of discounts covering the leading units
+      of each item, as ``receipt.unit_order`` takes.
+    """
+    priced = catalogue.price(counts.items())
+    allocations = {}
+    for line in priced.lines:
+        allocations.setdefault(line.product.name, []).append(
+            (line.message, line.quantity))
+    return priced.subtotal, priced.total, {
+        name: tuple(allocation) for name, allocation in allocations.items()}
@@ -0,0 +1,220 @@
+"""Catalogue module."""
+
+import contextlib
+import os
+import threading
+import time
+import types
+
+from basket import basket
+from basket import engine
+from basket import logs
+from basket import receipt
+
+
+class Catalogue:
+    """Class that encapsulates the goods and offers baskets are priced
+    against.
+
+    A catalogue is loaded once and shared by every basket priced against
+    it, together with the ``engine.PricingPlan`` its offers compile to.
+    It is not changed once made: a new version is made instead when the
+    goods or offers change (see ``CatalogueManager``), so baskets being
+    priced against an older version are unaffected.
+    """
+
+    def __init__(self, goods, offers, version=1, strategy=engine.ORDERED):
+        """
+        :param dict goods: The goods available.
+        :param list offers: The offers available.
+        :param int version: Version number of this catalogue.
+        :param str strategy: How competing offers are allocated, one of
+          ``engine.STRATEGIES``.
+        """
+        # The goods and offers of another catalogue are already frozen
+        if not isinstance(goods, types.MappingProxyType):
+            goods = types.MappingProxyType(dict(goods))
+        self.goods = goods
+        self.offers = tuple(offers)
+        self.plan = engine.compile_offers(self.goods, self.offers, strategy)
+        self.version = version
+
+    def current(self):
+        """The catalogue to price against.
+
+        A catalogue never changes so this is the catalogue itself.  It
+        allows a catalogue to be used wherever a ``CatalogueManager`` is.
+
+        :return: ``Catalogue`` instance.
+        """
+        return self
+
+    def new_basket(self):
+        """Make an empty basket priced against this catalogue.
+
+        :return: ``basket.Basket`` instance.
+        """
+        return basket.Basket(self.goods, self.offers, self.plan)
+
+    def price(self, items):
+        """Price a basket of items against this catalogue, changing
+        nothing.  Safe to call from any number of threads at once.
+
+        :param items: Iterable of ``(item, quantity)`` tuples.
+        :return: ``receipt.Receipt`` instance.
+        :raises: ValueError if a quantity is not an integer of at least 1.
+        """
+        return receipt.price(self.goods, self.plan, items)
+
+
+@contextlib.contextmanager
+def _acquire_if_free(lock):
+    """Hold a lock until the block exits, if it is not already held.
+
+    :param lock: ``threading.Lock`` instance.
+    :return: Context manager giving True if the lock was acquired, and False
+      if it was already held.
+    """
+    acquired = lock.acquire(blocking=False)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            lock.release()
+
+
+def file_signature(file_path):
+    """Signature identifying the version of a file.
+
+    :param str file_path: Path to the file.
+    :return: Tuple of the file's inode, modification time and size, or
+      None if the file does not exist.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class CatalogueManager:
+    """Class that keeps a catalogue up to date with its goods and offers
+    files.
+
+    The files are checked for changes (by inode, modification time and
+    size) at most once every ``check_interval`` seconds.  Only a changed
+    file is loaded again, and a new ``Catalogue`` version then replaces the
+    current one.  Callers keep whichever version ``current`` gave them
+    until they finish with it.
+
+    If a changed file cannot be loaded, e.g. as it is only partly written,
+    the current version is kept and the file is loaded again at the next
+    check.
+    """
+
+    def __init__(self, goods_file_path, offers_file_path, load_goods,
+                 load_offers, check_interval=1.0, strategy=engine.ORDERED):
+        """
+        :param str goods_file_path: Path to goods file.
+        :param str offers_file_path: Path to offers file.
+        :param load_goods: Callable loading the goods dict from a path, or
+          returning None if the file cannot be loaded.
+        :param load_offers: Callable loading the offers list from a path,
+          or returning None if the file cannot be loaded.
+        :param float check_interval: Least time in seconds between checks
+          for changed files.
+        :param str strategy: How competing offers are allocated, one of
+          ``engine.STRATEGIES``.
+        """
+        self.goods_file_path = goods_file_path
+        self.offers_file_path = offers_file_path
+        self.load_goods = load_goods
+        self.load_offers = load_offers
+        self.check_interval = check_interval
+        self.strategy = strategy
+        self.catalogue = None
+        self._signatures = (None, None)
+        self._next_check = 0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def current(self):
+        """The catalogue to price against.
+
+        Checks whether the files have changed if ``check_interval`` has
+        passed since the last check, loading a new version if so.
+
+        :return: ``Catalogue`` instance.
+        """
+        if time.monotonic() >= self._next_check:
+            self.reload()
+        return self.catalogue
+
+    def reload(self):
+        """Load a new catalogue version if either file has changed.
+
+        Only one thread reloads at a time; others carry on with the current
+        version meanwhile.
+
+        :return: True if a new version was loaded and False otherwise.
+          Until the first version is loaded a file that cannot be loaded is
+          taken as empty.
+        """
+        with _acquire_if_free(self._lock) as acquired:
+            if not acquired:
+                return False
+            self._next_check = time.monotonic() + self.check_interval
+            signatures = self._changed_signatures()
+            if signatures is None:
+                return False
+            return self._load(signatures)
+
+    def _changed_signatures(self):
+        """Take the signatures of the files, if either has changed.
+
+        Signatures are taken before loading so a file changed while being
+        loaded is seen as changed again at the next check.
+
+        :return: Tuple of the goods and offers file signatures, or None if
+          neither has changed since the current version was loaded.
+        """
+        signatures = (file_signature(self.goods_file_path),
+                      file_signature(self.offers_file_path))
+        if signatures == self._signatures:
+            return None
+        return signatures
+
+    def _load(self, signatures):
+        """Load the changed files and replace the current version.
+
+        Must be called holding ``self._lock``.
+
+        :param tuple signatures: The goods and offers file signatures taken
+          by ``_changed_signatures``.
+        :return: True if a new version was loaded and False otherwise.
+        """
+        goods_signature, offers_signature = signatures
+        current = self.catalogue
+        if current and goods_signature == self._signatures[0]:
+            goods = current.goods
+        else:
+            goods = self.load_goods(self.goods_file_path)
+        if current and offers_signature == self._signatures[1]:
+            offers = current.offers
+        else:
+            offers = self.load_offers(self.offers_file_path)
+
+        if goods is None or offers is None:
+            if current:
+                # Keep the signatures too, so the files are loaded again at
+                # the next check
+                logs.warning('Failed to reload the catalogue, keeping '
+                             'version %d', current.version)
+                return False
+            goods, offers = goods or {}, offers or []
+            signatures = None, None
+
+        version = current.version + 1 if current else 1
+        self.catalogue = Catalogue(goods, offers, version, self.strategy)
+        self._signatures = signatures
+        return True
@@ -0,0 +1,248 @@
+"""Columnar module.
+
+Writes the results of pricing a batch of baskets as a table with a fixed
+schema, for analytics, rather than as a receipt or JSON line per basket.
+Each basket is a row of:
+
+- ``id``: the basket id, or its line number if it has none.
+- ``subtotal``, ``discount`` and ``total``: in pence.
+- For each offer in the catalogue, in order, ``offer_<id>_units`` and
+  ``offer_<id>_discount``: the units the offer discounted and the discount
+  it gave in pence, 0 if it did not apply.
+
+Rows are buffered and written a chunk at a time, as CSV or TSV with a
+header row, or as Parquet or an Arrow IPC file when PyArrow is installed.
+Arrow and Parquet have typed columns, so ``id`` is written as a string
+and every other column as a 64-bit integer.
+
+Baskets that cannot be parsed are logged and left out, as are items not in
+stock.
+
+PyArrow is an optional dependency, needed only for the Parquet and Arrow
+formats.
+"""
+
+import csv
+
+from basket import batch
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+
+DELIMITERS = {'csv': ',', 'tsv': '\t'}
+FORMATS = ('csv', 'tsv', 'parquet', 'arrow')
+
+# Formats written as bytes rather than text
+BINARY_FORMATS = ('parquet', 'arrow')
+
+# Rows written at a time
+CHUNK_SIZE = 10000
+
+# Columns leading every row
+LEADING = ('id', 'subtotal', 'discount', 'total')
+
+
+def column_names(offers):
+    """The names of the columns of the table.
+
+    :param list offers: The offers of the catalogue priced against.
+    :return list: Column names, as described above.  An offer sharing its
+      id with an earlier offer also has its position in its names.
+    """
+    names = list(LEADING)
+    seen = set()
+    for position, o in enumerate(offers):
+        name = 'offer_{}'.format(o.offer_id)
+        if name in seen:
+            name = '{}_{}'.format(name, position)
+        seen.add(name)
+        names.extend([name + '_units', name + '_discount'])
+    return names
+
+
+def offer_columns(offers):
+    """The position in a row of the units column of each offer.
+
+    :param list offers: The offers of the catalogue priced against.
+    :return dict: Column positions by ``offer.Offer`` instance.  The
+      discount column of an offer follows its units column.
+    """
+    return {o: len(LEADING) + 2 * position
+            for position, o in enumerate(offers)}
+
+
+def price_rows(catalogue, numbered_lines, columns):
+    """Price baskets given as numbered JSON lines, as rows of the table.
+
+    :param catalogue: ``catalogue.Catalogue`` to price against.
+    :param numbered_lines: Iterable of ``(line_no, line)`` tuples.
+    :param dict columns: Column positions of the catalogue's offers, as
+      from ``offer_columns``.
+    :return list: Rows, each a list of the values of the columns.
+    """
+    width = len(LEADING) + 2 * len(columns)
+    rows = []
+    for line_no, line in numbered_lines:
+        try:
+            basket_id, items = batch.parse_line(line_no, line)
+        except ValueError:
+            continue
+        priced = catalogue.price(items)
+        batch.log_unknown(basket_id, priced.unknown)
+        row = [0] * width
+        row[:len(LEADING)] = (basket_id, priced.subtotal, priced.discount,
+                              priced.total)
+        for discount_line in priced.lines:
+            column = columns[discount_line.offer]
+            row[column] += discount_line.quantity
+            row[column + 1] += discount_line.amount
+        rows.append(row)
+    return rows
+
+
+# The catalogue last priced by ``price_chunk_rows``, and its offer columns
+_CHUNK_COLUMNS = (None, None)
+
+
+def price_chunk_rows(catalogue, numbered_lines):
+    """Price a chunk of baskets as rows, as ``price_rows`` does, working out
+    the offer columns once for each catalogue.  A task for
+    ``batch.price_lines_parallel``.
+
+    :param catalogue: ``catalogue.Catalogue`` to price against.
+    :param numbered_lines: Iterable of ``(line_no, line)`` tuples.
+    :return list: Rows, each a list of the values of the columns.
+    """
+    global _CHUNK_COLUMNS  # pylint: disable=global-statement
+    shop, columns = _CHUNK_COLUMNS
+    if shop is not catalogue:
+        columns = offer_columns(catalogue.offers)
+        _CHUNK_COLUMNS = catalogue, columns
+    return price_rows(catalogue, numbered_lines, columns)
+
+
+class ColumnarWriter:
+    """Class that buffers rows and writes them a chunk at a time.
+
+    Use as a context manager, or call ``close`` once all rows are written
+    to write any rows still buffered and finish the output.
+    """
+
+    def __init__(self, out, names, output_format='csv',
+                 chunk_size=CHUNK_SIZE):
+        """
+        :param out: File like object to write to, opened in binary mode for
+          ``BINARY_FORMATS`` and in text mode (with ``newline=''``)
+          otherwise.
+        :param list names: Column names, as from ``column_names``.
+        :param str output_format: One of ``FORMATS``.
+        :param int chunk_size: Most rows buffered before they are written.
+        :raises: ValueError if the format is not recognised, or ImportError
+          if it needs PyArrow and PyArrow is not installed.
+        """
+        if output_format in DELIMITERS:
+            self._sink = _DelimitedSink(out, names,
+                                        DELIMITERS[output_format])
+        elif output_format in BINARY_FORMATS:
+            if pyarrow is None:
+                raise ImportError(
+                    'PyArrow is required for {} output'.format(output_format))
+            self._sink = _ArrowSink(out, names, output_format)
+        else:
+            raise ValueError(
+                'Unknown output format {!r}'.format(output_format))
+        self.chunk_size = chunk_size
+        self.rows_written = 0
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_rows(self, rows):
+        """Write rows, buffering them until a chunk is full.
+
+        :param list rows: Rows, each a list of the values of the columns.
+        """
+        self._rows.extend(rows)
+        if len(self._rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write the rows buffered."""
+        if self._rows:
+            self._sink.write(self._rows)
+            self.rows_written += len(self._rows)
+            self._rows = []
+
+    def close(self):
+        """Write the rows buffered and finish the output.  The file written
+        to is left open."""
+        self.flush()
+        self._sink.close()
+
+
+class _DelimitedSink:
+    """Writes rows as delimited text with a header row."""
+
+    def __init__(self, out, names, delimiter):
+        """
+        :param out: Text file to write to.
+        :param list names: Column names, written as the header row.
+        :param str delimiter: Character separating the columns.
+        """
+        self._writer = csv.writer(out, delimiter=delimiter,
+                                  lineterminator='\n')
+        self._writer.writerow(names)
+
+    def write(self, rows):
+        """Write rows.
+
+        :param list rows: Rows, each a list of the values of the columns.
+        """
+        self._writer.writerows(rows)
+
+    def close(self):
+        """Finish writing.  Nothing is held back, so there is nothing to
+        do."""
+
+
+class _ArrowSink:
+    """Writes rows as record batches of a Parquet or Arrow IPC file."""
+
+    def __init__(self, out, names, output_format):
+        """
+        :param out: Binary file to write to.
+        :param list names: Column names, the first being the basket id.
+        :param str output_format: ``'parquet'`` or ``'arrow'``.
+        """
+        self._schema = pyarrow.schema(
+            [(names[0], pyarrow.string())] +
+            [(name, pyarrow.int64()) for name in names[1:]])
+        if output_format == 'parquet':
+            self._writer = pyarrow.parquet.ParquetWriter(out, self._schema)
+        else:
+            self._writer = pyarrow.ipc.new_file(out, self._schema)
+
+    def write(self, rows):
+        """Write rows as a record batch.
+
+        :param list rows: Rows, each a list of the values of the columns.
+        """
+        columns = [list(column) for column in zip(*rows)]
+        columns[0] = [str(basket_id) for basket_id in columns[0]]
+        self._writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=field.type)
+             for column, field in zip(columns, self._schema)],
+            schema=self._schema))
+
+    def close(self):
+        """Finish the file, writing its footer."""
+        self._writer.close()
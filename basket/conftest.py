@@ -0,0 +1,19 @@
+"""Fixtures shared by the tests of the basket package."""
+
+import pytest
+
+from basket import logs
+from basket.testing import make_goods
+
+
+@pytest.fixture(autouse=True, scope='session')
+def log_output():
+    """Write log messages to the output stream, as the command line program
+    does, so that tests can check them."""
+    logs.configure()
+
+
+@pytest.fixture
+def goods():
+    """The goods of ``testing.make_goods``, made afresh for each test."""
+    return make_goods()
@@ -0,0 +1,508 @@
+"""Engine module.
+
+Compiles offers into a ``PricingPlan`` that prices baskets using the
+integer SKU ids interned for products (see ``product.intern_sku``) rather
+than product names.  Offers are resolved against the goods once, when the
+plan is compiled, so pricing a basket is a pass over the rules between the
+products in the basket, leaving out any that can never be allocated (see
+``shadowed``).
+
+Where offers compete for the same units, the plan's strategy decides
+which apply:
+
+- ``ORDERED``: offers apply in order, each to as many units as it has
+  earned, with a later offer replacing an earlier one on the same units.
+- ``BEST``: each offer earns discounts as with ``ORDERED``, and each unit
+  gets the largest discount earned for it, so the price is never more
+  than with ``ORDERED``.
+- ``EXCLUSIVE``: each unit counts towards at most one offer, whether to
+  qualify for it or to be discounted by it, and the offers are chosen to
+  give the lowest price (see ``solver``).
+"""
+
+from basket import solver
+
+
+ORDERED = 'ordered'
+BEST = 'best'
+EXCLUSIVE = 'exclusive'
+STRATEGIES = (ORDERED, BEST, EXCLUSIVE)
+
+
+class Rule:
+    """Class that encapsulates an offer compiled against the goods."""
+
+    __slots__ = ('position', 'offer', 'qualifying', 'qualifying_qty',
+                 'discounted', 'unit_discount')
+
+    def __init__(self, position, offer, unit_price):
+        """
+        :param int position: Position of the offer in the offers list.
+        :param offer: The ``offer.Offer`` compiled.
+        :param int unit_price: Price of the discounted product in pence.
+        """
+        self.position = position
+        self.offer = offer
+        self.qualifying = offer.qualifying_sku
+        self.qualifying_qty = offer.qualifying_qty
+        self.discounted = offer.discounted_sku
+        # As product.Product.discount_amount
+        self.unit_discount = int(unit_price * offer.discount_percent / 100.0)
+
+
+class PricingPlan:
+    """Class that encapsulates offers compiled into pricing rules.
+
+    Prices and rules are held in lists indexed by SKU id.  Rules are held
+    in the order of the offers they were compiled from and are grouped by
+    the SKU ids of their qualifying and discounted products, and by the
+    pair of the two.  Offers involving products that are not in the goods
+    can never apply and are left out.  Rules that can never be allocated
+    whatever the basket (see ``shadowed``) are kept in ``rules`` but left
+    out of the groups, so pricing never evaluates them.
+
+    Pricing a basket only evaluates the rules between products in the
+    basket.  Where a product qualifies for more rules than there are
+    products in the basket, those rules are looked up by pair, so a basket
+    of a few items costs the same however many offers there are.
+    """
+
+    strategy = ORDERED
+    by_pair = None
+
+    def __init__(self, goods, offers, strategy=ORDERED):
+        """
+        :param dict goods: The goods available.
+        :param list offers: The offers available.
+        :param str strategy: How competing offers are allocated, one of
+          ``STRATEGIES``.
+        :raises: ValueError if the strategy is not recognised.
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError('Unknown strategy {!r}'.format(strategy))
+        self.strategy = strategy
+        # Tables are indexed by the SKU ids of the goods alone, which may
+        # be far fewer than the process has interned
+        size = max((p.sku for p in goods.values()), default=-1) + 1
+        self.prices = [0] * size
+        in_stock = [False] * size
+        for p in goods.values():
+            self.prices[p.sku] = p.price
+            in_stock[p.sku] = True
+        self.rules = []
+        for position, offer in enumerate(offers):
+            qualifying = offer.qualifying_sku
+            discounted = offer.discounted_sku
+            if (qualifying < size and discounted < size and
+                    in_stock[qualifying] and in_stock[discounted]):
+                self.rules.append(Rule(position, offer,
+                                       self.prices[discounted]))
+
+        # Rules that can never be allocated are left out of the indexes, so
+        # are never evaluated
+        self.shadowed = shadowed(self.rules, strategy)
+        self._index(size)
+
+    def _index(self, size):
+        """Group the rules that can be allocated by SKU id and pair.
+
+        :param int size: Number of SKU ids the tables are indexed by.
+        """
+        by_qualifying = [[] for _ in range(size)]
+        by_discounted = [[] for _ in range(size)]
+        by_pair = {}
+        for index, rule in enumerate(self.rules):
+            if index in self.shadowed:
+                continue
+            by_qualifying[rule.qualifying].append(index)
+            by_discounted[rule.discounted].append(index)
+            by_pair.setdefault((rule.qualifying, rule.discounted),
+                               []).append(index)
+        self.by_qualifying = [tuple(rules) for rules in by_qualifying]
+        self.by_discounted = [tuple(rules) for rules in by_discounted]
+        self.by_pair = {pair: tuple(rules) for pair, rules in by_pair.items()}
+
+    def allocate(self, counts):
+        """Allocate offers to the units in a basket.
+
+        With the ``ORDERED`` strategy rules are applied in order, each to
+        as many of the leading units of its discounted product as have been
+        earned, replacing any rule already applied to those units.
+
+        :param dict counts: Quantity of each SKU id in the basket.
+        :return dict: For each discounted SKU id, a list of
+          ``(rule, quantity)`` tuples covering its leading units in order.
+        """
+        if self.strategy == EXCLUSIVE:
+            return solver.allocate(self, counts)
+
+        earned = {}
+        for index in self.relevant(counts):
+            rule = self.rules[index]
+            available = counts.get(rule.discounted)
+            if not available:
+                continue
+            num_discounts = counts[rule.qualifying] // rule.qualifying_qty
+            if num_discounts:
+                earned.setdefault(rule.discounted, []).append(
+                    (min(num_discounts, available), rule))
+        allocations = {}
+        for sku, grants in earned.items():
+            allocation = self.cover(grants, counts[sku])
+            if allocation:
+                allocations[sku] = allocation
+        return allocations
+
+    def relevant(self, counts):
+        """The rules that can apply to a basket.
+
+        :param dict counts: Quantity of each SKU id in the basket.
+        :return list: Indices of the rules whose qualifying product is in
+          the basket, in order.  Those whose discounted product is not in
+          the basket are left out where that is the quicker way to look
+          them up.
+        """
+        by_qualifying = self.by_qualifying
+        by_pair = self.by_pair
+        # Each rule has one qualifying product so there are no duplicates
+        candidates = []
+        for sku in counts:
+            indices = by_qualifying[sku]
+            if by_pair is not None and len(indices) > len(counts):
+                for discounted in counts:
+                    candidates.extend(by_pair.get((sku, discounted), ()))
+            else:
+                candidates.extend(indices)
+        candidates.sort()
+        return candidates
+
+    def involving(self, sku, counts):
+        """The rules a change to the quantity of a SKU can re-allocate.
+
+        :param int sku: SKU id.
+        :param dict counts: Quantity of each SKU id in the basket.
+        :return: Indices of the rules qualifying for or discounting the SKU.
+          Those whose other product is not the SKU itself or in the basket
+          are left out where that is the quicker way to look them up.
+        """
+        by_pair = self.by_pair
+        indices = self.by_qualifying[sku] + self.by_discounted[sku]
+        if by_pair is None or len(indices) <= 2 * (len(counts) + 1):
+            return indices
+        indices = list(by_pair.get((sku, sku), ()))
+        for other in counts:
+            if other != sku:
+                indices.extend(by_pair.get((sku, other), ()))
+                indices.extend(by_pair.get((other, sku), ()))
+        return indices
+
+    def cover(self, grants, available):
+        """Work out which rule each unit of a product ends up with.
+
+        :param list grants: ``(quantity, rule)`` tuples in the order of the
+          rules, each rule having earned ``quantity`` discounts.
+        :param int available: Quantity of the product in the basket.
+        :return list: ``(rule, quantity)`` tuples covering the leading
+          units in order.
+        """
+        if self.strategy == BEST:
+            return best_cover(grants, available)
+        return cover(grants)
+
+    def new_allocator(self):
+        """Make an allocator of this plan's offers for a basket.
+
+        :return: ``Allocator``, or ``SolvingAllocator`` for the
+          ``EXCLUSIVE`` strategy.
+        """
+        if self.strategy == EXCLUSIVE:
+            return SolvingAllocator(self)
+        return Allocator(self)
+
+    def discount(self, allocations):
+        """The discount given by allocated offers.
+
+        :param dict allocations: Allocations as from ``allocate``.
+        :return: Discount amount in pence.
+        """
+        return sum(discount(allocation)
+                   for allocation in allocations.values())
+
+    def subtotal(self, counts):
+        """The price of a basket without discounts applied.
+
+        :param dict counts: Quantity of each SKU id in the basket.
+        :return: Price in pence.
+        """
+        prices = self.prices
+        return sum(prices[sku] * quantity for sku, quantity in counts.items())
+
+
+class Allocator:
+    """Class that maintains the allocation of offers to a basket as the
+    quantities in the basket change.
+
+    Changing the quantity of a SKU only re-evaluates the rules that SKU
+    qualifies for or is discounted by, and only re-allocates the products
+    discounted by rules whose number of discounts earned has changed.  The
+    allocations are always those ``PricingPlan.allocate`` would give for
+    ``counts``.
+
+    The number of quantity changes made (``updates``) and of rules
+    evaluated as a result (``evaluated``) are counted for profiling.
+
+    The ``EXCLUSIVE`` strategy is not supported, as changing one quantity
+    can change the allocation of any product (see ``SolvingAllocator``).
+    """
+
+    def __init__(self, plan):
+        """
+        :param plan: ``PricingPlan`` to allocate the offers of.
+        """
+        self.plan = plan
+        self.counts = {}
+        self.earned = {}
+        self.allocations = {}
+        self.discount = 0
+        self.updates = 0
+        self.evaluated = 0
+
+    def set_quantity(self, sku, quantity):
+        """Change the quantity of a SKU in the basket.
+
+        :param int sku: SKU id.
+        :param int quantity: New quantity, 0 to remove the SKU.
+        :return set: SKU ids whose allocations have changed.
+        """
+        counts = self.counts
+        if quantity:
+            counts[sku] = quantity
+        else:
+            counts.pop(sku, None)
+        changed = self._update_earned(sku)
+        if self.plan.strategy == BEST and self.plan.by_discounted[sku]:
+            # Covering the units left depends on the quantity too
+            changed.add(sku)
+        for discounted in changed:
+            self._reallocate(discounted)
+        return changed
+
+    def _update_earned(self, sku):
+        """Re-evaluate the rules involving a SKU whose quantity changed.
+
+        :param int sku: SKU id.
+        :return set: SKU ids discounted by rules whose number of discounts
+          earned has changed.
+        """
+        plan = self.plan
+        counts = self.counts
+        changed = set()
+        indices = plan.involving(sku, counts)
+        self.updates += 1
+        self.evaluated += len(indices)
+        for index in indices:
+            rule = plan.rules[index]
+            qualifying = counts.get(rule.qualifying, 0)
+            earned = min(qualifying // rule.qualifying_qty,
+                         counts.get(rule.discounted, 0))
+            if earned != self.earned.get(index, 0):
+                if earned:
+                    self.earned[index] = earned
+                else:
+                    del self.earned[index]
+                changed.add(rule.discounted)
+        return changed
+
+    def _reallocate(self, discounted):
+        """Allocate the rules discounting a SKU again.
+
+        :param int discounted: SKU id.
+        """
+        plan = self.plan
+        indices = plan.by_discounted[discounted]
+        if len(indices) > len(self.earned):
+            indices = sorted(index for index in self.earned
+                             if plan.rules[index].discounted == discounted)
+        old = self.allocations.pop(discounted, ())
+        new = plan.cover([(self.earned[index], plan.rules[index])
+                          for index in indices if index in self.earned],
+                         self.counts.get(discounted, 0))
+        if new:
+            self.allocations[discounted] = new
+        self.discount += discount(new) - discount(old)
+
+    def settle(self):
+        """Bring the allocations up to date.
+
+        They are kept up to date by ``set_quantity``, so there is nothing
+        to do.
+
+        :return: Empty set of SKU ids whose allocations have changed.
+        """
+        return _UNCHANGED
+
+
+class SolvingAllocator:
+    """Class that allocates the offers of a plan to a basket when asked,
+    solving the allocation for the basket as a whole.
+
+    As ``Allocator``, except that ``settle`` must be called after changing
+    quantities to bring ``allocations`` and ``discount`` up to date.
+    """
+
+    def __init__(self, plan):
+        """
+        :param plan: ``PricingPlan`` to allocate the offers of.
+        """
+        self.plan = plan
+        self.counts = {}
+        self.allocations = {}
+        self.discount = 0
+        self.updates = 0
+        self.evaluated = 0
+        self._stale = False
+
+    def set_quantity(self, sku, quantity):
+        """Change the quantity of a SKU in the basket.
+
+        :param int sku: SKU id.
+        :param int quantity: New quantity, 0 to remove the SKU.
+        :return set: Empty set, changes being found by ``settle``.
+        """
+        if quantity:
+            self.counts[sku] = quantity
+        else:
+            self.counts.pop(sku, None)
+        self.updates += 1
+        self._stale = True
+        return _UNCHANGED
+
+    def settle(self):
+        """Bring the allocations up to date, if quantities have changed.
+
+        :return set: SKU ids whose allocations have changed.
+        """
+        if not self._stale:
+            return _UNCHANGED
+        plan = self.plan
+        old = self.allocations
+        new = plan.allocate(self.counts)
+        self.evaluated += sum(len(plan.by_qualifying[sku])
+                              for sku in self.counts)
+        self.allocations = new
+        self.discount = plan.discount(new)
+        self._stale = False
+        return {sku for sku in old.keys() | new.keys()
+                if old.get(sku) != new.get(sku)}
+
+
+_UNCHANGED = frozenset()
+
+
+def discount(allocation):
+    """The discount given by the offers allocated to a product.
+
+    :param list allocation: ``(rule, quantity)`` tuples.
+    :return: Discount amount in pence.
+    """
+    return sum(rule.unit_discount * quantity for rule, quantity in allocation)
+
+
+def cover(grants):
+    """Work out which rule each unit of a product ends up with.
+
+    :param list grants: ``(quantity, rule)`` tuples in the order applied,
+      each rule applying to the leading ``quantity`` units.
+    :return list: ``(rule, quantity)`` tuples covering the leading units in
+      order, where each unit has the last rule applied to it.
+    """
+    allocation = []
+    covered = 0
+    for quantity, rule in reversed(grants):
+        if quantity > covered:
+            allocation.append((rule, quantity - covered))
+            covered = quantity
+    return allocation
+
+
+def best_cover(grants, available):
+    """Work out which rule each unit of a product ends up with, giving
+    each unit the largest discount earned.
+
+    :param list grants: ``(quantity, rule)`` tuples in the order of the
+      rules, each rule having earned ``quantity`` discounts.
+    :param int available: Quantity of the product.
+    :return list: ``(rule, quantity)`` tuples covering the leading units in
+      order, largest discount first.
+    """
+    allocation = []
+    # Sorting is stable, so earlier rules win ties
+    for quantity, rule in sorted(grants, key=lambda g: -g[1].unit_discount):
+        if available <= 0 or rule.unit_discount <= 0:
+            break
+        quantity = min(quantity, available)
+        allocation.append((rule, quantity))
+        available -= quantity
+    return allocation
+
+
+def shadowed(rules, strategy=ORDERED):
+    """The rules that can never be allocated, whatever the basket.
+
+    With ``ORDERED`` a rule is shadowed by a later rule between the same
+    products needing no more qualifying units, which always earns at least
+    as many discounts and so replaces it on every unit.  With ``BEST`` and
+    ``EXCLUSIVE`` a rule giving no discount is never allocated.  With
+    ``EXCLUSIVE`` a rule is also shadowed by another between the same
+    products needing no more qualifying units for at least as much
+    discount (see ``solver.candidates``).
+
+    :param list rules: ``Rule`` instances, in the order of their offers.
+    :param str strategy: How competing offers are allocated, one of
+      ``STRATEGIES``.
+    :return dict: For the index of each rule shadowed, the index of a rule
+      shadowing it, or None if it gives no discount.
+    """
+    by_pair = {}
+    for index, rule in enumerate(rules):
+        by_pair.setdefault((rule.qualifying, rule.discounted),
+                           []).append(index)
+    found = {}
+    for indices in by_pair.values():
+        if strategy == ORDERED:
+            least = None  # Latest rule needing the fewest qualifying units
+            for index in reversed(indices):
+                if least is not None and (rules[least].qualifying_qty <=
+                                          rules[index].qualifying_qty):
+                    found[index] = least
+                else:
+                    least = index
+            continue
+        if strategy == EXCLUSIVE:
+            # As solver.candidates: fewest qualifying units first, then
+            # largest discount first
+            indices = sorted(indices, key=lambda i: (
+                rules[i].qualifying_qty, -rules[i].unit_discount, i))
+        best = None  # Rule giving the largest discount so far
+        for index in indices:
+            unit_discount = rules[index].unit_discount
+            if unit_discount <= 0:
+                found[index] = None
+            elif strategy == EXCLUSIVE and best is not None and (
+                    rules[best].unit_discount >= unit_discount):
+                found[index] = best
+            else:
+                best = index
+    return found
+
+
+def compile_offers(goods, offers, strategy=ORDERED):
+    """Compile offers into a pricing plan.
+
+    :param dict goods: The goods available.
+    :param list offers: The offers available.
+    :param str strategy: How competing offers are allocated, one of
+      ``STRATEGIES``.
+    :return: ``PricingPlan`` instance.
+    """
+    return PricingPlan(goods, offers, strategy)
@@ -0,0 +1,100 @@
+"""Graph module.
+
+Analyses a set of offers when loaded, as a graph between products with an
+edge from the qualifying product to the discounted product of each offer.
+An offer can only apply to a basket holding both of its products, so the
+offers relevant to a basket are the edges between the products it holds,
+however many offers there are in all.  ``engine.PricingPlan.relevant``
+looks up the rules it evaluates for a basket that way.
+
+The analysis finds the offers that:
+
+- Are unavailable, as one of their products is not in the goods.
+- Are shadowed, as they can never be allocated whatever the basket (see
+  ``engine.shadowed``), and so are never evaluated when pricing.
+- Conflict, competing with other offers for the units of a product, where
+  the strategy decides which apply.  With ``engine.ORDERED`` and
+  ``engine.BEST`` those are the offers discounting the same product, and
+  with ``engine.EXCLUSIVE`` the offers using the same product either to
+  qualify or to be discounted.
+"""
+
+from basket import engine
+from basket import product
+
+
+class OfferGraph:
+    """Class that encapsulates the offers of a catalogue as a graph between
+    the products they involve.
+
+    Offers are referred to by their position in the offers list.
+    """
+
+    def __init__(self, goods, offers, strategy=engine.ORDERED):
+        """
+        :param dict goods: The goods available.
+        :param list offers: The offers available.
+        :param str strategy: How competing offers are allocated, one of
+          ``engine.STRATEGIES``.
+        """
+        self.goods = goods
+        self.offers = list(offers)
+        self.plan = plan = engine.compile_offers(goods, self.offers,
+                                                 strategy)
+        compiled = {rule.position for rule in plan.rules}
+        self.unavailable = [position for position in range(len(self.offers))
+                            if position not in compiled]
+        self.shadowed = {
+            plan.rules[index].position:
+            None if by is None else plan.rules[by].position
+            for index, by in sorted(plan.shadowed.items())}
+
+        competing = {}
+        for index, rule in enumerate(plan.rules):
+            if index in plan.shadowed:
+                continue
+            if strategy == engine.EXCLUSIVE:
+                contested = {rule.qualifying, rule.discounted}
+            else:
+                contested = (rule.discounted,)
+            for sku in contested:
+                competing.setdefault(sku, []).append(rule.position)
+        self.conflicts = {sku: tuple(positions)
+                          for sku, positions in competing.items()
+                          if len(positions) > 1}
+
+    def report(self):
+        """Report the offers that are unavailable, shadowed or conflict.
+
+        :return dict: The number of offers and of those that can apply,
+          the id, title and missing products of each offer unavailable, the
+          id and title of each offer shadowed and the id of the offer
+          shadowing it (None if it gives no discount), and for each product
+          whose units offers compete for, the ids of those offers, most
+          first.
+        """
+        offers = self.offers
+        conflicts = [{
+            'product': product.sku_name(sku),
+            'offers': [offers[position].offer_id for position in positions],
+        } for sku, positions in self.conflicts.items()]
+        conflicts.sort(key=lambda c: (-len(c['offers']), c['product']))
+        return {
+            'offers': len(offers),
+            'applicable': (len(offers) - len(self.unavailable) -
+                           len(self.shadowed)),
+            'unavailable': [{
+                'id': offers[position].offer_id,
+                'title': offers[position].title,
+                'missing': sorted({
+                    name for name in (offers[position].qualifying_product,
+                                      offers[position].discounted_product)
+                    if name not in self.goods}),
+            } for position in self.unavailable],
+            'shadowed': [{
+                'id': offers[position].offer_id,
+                'title': offers[position].title,
+                'shadowed_by': None if by is None else offers[by].offer_id,
+            } for position, by in self.shadowed.items()],
+            'conflicts': conflicts,
+        }
@@ -0,0 +1,308 @@
+"""Logs module.
+
+Logging for the basket package, through the standard ``logging`` module's
+``basket`` logger.  The logger is left to the application using the
+package to configure, as for any library.  The command line program calls
+``configure``, so that messages are written to stdout as::
+
+    2016-12-17 14:03:02 INFO: Item 'eggs' not in stock
+
+Where results are written to stdout, as when pricing a batch, messages can
+be sent to stderr instead with ``output_to`` or ``set_output``.
+
+How much is logged (the verbosity) is a level set for the current context,
+with ``verbosity`` or ``set_verbosity``, rather than for the process, and
+so is the stream written to.  So each thread, asyncio task or request can
+log at its own level and to its own stream.  A new thread starts with an
+empty context, so nothing is logged there until its level is set.  Nothing
+is logged by default.
+
+Messages are formatted only once they pass the level, from a format string
+and arguments as with ``logging``, so a message below the level costs a
+single level check.  ``logging`` itself is not imported until the first
+message is written.  Warnings that can occur once per basket are logged
+with ``warning_limited``, which lets through a burst of each kind of
+warning per interval and counts the rest.
+"""
+
+import contextlib
+import contextvars
+import sys
+import threading
+import time
+
+
+# Log levels, as in the logging module
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+CRITICAL = 50
+OFF = 100  # Above every level, so nothing is logged
+
+LEVELS = {
+    'debug': DEBUG,
+    'info': INFO,
+    'warning': WARNING,
+    'error': ERROR,
+    'critical': CRITICAL,
+    'off': OFF,
+}
+
+_LEVEL = contextvars.ContextVar('basket_log_level', default=OFF)
+
+# Name of the sys stream messages are written to
+_OUTPUT = contextvars.ContextVar('basket_log_output', default='stdout')
+
+_LOGGER = None
+_LOGGER_LOCK = threading.Lock()
+
+# Whether the logger is set up to write to the output stream
+_CONFIGURED = False
+
+
+def level():
+    """The log level of the current context.
+
+    :return int: The lowest level of message logged.
+    """
+    return _LEVEL.get()
+
+
+def enabled(message_level):
+    """Whether messages of a level are logged in the current context.
+
+    :param int message_level: Log level.
+    :return bool: True if the messages are logged.
+    """
+    return message_level >= _LEVEL.get()
+
+
+def set_verbosity(log_level):
+    """Set the log level of the current context.
+
+    :param int log_level: The lowest level of message to log.
+    """
+    _LEVEL.set(log_level)
+
+
+@contextlib.contextmanager
+def verbosity(log_level):
+    """Set the log level of the current context until the block exits.
+
+    :param int log_level: The lowest level of message to log.
+    """
+    token = _LEVEL.set(log_level)
+    try:
+        yield
+    finally:
+        _LEVEL.reset(token)
+
+
+def log(message_level, message, *args):
+    """Log a message if its level is logged in the current context.
+
+    :param int message_level: Log level of the message.
+    :param str message: Message, a ``%`` format string for ``args``.
+    :param args: Arguments formatted into the message when logged.
+    """
+    if message_level >= _LEVEL.get():
+        get_logger().log(message_level, message, *args)
+
+
+def debug(message, *args):
+    """Log a message at ``DEBUG`` level.  See ``log``."""
+    log(DEBUG, message, *args)
+
+
+def info(message, *args):
+    """Log a message at ``INFO`` level.  See ``log``."""
+    log(INFO, message, *args)
+
+
+def warning(message, *args):
+    """Log a message at ``WARNING`` level.  See ``log``."""
+    log(WARNING, message, *args)
+
+
+def error(message, *args):
+    """Log a message at ``ERROR`` level.  See ``log``."""
+    log(ERROR, message, *args)
+
+
+class RateLimiter:
+    """Class that limits how often each kind of message is let through.
+
+    Up to ``burst`` messages of a kind are let through per ``interval``
+    seconds, and the rest are counted.
+    """
+
+    def __init__(self, burst=10, interval=60.0, clock=time.monotonic):
+        """
+        :param int burst: Most messages of a kind let through per interval.
+        :param float interval: Length of an interval in seconds.
+        :param clock: Callable returning the time in seconds.
+        """
+        self.burst = burst
+        self.interval = interval
+        self.clock = clock
+        self._kinds = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """Count a message, and decide whether to let it through.
+
+        :param key: Hashable kind of the message.
+        :return: None if the message is held back, otherwise the number of
+          messages of the kind held back since the last let through.
+        """
+        now = self.clock()
+        with self._lock:
+            state = self._kinds.get(key)
+            if state is None or now - state[0] >= self.interval:
+                # A new interval: [start, let through, held back]
+                held_back = 0 if state is None else state[2]
+                self._kinds[key] = [now, 1, 0]
+                return held_back
+            if state[1] < self.burst:
+                state[1] += 1
+                return 0
+            state[2] += 1
+            return None
+
+
+_LIMITER = RateLimiter()
+
+
+def warning_limited(message, *args, key=None):
+    """Log a warning, rate limited by kind.
+
+    The first message let through after some were held back says how many
+    were.
+
+    :param str message: Message, a ``%`` format string for ``args``.
+    :param args: Arguments formatted into the message when logged.
+    :param key: Kind of the message, by default the message itself.
+    """
+    if WARNING < _LEVEL.get():
+        return
+    held_back = _LIMITER.allow(message if key is None else key)
+    if held_back is None:
+        return
+    if held_back:
+        message += ' (%d similar messages suppressed)'
+        args += (held_back,)
+    get_logger().warning(message, *args)
+
+
+def output():
+    """The stream messages are written to in the current context.
+
+    :return str: ``'stdout'`` or ``'stderr'``.
+    """
+    return _OUTPUT.get()
+
+
+def _check_output(stream_name):
+    if stream_name not in ('stdout', 'stderr'):
+        raise ValueError('Unknown log output {!r}'.format(stream_name))
+
+
+def set_output(stream_name):
+    """Set the stream messages are written to in the current context.
+
+    :param str stream_name: ``'stdout'`` or ``'stderr'``.
+    :raises: ValueError if the stream name is not recognised.
+    """
+    _check_output(stream_name)
+    _OUTPUT.set(stream_name)
+
+
+@contextlib.contextmanager
+def output_to(stream_name):
+    """Set the stream messages are written to in the current context until
+    the block exits.
+
+    :param str stream_name: ``'stdout'`` or ``'stderr'``.
+    :raises: ValueError if the stream name is not recognised.
+    """
+    _check_output(stream_name)
+    token = _OUTPUT.set(stream_name)
+    try:
+        yield
+    finally:
+        _OUTPUT.reset(token)
+
+
+class _Output:
+    """File like object writing to the output stream of the context it is
+    written from, so that logs follow ``set_output`` and a replaced
+    ``sys.stdout``."""
+
+    def write(self, text):
+        """Write to the output stream of the current context.
+
+        :param str text: Text to write.
+        """
+        getattr(sys, _OUTPUT.get()).write(text)
+
+    def flush(self):
+        """Flush the output stream of the current context."""
+        getattr(sys, _OUTPUT.get()).flush()
+
+
+def get_logger():
+    """The ``basket`` logger, set up by ``configure`` if it has been called.
+
+    :return: ``logging.Logger`` instance.
+    """
+    global _LOGGER  # pylint: disable=global-statement
+    if _LOGGER is None:
+        with _LOGGER_LOCK:
+            if _LOGGER is None:
+                import logging  # pylint: disable=import-outside-toplevel
+                logger = logging.getLogger('basket')
+                if _CONFIGURED:
+                    _set_up(logger)
+                _LOGGER = logger
+    return _LOGGER
+
+
+def configured():
+    """Whether ``configure`` has been called.
+
+    :return bool: True if the ``basket`` logger writes to the output stream.
+    """
+    return _CONFIGURED
+
+
+def configure():
+    """Set up the ``basket`` logger to write to the output stream, for the
+    command line program.
+
+    Levels are then checked by this module alone, so the logger passes
+    every message to its handler.  It does not propagate messages to the
+    root logger.  ``logging`` is still not imported until the first message
+    is written.  Calling this again changes nothing.
+    """
+    global _CONFIGURED  # pylint: disable=global-statement
+    with _LOGGER_LOCK:
+        if _CONFIGURED:
+            return
+        _CONFIGURED = True
+        if _LOGGER is not None:
+            _set_up(_LOGGER)
+
+
+def _set_up(logger):
+    """Add the handler writing to the output stream to a logger.
+
+    :param logger: ``logging.Logger`` instance.
+    """
+    import logging  # pylint: disable=import-outside-toplevel
+    handler = logging.StreamHandler(_Output())
+    handler.setFormatter(logging.Formatter(
+        '%(asctime)s %(levelname)s: %(message)s', '%Y-%m-%d %H:%M:%S'))
+    logger.addHandler(handler)
+    logger.setLevel(DEBUG)
+    logger.propagate = False
@@ -1,9 +1,15 @@
 """Offer module."""
 
+from basket import product
+
 
 class Offer:
     """Class that encapsulates a product offer."""
 
+    __slots__ = ('offer_id', 'title', 'qualifying_product', 'qualifying_sku',
+                 'qualifying_qty', 'discounted_product', 'discounted_sku',
+                 'discount_percent')
+
     def __init__(self, offer_def):
         """
         Given a definition, constructs a product offer that can be applied to
@@ -17,9 +23,13 @@ class Offer:
         """
         self.offer_id = offer_def['id']
         self.title = offer_def['title']
-        self.qualifying_product = offer_def['qualifying_product'].lower()
+        self.qualifying_sku = product.intern_sku(
+            offer_def['qualifying_product'].lower())
+        self.qualifying_product = product.sku_name(self.qualifying_sku)
         self.qualifying_qty = int(offer_def['qualifying_qty'])
         if not self.qualifying_qty:
             raise ValueError('Unacceptable value for qualifying_qty')
-        self.discounted_product = offer_def['discounted_product'].lower()
+        self.discounted_sku = product.intern_sku(
+            offer_def['discounted_product'].lower())
+        self.discounted_product = product.sku_name(self.discounted_sku)
         self.discount_percent = float(offer_def['discount_percent'])
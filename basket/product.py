@@ -1,9 +1,84 @@
 """Product module."""
 
+import functools
+import sys
+import threading
+
+
+# Product names interned as dense integer SKU ids, shared by every product
+# and offer made by the process so that ids are stable across catalogues.
+# Ids are never freed: loading a catalogue again (as when the files are
+# reloaded) gives each name the id it already has, so the table only grows
+# by the names never seen before, up to ``MAX_SKUS`` of them.  Names renamed
+# or removed from the files keep their ids, so a long running service
+# reloading files whose product names keep changing eventually reaches the
+# limit, after which files naming new products fail to load (raising
+# ``SkuLimitError``) until the process is restarted.  Pricing plans are
+# sized by the largest id among their goods, so a catalogue's own ids are
+# dense unless many of the names interned before it have since gone.
+_SKU_IDS = {}
+_SKU_NAMES = []
+_SKU_LOCK = threading.Lock()
+
+# Most product names interned by the process
+MAX_SKUS = 1 << 20
+
+# Most discount messages kept formatted, each for an offer title and
+# discount amount
+MESSAGE_CACHE_SIZE = 4096
+
+
+class SkuLimitError(ValueError):
+    """Raised when a new product name is interned once ``MAX_SKUS`` names
+    already are."""
+
+
+def intern_sku(name):
+    """Intern a product name as an integer SKU id.
+
+    :param str name: Product name (lower case).
+    :return int: The SKU id, the same for every call with the same name.
+    :raises: SkuLimitError if the name is new and ``MAX_SKUS`` names are
+      already interned.
+    """
+    try:
+        return _SKU_IDS[name]
+    except KeyError:
+        with _SKU_LOCK:
+            sku = _SKU_IDS.get(name)
+            if sku is None:
+                sku = len(_SKU_NAMES)
+                if sku >= MAX_SKUS:
+                    raise SkuLimitError(
+                        'Too many product names interned ({}), restart to '
+                        'load new names'.format(MAX_SKUS)) from None
+                _SKU_NAMES.append(name)
+                _SKU_IDS[name] = sku
+            return sku
+
+
+def sku_name(sku):
+    """The product name of an interned SKU id.
+
+    :param int sku: SKU id.
+    :return str: Product name.
+    """
+    return _SKU_NAMES[sku]
+
+
+def sku_count():
+    """The number of SKU ids interned so far.
+
+    :return int: One more than the largest SKU id.
+    """
+    return len(_SKU_NAMES)
+
 
 class Product:
     """Class that encapsulates a product item to be purchased."""
 
+    __slots__ = ('name', 'sku', 'price', 'unit', '_offer')
+
     def __init__(self, name, price, unit):
         """
         Given a name, price and unit constructs a product that can be
@@ -13,9 +88,12 @@ class Product:
         :param price: Price of the product in pence.
         :param unit: The product's unit of quantity, e.g. bag or loaf.
         """
-        self.name = name.lower()
+        # Names and units are shared with every other product made with
+        # the same ones, rather than each product holding its own copy
+        self.sku = intern_sku(name.lower())
+        self.name = sku_name(self.sku)
         self.price = int(price)  # Assumed price is in pence
-        self.unit = unit.lower()
+        self.unit = sys.intern(unit.lower())
         self._offer = None
 
     def apply_offer(self, offer):
@@ -38,6 +116,14 @@ class Product:
         """
         return self._offer is not None
 
+    @property
+    def offer(self):
+        """The offer applied to this product.
+
+        :return: ``offer.Offer`` instance, or None.
+        """
+        return self._offer
+
     @property
     def discounted_price(self):
         """The product price with discount applied.
@@ -64,10 +150,22 @@ class Product:
 
         :return: String message.
         """
-        discount_amount_str = '-£{:.2f}'.format(self.discount_amount/100)
-        if self.discount_amount < 100:
-            discount_amount_str = '-{}p'.format(self.discount_amount)
         if self._offer:
-            return '{}: {}'.format(
-                self._offer.title, discount_amount_str)
+            return discount_message(self._offer.title, self.discount_amount)
         return None
+
+
+@functools.lru_cache(maxsize=MESSAGE_CACHE_SIZE)
+def discount_message(title, discount_amount):
+    """A message representing a discount given by an offer.
+
+    Messages are memoized, as the same few are given for every unit an
+    offer discounts.
+
+    :param str title: Title of the offer.
+    :param int discount_amount: Discount amount in pence.
+    :return: String message.
+    """
+    if discount_amount < 100:
+        return '{}: -{}p'.format(title, discount_amount)
+    return '{}: -£{:.2f}'.format(title, discount_amount/100)
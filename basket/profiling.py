@@ -0,0 +1,184 @@
+"""Profiling module.
+
+Opt-in instrumentation of the pricing hot paths.  While a ``Profile`` is
+active (see ``Profile.start``, or use it as a context manager) the time
+spent in each phase of pricing is recorded: loading JSON, building
+products and offers, compiling the offers, adding items, calculating
+discounts and formatting output.  The work done for each basket is counted
+too, from ``basket.Basket.statistics``.  A profile can also run
+``cProfile`` for a function level view, saved with ``Profile.dump_stats``
+for ``pstats``.
+
+Nothing is recorded, and the hot paths do no extra work beyond checking
+``ACTIVE``, unless a profile is active.  Only one profile is active at a
+time in a process.
+"""
+
+import contextlib
+import threading
+import time
+
+
+# The profile being recorded, if any
+ACTIVE = None
+
+# Context manager doing nothing, used when no profile is active
+_NO_PHASE = contextlib.nullcontext()
+
+
+class Profile:
+    """Class that records where the time pricing baskets is spent."""
+
+    def __init__(self, cprofile=False):
+        """
+        :param bool cprofile: Also run ``cProfile`` while active.
+        """
+        self.phases = {}
+        self.counters = {}
+        self.offers_applied = {}
+        self.baskets = 0
+        self.profiler = None
+        if cprofile:
+            import cProfile  # pylint: disable=import-outside-toplevel
+            self.profiler = cProfile.Profile()
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """Make this the active profile."""
+        global ACTIVE  # pylint: disable=global-statement
+        self._previous = ACTIVE
+        ACTIVE = self
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stop(self):
+        """Stop recording, restoring the profile active before ``start``."""
+        global ACTIVE  # pylint: disable=global-statement
+        if self.profiler is not None:
+            self.profiler.disable()
+        ACTIVE = self._previous
+        self._previous = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a phase of pricing.
+
+        :param str name: Name of the phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        """Record time spent in a phase.
+
+        :param str name: Name of the phase.
+        :param float seconds: Time spent.
+        """
+        with self._lock:
+            timing = self.phases.setdefault(name, [0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+
+    def record_basket(self, shopping_basket):
+        """Record the work done pricing a basket.
+
+        :param shopping_basket: ``basket.Basket`` priced.
+        """
+        statistics = shopping_basket.statistics
+        with self._lock:
+            self.baskets += 1
+            for name in ('items_scanned', 'offers_evaluated'):
+                self.counters[name] = (self.counters.get(name, 0) +
+                                       statistics[name])
+            # Keyed by id, as offers can share a title
+            for applied in statistics['offers_applied']:
+                counted = self.offers_applied.setdefault(
+                    applied.offer_id, [applied.title, 0])
+                counted[1] += 1
+
+    def report(self):
+        """The results recorded.
+
+        :return dict: For each phase its number of calls and total seconds,
+          the counters with their means per basket, and for each offer id
+          the offer's title and the number of baskets it was applied to.
+        """
+        with self._lock:
+            baskets = self.baskets
+            return {
+                'phases': {name: {'calls': calls, 'seconds': seconds}
+                           for name, (calls, seconds) in self.phases.items()},
+                'baskets': baskets,
+                'counters': dict(self.counters),
+                'per_basket': {name: value / baskets
+                               for name, value in self.counters.items()
+                               if baskets},
+                'offers_applied': {
+                    offer_id: {'title': title, 'baskets': count}
+                    for offer_id, (title, count)
+                    in self.offers_applied.items()},
+            }
+
+    def summary(self, top=10):
+        """A summary of the results recorded, for people.
+
+        :param int top: Number of the most applied offers to list.
+        :return str: The summary.
+        """
+        report = self.report()
+        total = sum(p['seconds'] for p in report['phases'].values())
+        lines = ['{:<22} {:>9} {:>12} {:>12} {:>6}'.format(
+            'phase', 'calls', 'total ms', 'mean us', '%')]
+        for name, timing in sorted(report['phases'].items(),
+                                   key=lambda p: -p[1]['seconds']):
+            lines.append('{:<22} {:>9} {:>12.3f} {:>12.3f} {:>6.1f}'.format(
+                name, timing['calls'], timing['seconds'] * 1e3,
+                timing['seconds'] / timing['calls'] * 1e6,
+                timing['seconds'] / total * 100 if total else 0.0))
+        lines.append('baskets: {}'.format(report['baskets']))
+        for name, value in sorted(report['counters'].items()):
+            lines.append('{}: {} ({:.1f} per basket)'.format(
+                name, value, report['per_basket'].get(name, 0.0)))
+        offers = sorted(report['offers_applied'].items(),
+                        key=lambda o: (-o[1]['baskets'], str(o[0])))[:top]
+        if offers:
+            lines.append('offers applied (baskets):')
+            for offer_id, applied in offers:
+                lines.append('  {:>9}  {}: {}'.format(
+                    applied['baskets'], offer_id, applied['title']))
+        return '\n'.join(lines)
+
+    def dump_stats(self, file_path):
+        """Save the ``cProfile`` statistics, for ``pstats``.
+
+        :param str file_path: Path of the file to write.
+        :raises: ValueError if the profile is not running ``cProfile``.
+        """
+        if self.profiler is None:
+            raise ValueError('cProfile was not enabled for this profile')
+        self.profiler.dump_stats(file_path)
+
+
+def phase(name):
+    """Time a phase of pricing in the active profile, if any.
+
+    Hot paths should check ``ACTIVE`` themselves rather than pay for a call
+    per basket.
+
+    :param str name: Name of the phase.
+    :return: Context manager.
+    """
+    if ACTIVE is None:
+        return _NO_PHASE
+    return ACTIVE.phase(name)
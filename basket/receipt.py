@@ -0,0 +1,218 @@
+"""Receipt module.
+
+Prices a basket of items in one call, giving a ``Receipt`` of the
+subtotal, discounts and total.  Unlike ``basket.Basket`` nothing is kept
+between calls and nothing shared is changed: the quantities and
+allocations of the basket are local to the call, the catalogue's products
+and offers are referred to rather than copied, and its pricing plan is
+only read.  So one catalogue can price baskets for any number of threads
+at once, without locking.
+
+``render_discounts`` renders discount lines for display, giving identical
+lines once with the number of units, e.g. ``Apples 10% off: -10p ×200``,
+so that rendering a large receipt costs only as much as its distinct
+lines.
+"""
+
+from basket import product
+
+
+class DiscountLine:
+    """Class that encapsulates an offer applied to some units of a product.
+
+    Not changed once made.
+    """
+
+    __slots__ = ('product', 'offer', 'quantity', 'unit_discount')
+
+    def __init__(self, prod, offer, quantity, unit_discount):
+        """
+        :param prod: The ``product.Product`` discounted.
+        :param offer: The ``offer.Offer`` applied.
+        :param int quantity: Number of units discounted.
+        :param int unit_discount: Discount per unit in pence.
+        """
+        self.product = prod
+        self.offer = offer
+        self.quantity = quantity
+        self.unit_discount = unit_discount
+
+    @property
+    def amount(self):
+        """The discount given across all units.
+
+        :return: Discount amount in pence.
+        """
+        return self.unit_discount * self.quantity
+
+    @property
+    def message(self):
+        """A message representing the discount given on each unit.
+
+        :return: String message, as ``product.Product.discount_message``.
+        """
+        return product.discount_message(self.offer.title, self.unit_discount)
+
+
+class Receipt:
+    """Class that encapsulates the price of a basket.
+
+    Not changed once made.
+    """
+
+    __slots__ = ('subtotal', 'discount', 'lines', 'unknown')
+
+    def __init__(self, subtotal, discount, lines, unknown):
+        """
+        :param int subtotal: Price without discounts applied, in pence.
+        :param int discount: Discount amount in pence.
+        :param tuple lines: ``DiscountLine`` instances, in the order the
+          units they discount were given.
+        :param tuple unknown: Items given that are not in stock.
+        """
+        self.subtotal = subtotal
+        self.discount = discount
+        self.lines = lines
+        self.unknown = unknown
+
+    @property
+    def total(self):
+        """The price with discounts applied.
+
+        :return: Price in pence.
+        """
+        return self.subtotal - self.discount
+
+    @property
+    def discounts(self):
+        """Messages representing the discounts given.
+
+        :return list: One message per discounted unit, as from
+          ``basket.Basket.discounted_items``.
+        """
+        return render_discounts(self.lines, expand=True)
+
+    def render(self, expand=False):
+        """Render the discounts given for display.
+
+        :param bool expand: Give one message per discounted unit rather than
+          one per distinct discount.
+        :return list: Messages, as from ``render_discounts``.
+        """
+        return render_discounts(self.lines, expand)
+
+
+def unit_order(runs, allocations):
+    """Split allocations across the units of products in the order they
+    were given.
+
+    An allocation covers the leading units of a product, so the first units
+    given of each product are the first discounted.
+
+    :param runs: Iterable of ``(key, quantity)`` tuples, giving the units of
+      each product (by key) in order.  A product can have several runs.
+    :param dict allocations: Lists of ``(value, quantity)`` pairs covering
+      the leading units of each product, by key.
+    :return list: ``[key, value, quantity]`` lists in the order of the
+      units, joining one list to the next where both have the same key and
+      value.
+    """
+    pieces = []
+    given = {}
+    for key, quantity in runs:
+        allocation = allocations.get(key)
+        if not allocation:
+            continue
+        start = given.get(key, 0)
+        end = given[key] = start + quantity
+        offset = 0
+        for value, covered in allocation:
+            low = max(start, offset)
+            offset += covered
+            high = min(end, offset)
+            if high > low:
+                last = pieces[-1] if pieces else None
+                if last is not None and last[0] == key and last[1] is value:
+                    last[2] += high - low
+                else:
+                    pieces.append([key, value, high - low])
+            if offset >= end:
+                break
+    return pieces
+
+
+def render_discounts(lines, expand=False):
+    """Render discount lines for display.
+
+    Lines giving the same message are rendered once, with the number of
+    units they discount if more than one, in the order first given.
+
+    :param lines: Iterable of ``DiscountLine`` instances.
+    :param bool expand: Give one message per discounted unit instead, as
+      ``Receipt.discounts`` does.
+    :return list: Messages.
+    """
+    if expand:
+        messages = []
+        for line in lines:
+            messages.extend([line.message] * line.quantity)
+        return messages
+    quantities = {}
+    for line in lines:
+        key = (line.offer.title, line.unit_discount)
+        quantities[key] = quantities.get(key, 0) + line.quantity
+    messages = []
+    for (title, unit_discount), quantity in quantities.items():
+        message = product.discount_message(title, unit_discount)
+        if quantity > 1:
+            messages.append('{} ×{}'.format(message, quantity))
+        else:
+            messages.append(message)
+    return messages
+
+
+def price(goods, plan, items):
+    """Price a basket of items.
+
+    :param goods: Mapping of the (lower case) names of the goods available
+      to ``product.Product`` instances.
+    :param plan: ``engine.PricingPlan`` compiled from the goods and offers.
+    :param items: Iterable of ``(item, quantity)`` tuples.
+    :return: ``Receipt`` instance.
+    :raises: ValueError if a quantity is not an integer of at least 1.
+    """
+    counts = {}
+    products = {}
+    runs = []
+    unknown = []
+    for item, quantity in items:
+        if (isinstance(quantity, bool) or not isinstance(quantity, int)
+                or quantity < 1):
+            raise ValueError('Unacceptable quantity for {}: {!r}'.format(
+                item, quantity))
+        try:
+            prod = goods[item.lower()]
+        except KeyError:
+            unknown.append(item)
+            continue
+        sku = prod.sku
+        runs.append((sku, quantity))
+        if sku in counts:
+            counts[sku] += quantity
+        else:
+            counts[sku] = quantity
+            products[sku] = prod
+
+    allocations = plan.allocate(counts)
+    if len(runs) == len(counts):
+        # Each product given once, so its units are all together
+        lines = [DiscountLine(products[sku], rule.offer, quantity,
+                              rule.unit_discount)
+                 for sku in counts
+                 for rule, quantity in allocations.get(sku, ())]
+    else:
+        lines = [DiscountLine(products[sku], rule.offer, quantity,
+                              rule.unit_discount)
+                 for sku, rule, quantity in unit_order(runs, allocations)]
+    return Receipt(plan.subtotal(counts), plan.discount(allocations),
+                   tuple(lines), tuple(unknown))
@@ -0,0 +1,176 @@
+"""Server module.
+
+A small resident HTTP service that keeps a loaded catalogue in memory and
+prices baskets posted to it as JSON, avoiding the cost of starting a
+process and loading the goods and offers for every basket.
+
+``POST /price`` accepts a basket in the same form as a ``--batch`` line
+(see ``basket.batch``) and responds with a JSON object holding the
+``subtotal`` and ``total`` in pence, the ``discounts`` messages and any
+``unknown`` items.  ``GET /health`` can be used to check the service is up.
+
+Each request is priced against the current version of the catalogue, so
+given a ``catalogue.CatalogueManager`` changes to the goods and offers are
+picked up without a restart.
+"""
+
+import http.server
+import json
+
+from basket import batch
+from basket import logs
+
+
+# Largest request body accepted, in bytes.
+MAX_BODY_SIZE = 1024 * 1024
+
+# Seconds a connection may wait on the client before it is closed.
+REQUEST_TIMEOUT = 30
+
+
+class PricingHandler(http.server.BaseHTTPRequestHandler):
+    """Handles pricing requests made to a ``PricingServer``."""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'basket/0.1'
+    timeout = REQUEST_TIMEOUT
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Respond to a health check."""
+        if self.path != '/health':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        self.send_json(200, {'status': 'ok'})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Price the posted basket."""
+        # Where the body is left unread the connection cannot be reused
+        if self.path != '/price':
+            self.close_connection = True
+            self.send_json(404, {'error': 'Not found'})
+            return
+        body = self.read_body()
+        if body is None:
+            return
+        try:
+            result = price_request(self.server.catalogue.current(), body,
+                                   self.server.pricing_cache)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except Exception as e:  # pylint: disable=broad-except
+            logs.error('Failed to price basket: %s', e)
+            self.send_json(500, {'error': 'Failed to price basket'})
+            return
+        self.send_json(200, result)
+
+    def read_body(self):
+        """Read the request body, responding with an error if its length is
+        missing, invalid or too large.
+
+        :return bytes: The body, or None if an error response was sent.
+        """
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.close_connection = True
+            self.send_json(411, {'error': 'Content-Length required'})
+            return None
+        if length < 0:
+            self.close_connection = True
+            self.send_json(400, {'error': 'Invalid Content-Length'})
+            return None
+        if length > MAX_BODY_SIZE:
+            self.close_connection = True
+            self.send_json(413, {'error': 'Basket too large'})
+            return None
+        return self.rfile.read(length)
+
+    def send_json(self, status, data):
+        """Send a JSON response.
+
+        :param int status: HTTP status code.
+        :param dict data: Response data.
+        """
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Log requests at ``INFO`` level."""
+        logs.info('%s ' + format, self.address_string(), *args)
+
+
+class PricingServer(http.server.ThreadingHTTPServer):
+    """Threaded HTTP server pricing baskets against a shared catalogue."""
+
+    daemon_threads = True
+
+    def __init__(self, address, catalogue, pricing_cache=None,
+                 log_level=None):
+        """
+        :param tuple address: ``(host, port)`` to listen on.
+        :param catalogue: ``catalogue.Catalogue`` to price against, or a
+          ``catalogue.CatalogueManager`` providing the current one.
+        :param pricing_cache: Optional ``cache.PricingCache``.
+        :param int log_level: Log level requests are handled at, by default
+          that of the context the server is created in.  Each request is
+          logged at ``INFO`` level.
+        """
+        super().__init__(address, PricingHandler)
+        self.catalogue = catalogue
+        self.pricing_cache = pricing_cache
+        self.log_level = logs.level() if log_level is None else log_level
+        self.log_output = logs.output()
+
+    def process_request_thread(self, request, client_address):
+        """Handle a request in its own thread, logging as the server does.
+
+        Each thread starts with an empty context, so would otherwise log
+        nothing.
+        """
+        logs.set_verbosity(self.log_level)
+        logs.set_output(self.log_output)
+        super().process_request_thread(request, client_address)
+
+
+def price_request(catalogue, body, pricing_cache=None):
+    """Price a basket from a request body.
+
+    :param catalogue: ``catalogue.Catalogue`` to price against.
+    :param bytes body: UTF-8 JSON text of the basket.
+    :param pricing_cache: Optional ``cache.PricingCache``.
+    :return dict: Pricing result, including the basket ``id`` if given.
+    :raises: ValueError if the body does not describe a basket.
+    """
+    try:
+        text = body.decode('utf-8')
+    except UnicodeDecodeError as e:
+        raise ValueError('Basket is not UTF-8 encoded') from e
+    basket_id, items = batch.parse_basket(text)
+    result = {'id': basket_id}
+    result.update(batch.price(catalogue, items, pricing_cache))
+    return result
+
+
+def serve(catalogue, host='127.0.0.1', port=8080, pricing_cache=None,
+          log_level=None):
+    """Serve pricing requests until interrupted.
+
+    :param catalogue: ``catalogue.Catalogue`` to price against, or a
+      ``catalogue.CatalogueManager`` providing the current one.
+    :param str host: Host address to listen on.
+    :param int port: Port to listen on.
+    :param pricing_cache: Optional ``cache.PricingCache``.
+    :param int log_level: Log level requests are handled at, by default
+      that of the current context.
+    """
+    with PricingServer((host, port), catalogue, pricing_cache,
+                       log_level) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,352 @@
+"""Simulate module.
+
+Works out how a change to the offers would change the prices of a history
+of baskets, without pricing every basket again.
+
+The history is held compactly, each basket as the SKU ids and quantities
+of the goods it holds, along with an inverted index from each SKU id to
+the baskets holding it.  The old and new offers are compared (see
+``diff_offers``), and since an offer can only apply to a basket holding
+both its qualifying and discounted products, only the baskets holding both
+products of a changed offer can be priced differently.  Those are found
+from the index and priced against both the old and the new offers; every
+other basket is priced the same by both.
+
+Offers are matched by id.  An offer is changed if it was added or removed,
+if its definition changed, or (as the order of offers decides which
+applies under ``engine.ORDERED``) if it moved relative to the other
+offers.
+"""
+
+import array
+import bisect
+
+from basket import batch
+from basket import engine
+
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+MOVED = 'moved'
+UNCHANGED = 'unchanged'
+
+
+class History:
+    """Class that holds a history of baskets and an inverted index of the
+    baskets holding each SKU.
+
+    Baskets are numbered in the order added.  Only goods in stock are held,
+    as no others are priced or can be discounted.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self._skus = array.array('I')
+        # Quantities are unbounded, so held as 64-bit
+        self._quantities = array.array('Q')
+        self._starts = array.array('Q', [0])
+        self._index = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, basket_id, counts):
+        """Add a basket.
+
+        :param basket_id: Id of the basket.
+        :param dict counts: Quantity of each SKU id in the basket.
+        :return int: Number of the basket.
+        """
+        number = len(self.ids)
+        self.ids.append(basket_id)
+        for sku, quantity in counts.items():
+            self._skus.append(sku)
+            self._quantities.append(quantity)
+            try:
+                self._index[sku].append(number)
+            except KeyError:
+                self._index[sku] = array.array('I', [number])
+        self._starts.append(len(self._skus))
+        return number
+
+    def counts(self, number):
+        """The quantity of each SKU id in a basket.
+
+        :param int number: Number of the basket.
+        :return dict: Quantities by SKU id.
+        """
+        start, end = self._starts[number], self._starts[number + 1]
+        return dict(zip(self._skus[start:end], self._quantities[start:end]))
+
+    def holding(self, skus):
+        """The baskets holding every one of some SKUs.
+
+        :param skus: SKU ids.
+        :return set: Numbers of the baskets.
+        """
+        postings = sorted((self._index.get(sku, ()) for sku in set(skus)),
+                          key=len)
+        if not postings or not postings[0]:
+            return set()
+        found = set(postings[0])
+        for posting in postings[1:]:
+            # Postings are in order, so the fewest can be looked up in the
+            # rest by binary search
+            found = {number for number in found
+                     if _contains(posting, number)}
+        return found
+
+
+def _contains(posting, number):
+    """Whether a sorted posting list holds a number."""
+    position = bisect.bisect_left(posting, number)
+    return position < len(posting) and posting[position] == number
+
+
+def load_history(goods, lines):
+    """Load a history of baskets given as JSON lines, as for ``batch``.
+
+    Lines that cannot be parsed are logged and skipped, as are items not in
+    stock.
+
+    :param goods: Mapping of the (lower case) names of the goods available
+      to ``product.Product`` instances.
+    :param lines: Iterable of JSON lines, e.g. an open file.
+    :return: ``History`` instance.
+    """
+    history = History()
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            basket_id, items = batch.parse_line(line_no, line)
+        except ValueError:
+            continue
+        counts = {}
+        for item, quantity in items:
+            prod = goods.get(item.lower())
+            if prod is not None:
+                counts[prod.sku] = counts.get(prod.sku, 0) + quantity
+        history.add(basket_id, counts)
+    return history
+
+
+def offer_keys(offers):
+    """Keys matching offers between versions of the offers.
+
+    An offer is keyed by its id and, for ids shared by several offers, by
+    how many came before it with the same id.
+
+    :param list offers: ``offer.Offer`` instances.
+    :return list: A hashable key per offer, in order.
+    """
+    seen = {}
+    keys = []
+    for o in offers:
+        # Ids come from JSON, so may not be hashable, and 1 is not '1'
+        ident = repr(o.offer_id)
+        keys.append((ident, seen.get(ident, 0)))
+        seen[ident] = keys[-1][1] + 1
+    return keys
+
+
+def definition(o):
+    """What an offer does, for comparing versions of it.
+
+    :param o: ``offer.Offer`` instance.
+    :return tuple: The offer's title, products, quantity and discount.
+    """
+    return (o.title, o.qualifying_sku, o.qualifying_qty, o.discounted_sku,
+            o.discount_percent)
+
+
+def diff_offers(old_offers, new_offers):
+    """Compare two versions of the offers.
+
+    Offers kept with the same definition are unchanged unless they moved:
+    the most of them that stay in the same order are taken as unchanged,
+    and the rest as moved.
+
+    :param list old_offers: ``offer.Offer`` instances before the change.
+    :param list new_offers: ``offer.Offer`` instances after the change.
+    :return dict: ``ADDED``, ``REMOVED``, ``CHANGED``, ``MOVED`` or
+      ``UNCHANGED`` for the key of each offer (see ``offer_keys``).
+    """
+    old = dict(zip(offer_keys(old_offers), enumerate(old_offers)))
+    new = dict(zip(offer_keys(new_offers), enumerate(new_offers)))
+    status = {key: REMOVED for key in old.keys() - new.keys()}
+    kept = []
+    for key, (_, o) in new.items():
+        if key not in old:
+            status[key] = ADDED
+        elif definition(old[key][1]) != definition(o):
+            status[key] = CHANGED
+        else:
+            kept.append(key)
+    # Kept offers in their new order, by old position
+    positions = [old[key][0] for key in kept]
+    in_order = _increasing(positions)
+    for i, key in enumerate(kept):
+        status[key] = UNCHANGED if i in in_order else MOVED
+    return status
+
+
+def _increasing(values):
+    """The positions of a longest increasing subsequence of values.
+
+    :param list values: Distinct numbers.
+    :return set: Positions in ``values``.
+    """
+    tails = []  # Least last value of an increasing run of each length
+    ends = []  # Position of each of those last values
+    previous = [None] * len(values)
+    for i, value in enumerate(values):
+        length = bisect.bisect_left(tails, value)
+        if length:
+            previous[i] = ends[length - 1]
+        if length == len(tails):
+            tails.append(value)
+            ends.append(i)
+        else:
+            tails[length] = value
+            ends[length] = i
+    positions = set()
+    i = ends[-1] if ends else None
+    while i is not None:
+        positions.add(i)
+        i = previous[i]
+    return positions
+
+
+def affected(history, status, old_offers, new_offers):
+    """The baskets that changes to the offers could price differently.
+
+    :param history: ``History`` of the baskets.
+    :param dict status: Status of each offer key, from ``diff_offers``.
+    :param list old_offers: ``offer.Offer`` instances before the change.
+    :param list new_offers: ``offer.Offer`` instances after the change.
+    :return list: Numbers of the baskets holding both products of an old
+      or new version of a changed offer, in order.
+    """
+    pairs = set()
+    for offers in (old_offers, new_offers):
+        for key, o in zip(offer_keys(offers), offers):
+            if status[key] != UNCHANGED:
+                pairs.add((o.qualifying_sku, o.discounted_sku))
+    numbers = set()
+    for pair in pairs:
+        numbers |= history.holding(pair)
+    return sorted(numbers)
+
+
+def simulate(goods, old_offers, new_offers, history,
+             strategy=engine.ORDERED):
+    """Work out how a change to the offers changes the prices of a history
+    of baskets.
+
+    :param goods: The goods available.
+    :param list old_offers: ``offer.Offer`` instances before the change.
+    :param list new_offers: ``offer.Offer`` instances after the change.
+    :param history: ``History`` of the baskets, made against ``goods``.
+    :param str strategy: How competing offers are allocated, one of
+      ``engine.STRATEGIES``.
+    :return dict: The number of baskets in the history, of those repriced
+      and of those whose price changed, the total price of the baskets
+      repriced before and after the change and the difference, and for each
+      offer applied to them before or after, its status, the units it
+      discounted and the discount it gave before and after the change.
+    """
+    status = diff_offers(old_offers, new_offers)
+    versions = [(engine.compile_offers(goods, offers, strategy),
+                 offer_keys(offers)) for offers in (old_offers, new_offers)]
+    numbers = affected(history, status, old_offers, new_offers)
+    totals, changed, applied = _reprice(history, numbers, versions)
+    return {
+        'baskets': len(history),
+        'repriced': len(numbers),
+        'changed': changed,
+        'total_before': totals[0],
+        'total_after': totals[1],
+        'total_delta': totals[1] - totals[0],
+        'offers': _offer_report(applied, status, old_offers, new_offers),
+    }
+
+
+def _reprice(history, numbers, versions):
+    """Price baskets before and after a change to the offers.
+
+    :param history: ``History`` of the baskets.
+    :param list numbers: Numbers of the baskets to price.
+    :param list versions: ``(plan, keys)`` tuples of the
+      ``engine.PricingPlan`` and the offer keys before and after the change.
+    :return tuple: The total price of the baskets before and after, the
+      number of baskets whose price changed, and a dict of the units
+      discounted before and after and the discount given before and after
+      by each offer applied, by offer key.
+    """
+    totals = [0, 0]
+    changed = 0
+    applied = {}
+    for number in numbers:
+        counts = history.counts(number)
+        basket_totals = []
+        for version, (plan, keys) in enumerate(versions):
+            allocations = plan.allocate(counts)
+            basket_totals.append(plan.subtotal(counts) -
+                                 plan.discount(allocations))
+            _record_applied(applied, allocations, keys, version)
+        totals[0] += basket_totals[0]
+        totals[1] += basket_totals[1]
+        if basket_totals[0] != basket_totals[1]:
+            changed += 1
+    return totals, changed, applied
+
+
+def _record_applied(applied, allocations, keys, version):
+    """Add the units discounted and discount given by each offer allocated
+    to a basket.
+
+    :param dict applied: Dict to add to, as from ``_reprice``.
+    :param dict allocations: Allocations of the basket, as from
+      ``engine.PricingPlan.allocate``.
+    :param list keys: Offer key of each rule position.
+    :param int version: 0 before the change and 1 after.
+    """
+    for allocation in allocations.values():
+        for rule, quantity in allocation:
+            key = keys[rule.position]
+            try:
+                stats = applied[key]
+            except KeyError:
+                stats = applied[key] = [0, 0, 0, 0]
+            stats[version] += quantity
+            stats[2 + version] += rule.unit_discount * quantity
+
+
+def _offer_report(applied, status, old_offers, new_offers):
+    """Report the offers applied before or after a change to the offers.
+
+    :param dict applied: Units discounted and discount given by each offer,
+      as from ``_reprice``.
+    :param dict status: Status of each offer key, from ``diff_offers``.
+    :param list old_offers: ``offer.Offer`` instances before the change.
+    :param list new_offers: ``offer.Offer`` instances after the change.
+    :return list: Dicts describing each offer, by most changed discount.
+    """
+    # Offers are reported as they are after the change, if not removed
+    latest = dict(zip(offer_keys(old_offers), old_offers))
+    latest.update(zip(offer_keys(new_offers), new_offers))
+    report = [{
+        'id': latest[key].offer_id,
+        'title': latest[key].title,
+        'status': status[key],
+        'units_before': units_before,
+        'units_after': units_after,
+        'discount_before': before,
+        'discount_after': after,
+        'discount_delta': after - before,
+    } for key, (units_before, units_after, before, after)
+        in applied.items()]
+    report.sort(key=lambda s: (-abs(s['discount_delta']), s['title']))
+    return report
@@ -0,0 +1,386 @@
+"""Solver module.
+
+Finds the allocation of offers to a basket giving the lowest price when
+each unit bought can be used once: either towards the qualifying quantity
+of one application of an offer, or as the unit one application discounts.
+For an offer on a single product, like "3 for 2", the discounted unit is
+one of the qualifying units.  (See ``engine.EXCLUSIVE``.)
+
+Choosing how many times to apply each offer is then an integer program
+over the quantities of the SKUs in the basket, solved by dynamic
+programming with pruning:
+
+- Only offers that can apply to the basket are considered, and an offer is
+  dropped if another offer between the same products asks for no more
+  qualifying units and gives at least as much discount.
+- Only the SKUs whose units are contested constrain the solution, so
+  offers not involving one are applied in full, and offers sharing no
+  contested SKUs are solved separately.
+- Each group of offers is solved over the quantities of its contested SKUs
+  left, pruning states that cannot beat a greedy allocation (see
+  ``search``).
+"""
+
+
+# Most states kept by ``search`` in all, shared between the offers of a
+# group, bounding the time spent on any basket
+MAX_STATES = 20000
+
+
+def allocate(plan, counts):
+    """Allocate offers to the units in a basket, for the lowest price.
+
+    :param plan: ``engine.PricingPlan`` holding the rules.
+    :param dict counts: Quantity of each SKU id in the basket.
+    :return dict: For each discounted SKU id, a list of ``(rule,
+      quantity)`` tuples in the order of the offers.
+    """
+    rules = candidates(plan, counts)
+    allocations = {}
+    for rule, quantity in zip(rules, solve(rules, counts)):
+        if quantity:
+            allocations.setdefault(rule.discounted, []).append(
+                (rule, quantity))
+    return allocations
+
+
+def most(rule, counts):
+    """The most times a rule can be applied to a basket by itself.
+
+    :param rule: ``engine.Rule`` instance.
+    :param dict counts: Quantity of each SKU id available.
+    :return int: Number of applications.
+    """
+    applications = counts.get(rule.qualifying, 0) // rule.qualifying_qty
+    if rule.discounted == rule.qualifying:
+        return applications
+    return min(applications, counts.get(rule.discounted, 0))
+
+
+def candidates(plan, counts):
+    """The rules worth considering for a basket.
+
+    Rules that cannot apply or give no discount are left out, as are rules
+    dominated by another between the same products that needs no more
+    qualifying units for at least as much discount.  A ``PricingPlan``
+    leaves those out when compiled (see ``engine.shadowed``), but a plan
+    read from a catalogue file lazily does not.
+
+    :param plan: ``engine.PricingPlan`` holding the rules.
+    :param dict counts: Quantity of each SKU id in the basket.
+    :return list: ``engine.Rule`` instances, in the order of the offers.
+    """
+    by_products = {}
+    for index in plan.relevant(counts):
+        rule = plan.rules[index]
+        if rule.unit_discount > 0 and most(rule, counts):
+            by_products.setdefault(
+                (rule.qualifying, rule.discounted), []).append(rule)
+    rules = []
+    for competing in by_products.values():
+        # Fewest qualifying units first, then largest discount first
+        competing.sort(key=lambda r: (r.qualifying_qty, -r.unit_discount,
+                                      r.position))
+        best = 0
+        for rule in competing:
+            if rule.unit_discount > best:
+                rules.append(rule)
+                best = rule.unit_discount
+    rules.sort(key=lambda r: r.position)
+    return rules
+
+
+def uses(rule, applications):
+    """The units of each SKU used by applications of a rule.
+
+    :param rule: ``engine.Rule`` instance.
+    :param int applications: Number of times the rule is applied.
+    :return list: ``(sku, units)`` tuples.
+    """
+    if rule.discounted == rule.qualifying:
+        return [(rule.qualifying, rule.qualifying_qty * applications)]
+    return [(rule.qualifying, rule.qualifying_qty * applications),
+            (rule.discounted, applications)]
+
+
+def greedy(rules, counts):
+    """Allocate rules greedily, either by largest discount or by largest
+    discount per unit used, whichever gives more discount.
+
+    :param list rules: ``engine.Rule`` instances.
+    :param dict counts: Quantity of each SKU id in the basket.
+    :return list: Number of applications of each rule, in the order given.
+    """
+    best, most_discount = None, -1
+    for key in (lambda r: -r.unit_discount,
+                lambda r: -r.unit_discount / (r.qualifying_qty + (
+                    r.discounted != r.qualifying))):
+        left = dict(counts)
+        applied = [0] * len(rules)
+        priorities = [key(rule) for rule in rules]
+        for index in sorted(range(len(rules)), key=priorities.__getitem__):
+            applied[index] = most(rules[index], left)
+            for sku, units in uses(rules[index], applied[index]):
+                left[sku] -= units
+        discount = sum(rule.unit_discount * applications
+                       for rule, applications in zip(rules, applied))
+        if discount > most_discount:
+            best, most_discount = applied, discount
+    return best
+
+
+def components(rules, skus):
+    """Group rules into those sharing SKUs of a set, directly or
+    indirectly.
+
+    :param list rules: ``engine.Rule`` instances, each involving a SKU in
+      ``skus``.
+    :param set skus: SKU ids.
+    :return list: Lists of the indices of the rules in each group, in
+      order.
+    """
+    parent = {}
+
+    def find(sku):
+        root = sku
+        while parent.setdefault(root, root) != root:
+            root = parent[root]
+        while sku != root:
+            parent[sku], sku = root, parent[sku]
+        return root
+
+    shared = [[sku for sku in (rule.qualifying, rule.discounted)
+               if sku in skus] for rule in rules]
+    for involved in shared:
+        parent[find(involved[0])] = find(involved[-1])
+    groups = {}
+    for index, involved in enumerate(shared):
+        groups.setdefault(find(involved[0]), []).append(index)
+    return list(groups.values())
+
+
+def solve(rules, counts):
+    """The number of times to apply each rule for the largest discount,
+    each unit being used once.
+
+    Only SKUs whose units are contested, more being wanted than are in the
+    basket if every rule applied in full, constrain the solution.  Rules
+    not involving one are applied in full, and the rest are solved in
+    groups sharing contested SKUs by ``search``.
+
+    :param list rules: ``engine.Rule`` instances.
+    :param dict counts: Quantity of each SKU id in the basket.
+    :return list: Number of applications of each rule, in the order given.
+    """
+    limits = [most(rule, counts) for rule in rules]
+    demand = {}
+    for rule, limit in zip(rules, limits):
+        for sku, units in uses(rule, limit):
+            demand[sku] = demand.get(sku, 0) + units
+    contested = {sku for sku, units in demand.items() if units > counts[sku]}
+    if not contested:
+        return limits
+
+    applied = list(limits)
+    involved = [index for index, rule in enumerate(rules)
+                if rule.qualifying in contested or
+                rule.discounted in contested]
+    for group in components([rules[i] for i in involved], contested):
+        indices = [involved[i] for i in group]
+        group_rules = [rules[i] for i in indices]
+        group_limits = [limits[i] for i in indices]
+        for index, applications in zip(indices, search(
+                group_rules, group_limits, counts, contested)):
+            applied[index] = applications
+    return applied
+
+
+def search(rules, limits, counts, contested):
+    """The number of times to apply each of a group of rules for the
+    largest discount, by dynamic programming over the contested SKUs.
+
+    The rules are applied one at a time, each state being the quantities of
+    the contested SKUs left.  Once no later rule involves a SKU it is
+    dropped from the state, merging states that differ only in SKUs that no
+    longer matter.  States that could not beat the greedy allocation, even
+    if every later rule applied in full, are pruned.
+
+    The solution is exact unless more states are left after applying a
+    rule than its share of ``MAX_STATES`` (and at least 16), in which case
+    those with the most discount so far are kept.  It is never worse than
+    the greedy allocation.
+
+    :param list rules: ``engine.Rule`` instances.
+    :param list limits: Most applications of each rule by itself.
+    :param dict counts: Quantity of each SKU id in the basket.
+    :param set contested: SKU ids whose units are contested.
+    :return list: Number of applications of each rule, in the order given.
+    """
+    order = _order(rules, contested)
+    skus = sorted({sku for rule in rules
+                   for sku in (rule.qualifying, rule.discounted)
+                   if sku in contested})
+    fallback = greedy(rules, counts)
+    lower = sum(rule.unit_discount * applications
+                for rule, applications in zip(rules, fallback))
+    bounds = _bounds(rules, limits, order)
+    width = max(MAX_STATES // len(order), 16)
+
+    # Each layer maps states to (discount, previous state, applications)
+    layers = [{tuple(counts[sku] for sku in skus): (0, None, 0)}]
+    for position, (index, step) in enumerate(_steps(rules, order, skus)):
+        layers.append(_prune(_expand(layers[-1], rules[index],
+                                     limits[index], step,
+                                     lower - bounds[position]), width))
+    applied = _backtrack(layers, order, lower)
+    return fallback if applied is None else applied
+
+
+def _bounds(rules, limits, order):
+    """The most discount the rules from each position on could give.
+
+    :param list rules: ``engine.Rule`` instances.
+    :param list limits: Most applications of each rule by itself.
+    :param list order: Indices of the rules, in the order applied.
+    :return list: Discount from each position of ``order``, and 0 after
+      the last.
+    """
+    bounds = [0] * (len(order) + 1)
+    for position in range(len(order) - 1, -1, -1):
+        index = order[position]
+        bounds[position] = (bounds[position + 1] +
+                            rules[index].unit_discount * limits[index])
+    return bounds
+
+
+def _steps(rules, order, skus):
+    """How applying each rule in turn changes the states of ``search``.
+
+    :param list rules: ``engine.Rule`` instances.
+    :param list order: Indices of the rules, in the order applied.
+    :param list skus: The contested SKU ids, in the order of the slots of
+      each state.
+    :return list: ``(index, (used, retired))`` tuples in order, where
+      ``used`` lists the ``(slot, units)`` used by one application of the
+      rule, and ``retired`` the slots no later rule involves.
+    """
+    slots = {sku: slot for slot, sku in enumerate(skus)}
+    last = {}
+    for position, index in enumerate(order):
+        last[rules[index].qualifying] = last[rules[index].discounted] = (
+            position)
+    steps = []
+    for position, index in enumerate(order):
+        rule = rules[index]
+        used = [(slots[sku], units) for sku, units in uses(rule, 1)
+                if sku in slots]
+        retired = [slots[sku] for sku in {rule.qualifying, rule.discounted}
+                   if sku in slots and last[sku] == position]
+        steps.append((index, (used, retired)))
+    return steps
+
+
+def _expand(previous, rule, limit, step, floor):
+    """Apply a rule to each state of a layer of ``search``.
+
+    :param dict previous: The layer before applying the rule.
+    :param rule: ``engine.Rule`` instance.
+    :param int limit: Most applications of the rule by itself.
+    :param tuple step: The slots the rule uses and retires, as from
+      ``_steps``.
+    :param floor: Least discount a state must have to be expanded, as no
+      other can beat the greedy allocation.
+    :return dict: The layer after applying the rule.
+    """
+    used = step[0]
+    layer = {}
+    for state, (total, _, _) in previous.items():
+        if total < floor:
+            continue
+        applications = min([limit] + [state[slot] // units
+                                      for slot, units in used])
+        for count in range(applications + 1):
+            new = _apply(state, step, count)
+            value = total + rule.unit_discount * count
+            best = layer.get(new)
+            if best is None or value > best[0]:
+                layer[new] = (value, state, count)
+    return layer
+
+
+def _apply(state, step, count):
+    """The state left by applying a rule to a state of ``search``.
+
+    :param tuple state: Quantities of the contested SKUs left.
+    :param tuple step: The slots the rule uses and retires, as from
+      ``_steps``.
+    :param int count: Number of applications of the rule.
+    :return tuple: The new state.
+    """
+    used, retired = step
+    new = list(state)
+    for slot, units in used:
+        new[slot] -= units * count
+    for slot in retired:
+        new[slot] = 0
+    return tuple(new)
+
+
+def _prune(layer, width):
+    """Keep the states of a layer with the most discount so far.
+
+    :param dict layer: A layer of ``search``.
+    :param int width: Most states to keep.
+    :return dict: The layer, with at most ``width`` states.
+    """
+    if len(layer) <= width:
+        return layer
+    return dict(sorted(layer.items(), key=lambda item: -item[1][0])[:width])
+
+
+def _backtrack(layers, order, lower):
+    """The applications of each rule leading to the best final state.
+
+    :param list layers: The layers of ``search``.
+    :param list order: Indices of the rules, in the order applied.
+    :param lower: Discount of the greedy allocation.
+    :return list: Number of applications of each rule, in the order given,
+      or None if no state beats the greedy allocation.
+    """
+    final = layers[-1]
+    if not final:
+        return None
+    state = max(final, key=lambda s: final[s][0])
+    if final[state][0] <= lower:
+        return None
+    applied = [0] * len(order)
+    for position in range(len(order), 0, -1):
+        _, state, applied[order[position - 1]] = layers[position][state]
+    return applied
+
+
+def _order(rules, contested):
+    """Order rules so that each contested SKU is involved in a short run of
+    them, keeping the states of ``search`` few.
+
+    Contested SKUs are visited breadth first from the first rule's, and
+    each rule comes once the contested SKUs it involves have been visited.
+
+    :param list rules: ``engine.Rule`` instances.
+    :param set contested: SKU ids whose units are contested.
+    :return list: Indices of the rules, in the order to apply them.
+    """
+    involved = [[sku for sku in (rule.qualifying, rule.discounted)
+                 if sku in contested] for rule in rules]
+    neighbours = {}
+    for skus in involved:
+        neighbours.setdefault(skus[0], set()).add(skus[-1])
+        neighbours.setdefault(skus[-1], set()).add(skus[0])
+    visited = {}
+    queue = [involved[0][0]]
+    for sku in queue:
+        if sku not in visited:
+            visited[sku] = len(visited)
+            queue.extend(sorted(neighbours[sku]))
+    return sorted(range(len(rules)), key=lambda i: (
+        max(visited[sku] for sku in involved[i]), rules[i].position))
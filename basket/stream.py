@@ -0,0 +1,318 @@
+"""Stream module.
+
+Reads the elements of a JSON array from a file one at a time, so that a
+large goods or offers file can be turned into products and offers as it is
+read rather than being held in memory whole as ``json.load`` would.  Only a
+chunk of the file, and the elements parsed from it, are held at once.
+
+Where they can be, the whole elements in a chunk are parsed together by a
+single call to the ``json`` module's scanner, which costs much less than a
+call per element.  The offset of each element in the file can be found
+again, so that elements that cannot be used can be reported by line and
+column, as can syntax errors.  Offsets and lines are only worked out when a
+position is reported.
+"""
+
+import json
+import re
+
+
+# Characters read from the file at a time
+CHUNK_SIZE = 1 << 16
+
+# Most characters an element may take up
+MAX_ELEMENT_SIZE = 1 << 24
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# The delimiter between two elements, with any whitespace around it
+_DELIMITER = re.compile(r'[ \t\n\r]*,[ \t\n\r]*')
+
+# Characters that may follow a number read in part, '' being the end of
+# what has been read
+_NUMBER = ('', '.', 'e', 'E', '+', '-', '0', '1', '2', '3', '4', '5', '6',
+           '7', '8', '9')
+
+
+class ArrayReader:
+    """Class that iterates over the elements of a JSON array in a file,
+    parsing each as it is reached.
+
+    ``offset``, ``line`` and ``column`` give the position in the file of
+    the start of the element last returned, and are only worked out when
+    asked for.
+    """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE,
+                 max_element_size=MAX_ELEMENT_SIZE):
+        """
+        :param f: File opened in text mode.
+        :param int chunk_size: Characters to read from the file at a time.
+        :param int max_element_size: Most characters an element may take
+          up.  A larger element is reported as a syntax error.
+        """
+        self.file = f
+        self.chunk_size = chunk_size
+        self.max_element_size = max_element_size
+        self._scan = json.JSONDecoder().scan_once
+        self._buffer = ''
+        self._pos = 0  # Position in the buffer
+        self._start = 0  # File offset of the start of the buffer
+        self._eof = False
+        self._state = 'start'
+        # Line number of the start of the buffer, and the offset its line
+        # starts at
+        self._line = 1
+        self._line_start = 0
+        # File offset of the element last returned, if known
+        self._offset = None
+        # Elements parsed together, the number of them returned so far, and
+        # the file offset of the first.  Parsing together is given up if the
+        # array's elements hold arrays or objects that defeat it.
+        self._batch = []
+        self._returned = 0
+        self._batch_offset = None
+        self._batching = True
+        # The number of the element last found among those parsed together
+        # and its file offset
+        self._found = None
+        # File offset of the end of the buffer when last found to hold no
+        # elements that can be parsed together
+        self._searched = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """Parse the next element.
+
+        :return: The element.
+        :raises: StopIteration at the end of the array, or ValueError if
+          the file is not a JSON array.
+        """
+        if self._returned < len(self._batch):
+            element = self._batch[self._returned]
+            self._returned += 1
+            self._offset = None
+            return element
+        if (self._state == 'next' and self._batching and
+                self._searched != self._start + len(self._buffer) and
+                self._parse_batch()):
+            self._returned = 1
+            self._offset = None
+            return self._batch[0]
+        return self._next_element()
+
+    def _parse_batch(self):
+        """Parse the whole elements following the current position in the
+        buffer together.
+
+        The last delimiter following an array or object in the buffer is
+        taken as the end of an element.  Only if it is does the text
+        between parse as the elements of an array, as otherwise some
+        bracket or quote is left open.
+
+        :return bool: True if any elements were parsed.
+        """
+        buffer = self._buffer
+        match = _DELIMITER.match(buffer, self._pos)
+        end = -1
+        if match is not None:
+            begin = match.end()
+            end = len(buffer)
+            while True:
+                end = max(buffer.rfind('}', begin, end),
+                          buffer.rfind(']', begin, end))
+                if end < 0 or _DELIMITER.match(buffer, end + 1):
+                    break
+        if end < 0:
+            # Not until more of the file is read
+            self._searched = self._start + len(buffer)
+            return False
+        try:
+            batch, _ = self._scan('[' + buffer[begin:end + 1] + ']', 0)
+        except (StopIteration, ValueError):
+            self._batching = False
+            return False
+        self._batch = batch
+        self._batch_offset = self._start + begin
+        self._found = 1, self._batch_offset
+        self._pos = end + 1
+        return True
+
+    def _next_element(self):
+        """Parse the next element on its own, reading more of the file as
+        needed.
+
+        :return: The element.
+        :raises: StopIteration at the end of the array, or ValueError if
+          the file is not a JSON array.
+        """
+        if self._state == 'start':
+            if self._next_char() != '[':
+                self._error('Expecting \'[\'', self._pos)
+            self._pos += 1
+            self._state = 'first'
+        elif self._state == 'end':
+            raise StopIteration
+
+        char = self._next_char()
+        if char == ']' and self._state == 'first':
+            return self._finish()
+        if self._state == 'next':
+            if char == ']':
+                return self._finish()
+            if char != ',':
+                self._error('Expecting \',\' delimiter', self._pos)
+            self._pos += 1
+            self._next_char()
+        self._state = 'next'
+
+        element, end = self._decode()
+        self._offset = self._start + self._pos
+        self._pos = end
+        self._batch = []
+        self._returned = 0
+        return element
+
+    @property
+    def offset(self):
+        """The character offset in the file of the element last returned.
+        """
+        if self._offset is None and self._returned:
+            # Find the element again among those parsed together, from the
+            # last one found
+            buffer = self._buffer
+            found, offset = self._found
+            pos = offset - self._start
+            for _ in range(self._returned - found):
+                pos = self._scan(buffer, pos)[1]
+                pos = _DELIMITER.match(buffer, pos).end()
+            self._offset = self._start + pos
+            self._found = self._returned, self._offset
+        return self._offset
+
+    @property
+    def line(self):
+        """The line number of the element last returned, from 1."""
+        offset = self.offset
+        return None if offset is None else self._locate(offset)[0]
+
+    @property
+    def column(self):
+        """The column number of the element last returned, from 1."""
+        offset = self.offset
+        return None if offset is None else self._locate(offset)[1]
+
+    def _decode(self):
+        """Decode the element at the current position, reading more of the
+        file until it is whole.
+
+        :return tuple: The element, and the position in the buffer of its
+          end.
+        :raises: ValueError if the element is not valid JSON.
+        """
+        while True:
+            try:
+                element, end = self._scan(self._buffer, self._pos)
+            except StopIteration as e:
+                error = json.JSONDecodeError('Expecting value', self._buffer,
+                                             e.value)
+            except json.JSONDecodeError as e:
+                error = e
+            else:
+                # A number may go on past what has been read so far
+                if (self._eof or not self._buffer[end - 1].isdigit() or
+                        self._buffer[end:end + 1] not in _NUMBER):
+                    return element, end
+                error = None
+            if self._eof or (len(self._buffer) - self._pos >=
+                             self.max_element_size):
+                if error is None:
+                    return element, end
+                self._error(error.msg, error.pos)
+            self._compact()
+            self._read()
+
+    def _finish(self):
+        """End the array, checking nothing but whitespace follows it."""
+        self._pos += 1
+        self._state = 'end'
+        if self._next_char():
+            self._error('Extra data', self._pos)
+        raise StopIteration
+
+    def _next_char(self):
+        """Skip whitespace, reading more of the file as needed.
+
+        :return str: The next character, or '' at the end of the file.
+        """
+        while True:
+            pos = self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if pos < len(self._buffer):
+                return self._buffer[pos]
+            if self._eof:
+                return ''
+            self._compact()
+            self._read()
+
+    def _read(self):
+        """Read a chunk of the file into the buffer."""
+        chunk = self.file.read(self.chunk_size)
+        if chunk:
+            self._buffer += chunk
+        else:
+            self._eof = True
+
+    def _compact(self):
+        """Drop the part of the buffer already parsed, but for the element
+        last returned so that its position can still be found."""
+        drop = self._pos
+        if self._returned:
+            drop = min(drop, self._batch_offset - self._start)
+        elif self._offset is not None:
+            drop = min(drop, self._offset - self._start)
+        if drop:
+            newlines = self._buffer.count('\n', 0, drop)
+            if newlines:
+                self._line += newlines
+                self._line_start = (self._start +
+                                    self._buffer.rindex('\n', 0, drop) + 1)
+            self._buffer = self._buffer[drop:]
+            self._start += drop
+            self._pos -= drop
+
+    def _locate(self, offset):
+        """The line and column of a file offset in the buffer.
+
+        :param int offset: Character offset in the file.
+        :return tuple: The line and column numbers, from 1.
+        """
+        end = offset - self._start
+        line = self._line + self._buffer.count('\n', 0, end)
+        newline = self._buffer.rfind('\n', 0, end)
+        line_start = (self._line_start if newline < 0 else
+                      self._start + newline + 1)
+        return line, offset - line_start + 1
+
+    def _error(self, message, pos):
+        """Raise a syntax error at a position in the buffer.
+
+        :param str message: What is wrong.
+        :param int pos: Position in the buffer.
+        :raises: ValueError
+        """
+        offset = self._start + pos
+        line, column = self._locate(offset)
+        self._state = 'end'
+        raise ValueError('{}: line {} column {} (char {})'.format(
+            message, line, column, offset))
+
+
+def position(reader):
+    """Describe the position of the element last read, for messages.
+
+    :param reader: ``ArrayReader`` instance.
+    :return str: The line and column of the element.
+    """
+    return 'line {} column {}'.format(reader.line, reader.column)
@@ -0,0 +1,337 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+import basket.async_server as async_server
+import basket.catalogue as catalogue
+import basket.offer as offer
+import basket.product as product
+
+
+@pytest.fixture
+def shop():
+    goods = {
+      'milk': product.Product('milk', 130, 'bottle'),
+      'apples': product.Product('apples', 100, 'bag'), }
+    offers = [offer.Offer({'id': 1, 'title': 'Apples 10% off',
+                           'qualifying_product': 'apples',
+                           'qualifying_qty': 1,
+                           'discounted_product': 'apples',
+                           'discount_percent': 10})]
+    return catalogue.Catalogue(goods, offers)
+
+
+async def post(reader, writer, body, path='/price'):
+    body = body.encode('utf-8')
+    writer.write('POST {} HTTP/1.1\r\nContent-Length: {}\r\n\r\n'.format(
+        path, len(body)).encode('latin-1') + body)
+    await writer.drain()
+    return await read_response(reader)
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line == b'\r\n':
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.lower()] = value.strip()
+    body = await reader.readexactly(int(headers['content-length']))
+    return int(status_line.split()[1]), headers, json.loads(body)
+
+
+def run_server(shop, client, **kwargs):
+    async def main():
+        coalescer = async_server.Coalescer(shop, **kwargs)
+        server = await async_server.AsyncPricingServer(coalescer).start(
+            '127.0.0.1', 0)
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+            return await client(port, coalescer)
+    return asyncio.run(main())
+
+
+def test_coalescer_batches(shop):
+    async def main():
+        coalescer = async_server.Coalescer(shop, max_batch=3,
+                                           batch_window=10)
+        baskets = [[('apples', 1)], [('milk', 1)], [('apples', 1)],
+                   [('apples', 2)]]
+        tasks = [asyncio.ensure_future(coalescer.price(b)) for b in baskets]
+        await asyncio.sleep(0)
+        assert coalescer.batches == 1
+        assert coalescer.baskets == 3
+        coalescer.flush()
+        results = await asyncio.gather(*tasks)
+        assert coalescer.batches == 2
+        return results
+    results = asyncio.run(main())
+    assert [r['total'] for r in results] == [90, 130, 90, 180]
+    assert results[0] is results[2]
+
+
+def test_coalescer_window(shop):
+    async def main():
+        coalescer = async_server.Coalescer(shop, batch_window=0.001)
+        results = await asyncio.gather(coalescer.price([('milk', 1)]),
+                                       coalescer.price([('apples', 1)]))
+        assert coalescer.batches == 1
+        return results
+    results = asyncio.run(main())
+    assert [r['total'] for r in results] == [130, 90]
+
+
+def test_coalescer_cancelled(shop):
+    async def main():
+        coalescer = async_server.Coalescer(shop, batch_window=10)
+        cancelled = asyncio.ensure_future(coalescer.price([('milk', 1)]))
+        priced = asyncio.ensure_future(coalescer.price([('apples', 1)]))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        coalescer.flush()
+        return await priced
+    assert asyncio.run(main())['total'] == 90
+
+
+def test_coalescer_in_flight_limit(shop):
+    async def main():
+        coalescer = async_server.Coalescer(shop, max_batch=10,
+                                           batch_window=10, max_in_flight=2)
+        tasks = [asyncio.ensure_future(coalescer.price([('milk', 1)]))
+                 for _ in range(3)]
+        await asyncio.sleep(0)
+        assert len(coalescer._pending) == 2
+        await coalescer.flush()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert len(coalescer._pending) == 1
+        coalescer.flush()
+        return await asyncio.gather(*tasks)
+    assert len(asyncio.run(main())) == 3
+
+
+class Failing:
+    """Catalogue failing to load, or to price baskets holding eggs."""
+
+    def __init__(self, shop, unavailable=False):
+        self.shop = shop
+        self.unavailable = unavailable
+
+    def current(self):
+        if self.unavailable:
+            raise OSError('Catalogue unavailable')
+        return self
+
+    def price(self, items):
+        if any(item == 'eggs' for item, _ in items):
+            raise RuntimeError('Pricing failed')
+        return self.shop.price(items)
+
+
+def test_coalescer_price_error(shop):
+    async def main():
+        coalescer = async_server.Coalescer(Failing(shop), max_batch=3,
+                                           batch_window=10, max_in_flight=3)
+        results = await asyncio.gather(
+            coalescer.price([('milk', 1)]), coalescer.price([('eggs', 1)]),
+            coalescer.price([('apples', 1)]), return_exceptions=True)
+        # Every permit is released, so a full batch can be priced again
+        results.append(await asyncio.wait_for(asyncio.gather(
+            *[coalescer.price([('milk', 1)]) for _ in range(3)]), 1))
+        return results
+    results = asyncio.run(main())
+    assert results[0]['total'] == 130
+    assert isinstance(results[1], RuntimeError)
+    assert results[2]['total'] == 90
+    assert [r['total'] for r in results[3]] == [130, 130, 130]
+
+
+def test_coalescer_catalogue_error(shop):
+    async def main():
+        source = Failing(shop, unavailable=True)
+        coalescer = async_server.Coalescer(source, max_batch=2,
+                                           batch_window=10, max_in_flight=2)
+        results = await asyncio.gather(
+            coalescer.price([('milk', 1)]), coalescer.price([('apples', 1)]),
+            return_exceptions=True)
+        source.unavailable = False
+        results.append(await asyncio.wait_for(asyncio.gather(
+            *[coalescer.price([('milk', 1)]) for _ in range(2)]), 1))
+        return results
+    results = asyncio.run(main())
+    assert [type(r) for r in results[:2]] == [OSError, OSError]
+    assert [r['total'] for r in results[2]] == [130, 130]
+
+
+def test_price_error(shop):
+    async def client(port, coalescer):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        responses = [await post(reader, writer, '["eggs"]'),
+                     await post(reader, writer, '["apples"]')]
+        writer.close()
+        return responses
+    responses = run_server(Failing(shop), client, batch_window=0)
+    assert responses[0][0] == 500
+    assert responses[0][2] == {'error': 'Failed to price basket'}
+    assert responses[1][2]['total'] == 90
+
+
+def test_in_flight_limit_before_body(shop):
+    async def client(port, coalescer):
+        first = await asyncio.open_connection('127.0.0.1', port)
+        second = await asyncio.open_connection('127.0.0.1', port)
+        responses = [asyncio.ensure_future(post(*first, '["milk"]')),
+                     asyncio.ensure_future(post(*second, '["apples"]'))]
+        await asyncio.sleep(0.05)
+        # The second body waits to be read until the first is priced
+        assert len(coalescer._pending) == 1
+        coalescer.flush()
+        await responses[0]
+        while not coalescer._pending:
+            await asyncio.sleep(0.01)
+        coalescer.flush()
+        await responses[1]
+        for _, writer in (first, second):
+            writer.close()
+        return [response.result() for response in responses]
+    responses = run_server(shop, client, batch_window=10, max_in_flight=1)
+    assert [r[2]['total'] for r in responses] == [130, 90]
+
+
+def test_get_body_discarded(shop):
+    async def client(port, coalescer):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /health HTTP/1.1\r\nContent-Length: 10\r\n\r\n'
+                     b'["apples"]')
+        responses = [await read_response(reader),
+                     await post(reader, writer, '["apples"]')]
+        writer.close()
+        return responses
+    responses = run_server(shop, client, batch_window=0)
+    assert responses[0][2] == {'status': 'ok'}
+    assert responses[1][2]['total'] == 90
+
+
+def test_coalescer_reload_off_loop(shop):
+    threads = []
+
+    class Source:
+
+        def current(self):
+            threads.append(threading.get_ident())
+            return shop
+
+    async def main():
+        coalescer = async_server.Coalescer(Source(), batch_window=0)
+        return await coalescer.price([('apples', 1)])
+    assert asyncio.run(main())['total'] == 90
+    assert threads and threading.get_ident() not in threads
+
+
+def test_price(shop):
+    async def client(port, coalescer):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        responses = [await post(reader, writer, '["apples", "milk"]'),
+                     await post(reader, writer, '{"id": 2, "items": ["x"]}')]
+        writer.close()
+        return responses
+    responses = run_server(shop, client, batch_window=0)
+    status, headers, result = responses[0]
+    assert status == 200
+    assert headers['connection'] == 'keep-alive'
+    assert result == {'id': None, 'subtotal': 230,
+                      'discounts': ['Apples 10% off: -10p'], 'total': 220,
+                      'unknown': []}
+    assert responses[1][2]['unknown'] == ['x']
+
+
+def test_price_concurrent(shop):
+    async def one(port, n):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        response = await post(reader, writer,
+                              json.dumps({'id': n, 'items': {'apples': n}}))
+        writer.close()
+        return response
+
+    async def client(port, coalescer):
+        responses = await asyncio.gather(*[one(port, n)
+                                           for n in range(1, 21)])
+        return responses, coalescer.batches
+
+    responses, batches = run_server(shop, client, batch_window=0.05)
+    assert [r[2]['total'] for r in responses] == [90 * n
+                                                  for n in range(1, 21)]
+    assert batches < 20
+
+
+@pytest.mark.parametrize('request_bytes, status, message', [
+    (b'POST /price HTTP/1.1\r\nContent-Length: 3\r\n\r\nfoo', 400,
+     'Expecting value'),
+    (b'POST /price HTTP/1.1\r\nContent-Length: 1\r\n\r\n\xff', 400,
+     'Basket is not UTF-8 encoded'),
+    (b'POST /price HTTP/1.1\r\nContent-Length: 30\r\n\r\n'
+     b'{"items":{"apples":500000000}}', 400, 'Basket holds more than'),
+    (b'POST /foo HTTP/1.1\r\nContent-Length: 2\r\n\r\n[]', 404,
+     'Not found'),
+    (b'GET /price HTTP/1.1\r\n\r\n', 404, 'Not found'),
+    (b'POST /price HTTP/1.1\r\n\r\n', 411, 'Content-Length required'),
+    (b'POST /price HTTP/1.1\r\nContent-Length: -1\r\n\r\n', 400,
+     'Invalid Content-Length'),
+    (b'POST /price HTTP/1.1\r\nContent-Length: 99999999\r\n\r\n', 413,
+     'Basket too large'),
+    (b'FOO\r\n\r\n', 400, 'Malformed request line'),
+    (b'GET /health HTTP/1.1\r\n' + b'X: y\r\n' * 101 + b'\r\n', 431,
+     'Too many headers'),
+    (b'GET /health HTTP/1.1\r\nContent-Length: x\r\n\r\n', 411,
+     'Content-Length required'),
+])
+def test_errors(shop, request_bytes, status, message):
+    async def client(port, coalescer):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(request_bytes)
+        response = await read_response(reader)
+        writer.close()
+        return response
+    response = run_server(shop, client)
+    assert response[0] == status
+    assert message in response[2]['error']
+
+
+def test_health_close(shop):
+    async def client(port, coalescer):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /health HTTP/1.0\r\n\r\n')
+        response = await read_response(reader)
+        assert await reader.read() == b''
+        writer.close()
+        return response
+    status, headers, result = run_server(shop, client)
+    assert status == 200
+    assert headers['connection'] == 'close'
+    assert result == {'status': 'ok'}
+
+
+def test_connection_wait_closed(shop):
+    class Writer:
+        events = []
+
+        def close(self):
+            self.events.append('close')
+
+        async def wait_closed(self):
+            self.events.append('wait_closed')
+            raise ConnectionResetError()
+
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_eof()
+        coalescer = async_server.Coalescer(shop)
+        await async_server.AsyncPricingServer(coalescer).handle_connection(
+            reader, Writer())
+    asyncio.run(main())
+    assert Writer.events == ['close', 'wait_closed']
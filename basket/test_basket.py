@@ -1,19 +1,12 @@
+import random
+
 import pytest
 
 import basket.basket as basket
-import basket.product as product
+import basket.engine as engine
 import basket.offer as offer
 
 
-@pytest.fixture
-def goods():
-    return {
-      'soup': product.Product('soup', 65, 'tin'),
-      'bread': product.Product('bread', 80, 'loaf'),
-      'milk': product.Product('milk', 130, 'bottle'),
-      'apples': product.Product('apples', 100, 'bag'), }
-
-
 @pytest.fixture
 def goods_empty():
     return {}
@@ -41,7 +34,7 @@ def test_basket(goods, offers):
     b = basket.Basket(goods, offers)
     assert b.goods is goods
     assert b.offers is offers
-    assert b.items == []
+    assert b.items == {}
     assert b.discounts == []
 
 
@@ -79,17 +72,300 @@ def test_discount(goods, offers):
     b.calculate_discounts()
     assert b.total == 90
     assert len(b.discounted_items) == 1
-    assert b.discounted_items[0] is b.items[0]
+    assert b.discounted_items[0].name == 'apples'
+    assert b.discounted_items[0].discount_message == 'Apples 10% off: -10p'
 
 
 def test_add_items_discount(goods, offers):
     b = basket.Basket(goods, offers)
     assert b.add('apples')
     assert b.add('apples')
-    assert len(b.items) == 2
+    assert len(b.items) == 1
+    assert b.items[goods['apples'].sku].quantity == 2
     assert b.subtotal == 200
     b.calculate_discounts()
     assert b.total == 180
     assert len(b.discounted_items) == 2
-    assert b.discounted_items[0] is b.items[0]
-    assert b.discounted_items[1] is b.items[1]
+    assert b.discounted_items[0] is b.discounted_items[1]
+    assert b.discounted_items[0] is not b.goods['apples']
+    assert not b.goods['apples'].has_offer
+
+
+def test_plan_shared(goods, offers):
+    plan = engine.compile_offers(goods, offers)
+    b1 = basket.Basket(goods, offers, plan)
+    b2 = basket.Basket(goods, offers, plan)
+    assert b1.plan is plan
+    assert b2.plan is plan
+
+
+def test_multiple_offers(goods, offer_def):
+    soup_bread = {'id': 2, 'title': '2 tins soup get you a half price loaf',
+                  'qualifying_product': 'soup',
+                  'qualifying_qty': 2,
+                  'discounted_product': 'bread',
+                  'discount_percent': 50}
+    offers = [offer.Offer(offer_def), offer.Offer(soup_bread)]
+    b = basket.Basket(goods, offers)
+    for item in ('milk', 'soup', 'soup', 'bread', 'bread', 'apples'):
+        assert b.add(item)
+    b.calculate_discounts()
+    assert b.subtotal == 520
+    assert b.total == 470
+    assert [p.name for p in b.discounted_items] == ['bread', 'apples']
+
+
+def test_later_offer_overrides(goods, offer_def):
+    better = dict(offer_def, id=2, title='Apples 50% off',
+                  discount_percent=50)
+    offers = [offer.Offer(offer_def), offer.Offer(better)]
+    b = basket.Basket(goods, offers)
+    assert b.add('apples')
+    b.calculate_discounts()
+    assert b.total == 50
+    assert b.discounted_items[0].discount_message == 'Apples 50% off: -50p'
+
+
+def test_strategy_exclusive(goods, offer_def):
+    apples_bread = {'id': 2, 'title': '2 apples get you a half price loaf',
+                    'qualifying_product': 'apples',
+                    'qualifying_qty': 2,
+                    'discounted_product': 'bread',
+                    'discount_percent': 50}
+    offers = [offer.Offer(offer_def), offer.Offer(apples_bread)]
+    plan = engine.compile_offers(goods, offers, engine.EXCLUSIVE)
+    b = basket.Basket(goods, offers, plan, debug=True)
+    assert b.add('apples', 2)
+    b.calculate_discounts()
+    assert b.total == 180
+    assert b.add('bread')
+    b.calculate_discounts()
+    # The apples go towards the loaf rather than being discounted
+    assert b.total == 240
+    assert [p.discount_message for p in b.discounted_items] == [
+        '2 apples get you a half price loaf: -40p']
+    assert b.remove('bread')
+    b.calculate_discounts()
+    assert b.total == 180
+    assert [p.name for p in b.discounted_items] == ['apples', 'apples']
+
+
+def test_add_quantity(goods, offers):
+    b = basket.Basket(goods, offers)
+    assert b.add('Apples', 500)
+    assert b.add('soup', 2)
+    assert list(b.items) == [goods['apples'].sku, goods['soup'].sku]
+    assert b.items[goods['apples'].sku].quantity == 500
+    assert b.items[goods['apples'].sku].product is goods['apples']
+    assert b.subtotal == 50130
+    b.calculate_discounts()
+    assert b.total == 45130
+    assert len(b.discounted_items) == 500
+    line, = b.discount_lines
+    assert line.product is goods['apples']
+    assert (line.quantity, line.unit_discount) == (500, 10)
+    assert line.offer is offers[0]
+
+
+def test_partial_discount(goods):
+    soup_bread = {'id': 2, 'title': '2 tins soup get you a half price loaf',
+                  'qualifying_product': 'soup',
+                  'qualifying_qty': 2,
+                  'discounted_product': 'bread',
+                  'discount_percent': 50}
+    b = basket.Basket(goods, [offer.Offer(soup_bread)])
+    assert b.add('soup', 5)
+    assert b.add('bread', 3)
+    b.calculate_discounts()
+    line = b.items[goods['bread'].sku]
+    assert len(line.allocations) == 1
+    assert line.allocations[0][1] == 2
+    assert line.discount_amount == 80
+    assert b.total == b.subtotal - 80
+    assert len(b.discounted_items) == 2
+
+
+def test_recalculate_discounts(goods, offers):
+    b = basket.Basket(goods, offers)
+    assert b.add('apples')
+    b.calculate_discounts()
+    b.calculate_discounts()
+    assert len(b.discounted_items) == 1
+    assert b.total == 90
+
+
+def test_line_item_override(goods, offer_def):
+    first = offer.Offer(offer_def)
+    second = offer.Offer(dict(offer_def, id=2, title='Apples 50% off',
+                              discount_percent=50))
+    line = basket.LineItem(goods['apples'])
+    line.quantity = 4
+    line.apply_offer(first, 3)
+    line.apply_offer(second, 2)
+    assert [(p.discount_message, qty) for p, qty in line.allocations] == [
+        ('Apples 50% off: -50p', 2), ('Apples 10% off: -10p', 1)]
+    assert line.subtotal == 400
+    assert line.total == 290
+    line.apply_offer(first, 0)
+    assert len(line.discounted_items) == 3
+    line.clear_offer()
+    assert line.total == 400
+    assert line.discounted_items == []
+
+
+def test_line_item_compact(goods):
+    line = basket.LineItem(goods['apples'])
+    assert not hasattr(line, '__dict__')
+    assert line.allocations == ()
+    assert line._discounted is None
+
+
+@pytest.fixture
+def meal_deal_offers(offer_def):
+    soup_bread = {'id': 2, 'title': '2 tins soup get you a half price loaf',
+                  'qualifying_product': 'soup',
+                  'qualifying_qty': 2,
+                  'discounted_product': 'bread',
+                  'discount_percent': 50}
+    return [offer.Offer(offer_def), offer.Offer(soup_bread)]
+
+
+def test_remove_item(goods, meal_deal_offers):
+    b = basket.Basket(goods, meal_deal_offers, debug=True)
+    assert b.add('soup', 2)
+    assert b.add('bread')
+    b.calculate_discounts()
+    assert b.total == 170
+    assert b.remove('Soup')
+    assert b.subtotal == 145
+    b.calculate_discounts()
+    assert b.total == 145
+    assert b.discounted_items == []
+    assert b.remove('soup', 5)
+    assert list(b.items) == [goods['bread'].sku]
+    assert b.subtotal == 80
+
+
+@pytest.mark.parametrize('quantity', [0, -1])
+def test_quantity_bad(goods, offers, quantity):
+    b = basket.Basket(goods, offers)
+    assert b.add('apples', 2)
+    with pytest.raises(ValueError):
+        b.add('apples', quantity)
+    with pytest.raises(ValueError):
+        b.remove('apples', quantity)
+    assert b.items[goods['apples'].sku].quantity == 2
+    assert b.subtotal == 200
+
+
+def test_discount_order(goods, meal_deal_offers):
+    # Discounts are given in the order the units were added
+    b = basket.Basket(goods, meal_deal_offers)
+    for item in ('apples', 'bread', 'soup', 'soup', 'apples'):
+        assert b.add(item)
+    b.calculate_discounts()
+    assert [p.name for p in b.discounted_items] == [
+        'apples', 'bread', 'apples']
+    assert [(line.product.name, line.quantity)
+            for line in b.discount_lines] == [
+                ('apples', 1), ('bread', 1), ('apples', 1)]
+
+
+def test_discount_order_remove(goods, offers):
+    # The last units added are removed first
+    b = basket.Basket(goods, offers)
+    for item, quantity in (('apples', 1), ('milk', 1), ('apples', 2),
+                           ('bread', 1), ('apples', 1)):
+        assert b.add(item, quantity)
+    assert b.remove('apples', 2)
+    assert b.remove('bread')
+    b.calculate_discounts()
+    assert [(line.product.name, line.quantity)
+            for line in b.discount_lines] == [('apples', 2)]
+    assert b._runs == [[goods['apples'].sku, 1], [goods['milk'].sku, 1],
+                       [goods['apples'].sku, 1]]
+    assert b.remove('milk')
+    assert b._runs == [[goods['apples'].sku, 2]]
+
+
+def test_remove_item_not_in_basket(goods, offers):
+    b = basket.Basket(goods, offers)
+    assert b.remove('apples') is False
+    assert b.remove('pie') is False
+
+
+def test_total_before_recalculation(goods, offers):
+    b = basket.Basket(goods, offers)
+    assert b.add('apples')
+    b.calculate_discounts()
+    assert b.add('apples')
+    assert b.subtotal == 200
+    assert b.total == 190
+    b.calculate_discounts()
+    assert b.total == 180
+
+
+@pytest.mark.parametrize('strategy', engine.STRATEGIES)
+def test_readd_removed_item(goods, offers, strategy):
+    plan = engine.compile_offers(goods, offers, strategy)
+    b = basket.Basket(goods, offers, plan, debug=True)
+    assert b.add('apples')
+    b.calculate_discounts()
+    assert b.remove('apples')
+    assert b.add('apples')
+    b.calculate_discounts()
+    assert b.total == 90
+    assert len(b.discounted_items) == 1
+    assert len(b.discount_lines) == 1
+
+
+@pytest.mark.parametrize('strategy', engine.STRATEGIES)
+def test_add_remove_random(goods, meal_deal_offers, strategy):
+    rng = random.Random(0)
+    plan = engine.compile_offers(goods, meal_deal_offers, strategy)
+    b = basket.Basket(goods, meal_deal_offers, plan, debug=True)
+    for _ in range(500):
+        for _ in range(rng.randint(1, 3)):
+            item = rng.choice(list(goods))
+            if rng.random() < 0.5:
+                b.add(item, rng.randint(1, 2))
+            else:
+                b.remove(item, rng.randint(1, 2))
+        # Verifies every line against a full recalculation
+        b.calculate_discounts()
+
+
+def test_incremental_matches_full(goods, meal_deal_offers):
+    b = basket.Basket(goods, meal_deal_offers, debug=True)
+    for item in ('soup', 'bread', 'apples', 'soup', 'bread', 'soup', 'soup',
+                 'milk'):
+        assert b.add(item)
+        b.calculate_discounts()
+    assert b.total == 650 - 80 - 10
+    for item in ('soup', 'apples', 'bread', 'soup', 'soup'):
+        assert b.remove(item)
+        b.calculate_discounts()
+    assert b.total == 275
+
+
+def test_verify_discounts(goods, offers):
+    b = basket.Basket(goods, offers)
+    assert b.add('apples', 2)
+    b.calculate_discounts()
+    b.verify_discounts()
+    b.items[goods['apples'].sku].clear_offer()
+    with pytest.raises(AssertionError) as e:
+        b.verify_discounts()
+    assert 'Discounts on apples differ' in str(e.value)
+
+
+def test_statistics(goods, meal_deal_offers):
+    b = basket.Basket(goods, meal_deal_offers)
+    assert b.statistics == {'items_scanned': 0, 'offers_evaluated': 0,
+                            'offers_applied': []}
+    for item in ('bread', 'soup', 'apples', 'milk', 'soup'):
+        b.add(item)
+    statistics = b.statistics
+    assert statistics['items_scanned'] == 5
+    assert statistics['offers_evaluated'] == 5
+    assert statistics['offers_applied'] == meal_deal_offers
@@ -0,0 +1,179 @@
+import io
+import json
+
+import pytest
+
+import basket.batch as batch
+import basket.cache as cache
+import basket.columnar as columnar
+import basket.catalogue as catalogue
+import basket.logs as logs
+import basket.offer as offer
+from basket.testing import make_goods
+
+
+def make_shop():
+    goods = make_goods()
+    offers = [
+        offer.Offer({'id': 1, 'title': 'Apples 10% off',
+                     'qualifying_product': 'apples',
+                     'qualifying_qty': 1,
+                     'discounted_product': 'apples',
+                     'discount_percent': 10}),
+        offer.Offer({'id': 2, 'title': '2 tins soup get you a half price loaf',
+                     'qualifying_product': 'soup',
+                     'qualifying_qty': 2,
+                     'discounted_product': 'bread',
+                     'discount_percent': 50})]
+    return catalogue.Catalogue(goods, offers)
+
+
+@pytest.fixture
+def shop():
+    return make_shop()
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('["apples", "milk"]', (None, [('apples', 1), ('milk', 1)])),
+    ('{"items": ["apples"]}', (None, [('apples', 1)])),
+    ('{"id": "a1", "items": {"soup": 2}}', ('a1', [('soup', 2)])),
+    ('{"id": 7, "items": []}', (7, [])),
+])
+def test_parse_basket(line, expected):
+    assert batch.parse_basket(line) == expected
+
+
+def test_parse_basket_most_units():
+    assert batch.parse_basket('{"items": {"apples": 10000}}') == (
+        None, [('apples', 10000)])
+
+
+@pytest.mark.parametrize('line, message', [
+    ('foo', 'Expecting value'),
+    ('"apples"', 'Basket has no list of items'),
+    ('{"id": 1}', 'Basket has no list of items'),
+    ('[1]', 'Unacceptable item: 1'),
+    ('{"items": {"soup": 0}}', 'Unacceptable quantity for soup: 0'),
+    ('{"items": {"soup": "2"}}', 'Unacceptable quantity for soup: \'2\''),
+    ('{"items": {"soup": true}}', 'Unacceptable quantity for soup: True'),
+    ('{"items": {"apples": 5000000000}}',
+     'Basket holds more than 10000 units'),
+    ('{"items": {"apples": 6000, "soup": 5000}}',
+     'Basket holds more than 10000 units'),
+])
+def test_parse_basket_bad(line, message):
+    with pytest.raises(ValueError) as e:
+        batch.parse_basket(line)
+    assert message in str(e.value)
+
+
+def test_price(shop):
+    result = batch.price(shop, [('milk', 1), ('soup', 2), ('bread', 1),
+                                ('apples', 1), ('pie', 1)])
+    assert result == {
+        'subtotal': 440,
+        'discounts': ['2 tins soup get you a half price loaf: -40p',
+                      'Apples 10% off: -10p'],
+        'total': 390,
+        'unknown': ['pie']}
+
+
+def test_price_line_warnings(shop, capsys):
+    with logs.verbosity(logs.WARNING):
+        batch.price_line(shop, 1, '["apples", "pie"]')
+        batch.price_line(shop, 2, 'foo')
+        batch.price_line(shop, 3, '["apples"]')
+    stdout, _ = capsys.readouterr()
+    lines = stdout.splitlines()
+    assert len(lines) == 2
+    assert 'WARNING: Items not in stock in basket 1: pie' in lines[0]
+    assert 'WARNING: Failed to parse basket on line 2: Expecting' in lines[1]
+
+
+def test_price_lines(shop):
+    lines = ['["apples"]\n', '\n', 'foo\n', '{"id": "x", "items": ["milk"]}']
+    results = list(batch.price_lines(shop, lines))
+    assert len(results) == 3
+    assert results[0]['id'] == 1
+    assert results[0]['total'] == 90
+    assert results[1] == {'id': None, 'line': 3,
+                          'error': 'Expecting value: line 1 column 1 (char 0)'}
+    assert results[2]['id'] == 'x'
+    assert results[2]['total'] == 130
+
+
+def test_price_lines_shares_catalogue(shop):
+    lines = ['["apples"]'] * 3
+    results = list(batch.price_lines(shop, lines))
+    assert [r['total'] for r in results] == [90, 90, 90]
+    assert not shop.goods['apples'].has_offer
+
+
+def test_price_lines_cached(shop):
+    lines = ['["apples", "milk"]', '["milk", "apples"]', '["apples"]']
+    pricing_cache = cache.PricingCache()
+    results = list(batch.price_lines(shop, lines, pricing_cache))
+    assert results == list(batch.price_lines(shop, lines))
+    assert (pricing_cache.hits, pricing_cache.misses) == (1, 2)
+
+
+def test_write_results():
+    out = io.StringIO()
+    assert batch.write_results(iter([{'id': 1}, {'id': 2}]), out) == 2
+    assert [json.loads(l) for l in out.getvalue().splitlines()] == [
+        {'id': 1}, {'id': 2}]
+
+
+def test_format_results():
+    assert batch.format_results([{'id': 1}, {'id': 2}]) == (
+        '{"id": 1}\n{"id": 2}\n')
+    assert batch.format_results([]) == ''
+
+
+def test_chunk_lines():
+    lines = ['a\n', '\n', 'b\n', 'c\n', 'd\n']
+    assert list(batch.chunk_lines(lines, 2)) == [
+        [(1, 'a\n'), (3, 'b\n')], [(4, 'c\n'), (5, 'd\n')]]
+    assert list(batch.chunk_lines(lines, 10)) == [
+        [(1, 'a\n'), (3, 'b\n'), (4, 'c\n'), (5, 'd\n')]]
+    assert list(batch.chunk_lines([], 10)) == []
+
+
+def test_price_lines_parallel(shop):
+    lines = ['["apples"]', '["milk"]', 'foo', '{"id": "x", "items": ["soup"]}',
+             '["apples", "apples"]'] * 7
+    expected = batch.format_results(batch.price_lines(shop, lines))
+    text = ''.join(batch.price_lines_parallel(make_shop, iter(lines), 2, 3))
+    assert text == expected
+
+
+def test_price_lines_parallel_cached(shop):
+    lines = ['["apples"]', '["milk", "apples"]', '["apples", "milk"]'] * 5
+    expected = batch.format_results(batch.price_lines(shop, lines))
+    text = ''.join(batch.price_lines_parallel(make_shop, iter(lines), 2, 4,
+                                              cache_size=2))
+    assert text == expected
+
+
+def test_price_lines_parallel_rows(shop):
+    lines = ['["apples"]', 'foo', '{"id": "x", "items": ["soup", "soup"]}',
+             '["bread", "soup", "soup"]'] * 5
+    expected = columnar.price_rows(shop, next(batch.chunk_lines(lines, 100)),
+                                   columnar.offer_columns(shop.offers))
+    chunks = list(batch.price_lines_parallel(
+        make_shop, iter(lines), 2, 3, task=columnar.price_chunk_rows))
+    assert [row for rows in chunks for row in rows] == expected
+
+
+def test_parse_line(capsys):
+    assert batch.parse_line(4, '["apples"]') == (4, [('apples', 1)])
+    assert batch.parse_line(4, '{"id": "a", "items": []}') == ('a', [])
+    with logs.verbosity(logs.WARNING):
+        with pytest.raises(ValueError):
+            batch.parse_line(5, 'foo')
+    stdout, _ = capsys.readouterr()
+    assert 'WARNING: Failed to parse basket on line 5: Expecting' in stdout
+
+
+def test_price_lines_parallel_empty():
+    assert list(batch.price_lines_parallel(make_shop, [], 2)) == []
@@ -0,0 +1,116 @@
+import json
+import random
+
+import pytest
+
+import basket.benchmark as benchmark
+
+
+def test_make_goods():
+    goods = benchmark.make_goods(10, random.Random(0))
+    assert len(goods) == 10
+    assert len({g['name'] for g in goods}) == 10
+    assert all(10 <= g['price'] <= 2000 for g in goods)
+
+
+def test_make_offers():
+    rng = random.Random(0)
+    goods = benchmark.make_goods(10, rng)
+    offers = benchmark.make_offers(goods, 6, rng)
+    names = {g['name'] for g in goods}
+    assert [o['id'] for o in offers] == [1, 2, 3, 4, 5, 6]
+    for o in offers:
+        assert o['qualifying_product'] in names
+        assert o['discounted_product'] in names
+    assert offers[0]['qualifying_product'] == offers[0]['discounted_product']
+    assert offers[1]['qualifying_qty'] >= 2
+
+
+def test_make_baskets():
+    rng = random.Random(0)
+    goods = benchmark.make_goods(10, rng)
+    baskets = benchmark.make_baskets(goods, 100, rng, max_size=20)
+    assert len(baskets) == 100
+    assert all(1 <= len(items) <= 20 for items in baskets)
+    assert all(item.startswith('product') for items in baskets
+               for item in items)
+
+
+def test_make_baskets_deterministic():
+    goods = benchmark.make_goods(10, random.Random(0))
+    assert (benchmark.make_baskets(goods, 5, random.Random(1)) ==
+            benchmark.make_baskets(goods, 5, random.Random(1)))
+
+
+def test_measure():
+    calls = []
+    times = benchmark.measure(calls.append, 3, lambda: 'x')
+    assert calls == ['x', 'x', 'x']
+    assert len(times) == 3
+    assert all(t >= 0 for t in times)
+
+
+def test_summarize():
+    result = benchmark.summarize([2.0, 1.0, 3.0], 4)
+    assert result == {'ops': 4, 'runs': 3, 'best': 1.0, 'mean': 2.0,
+                      'per_op_us': 250000.0}
+
+
+def test_run():
+    results = benchmark.run(num_goods=20, num_offers=10, num_baskets=10,
+                            repeat=1, main_baskets=2)
+    assert results['config']['baskets'] == 10
+    assert set(results['results']) == {
+        'load_goods', 'load_offers', 'add', 'calculate_discounts', 'total',
+        'main', 'interpreter', 'startup'}
+    assert results['startup_overhead'] == (
+        results['results']['startup']['best'] -
+        results['results']['interpreter']['best'])
+    assert results['results']['main']['ops'] == 2
+    json.dumps(results)
+
+
+def test_compare():
+    baseline = {'results': {'add': {'per_op_us': 2.0},
+                            'total': {'per_op_us': 0.0}}}
+    current = {'results': {'add': {'per_op_us': 3.0},
+                           'total': {'per_op_us': 1.0},
+                           'main': {'per_op_us': 1.0}}}
+    assert benchmark.compare(baseline, current) == [('add', 2.0, 3.0, 1.5)]
+
+
+def test_main_benchmark(tmpdir, capsys):
+    output = str(tmpdir.join('results.json'))
+    argv = ['--goods', '20', '--offers', '10', '--baskets', '10',
+            '--repeat', '1']
+    assert benchmark.main_benchmark(
+        argv + ['--output', output, '--startup-budget', '10000']) == 0
+    stdout, _ = capsys.readouterr()
+    with open(output) as f:
+        assert json.load(f) == json.loads(stdout)
+
+    with open(output, 'w') as f:
+        json.dump({'results': {'add': {'per_op_us': 1e-9}}}, f)
+    assert benchmark.main_benchmark(
+        argv + ['--compare', output, '--startup-budget', '10000']) == 1
+    _, stderr = capsys.readouterr()
+    assert 'REGRESSION' in stderr
+
+
+def test_main_benchmark_startup_budget(capsys):
+    argv = ['--goods', '20', '--offers', '10', '--baskets', '10',
+            '--repeat', '1', '--startup-budget', '-1']
+    assert benchmark.main_benchmark(argv) == 1
+    _, stderr = capsys.readouterr()
+    assert 'over the budget of -1ms' in stderr
+
+
+@pytest.mark.parametrize('argv, message', [
+    (['--repeat', '0'], 'must be at least 1'),
+    (['--offers', '-1'], '--offers cannot be negative'),
+])
+def test_parse_args_bad(argv, message, capsys):
+    with pytest.raises(SystemExit):
+        benchmark.parse_args(argv)
+    _, stderr = capsys.readouterr()
+    assert message in stderr
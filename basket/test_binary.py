@@ -0,0 +1,230 @@
+import pytest
+
+import basket.binary as binary
+import basket.catalogue as catalogue
+import basket.offer as offer
+import basket.product as product
+import basket.testing as testing
+
+
+def make_goods():
+    goods = testing.make_goods()
+    goods['crème'] = product.Product('Crème', 150, 'pot')
+    return goods
+
+
+def make_offers():
+    return [
+        offer.Offer({'id': 1, 'title': 'Apples 10% off',
+                     'qualifying_product': 'apples',
+                     'qualifying_qty': 1,
+                     'discounted_product': 'apples',
+                     'discount_percent': 10}),
+        offer.Offer({'id': 'two',
+                     'title': '2 tins soup get you a half price loaf',
+                     'qualifying_product': 'soup',
+                     'qualifying_qty': 2,
+                     'discounted_product': 'bread',
+                     'discount_percent': 50}),
+        offer.Offer({'id': 3, 'title': 'Pie makes soup free',
+                     'qualifying_product': 'pie',
+                     'qualifying_qty': 1,
+                     'discounted_product': 'soup',
+                     'discount_percent': 100}),
+        offer.Offer({'id': 4, 'title': 'Apples give 12.5% off soup',
+                     'qualifying_product': 'apples',
+                     'qualifying_qty': 1,
+                     'discounted_product': 'soup',
+                     'discount_percent': 12.5})]
+
+
+@pytest.fixture
+def catalogue_file(tmpdir):
+    path = str(tmpdir.join('catalogue.bin'))
+    binary.write_catalogue(path, make_goods(), make_offers())
+    return path
+
+
+@pytest.fixture
+def mapped(catalogue_file):
+    shop = binary.load(catalogue_file)
+    yield shop
+    shop.close()
+
+
+def test_goods(mapped):
+    assert len(mapped.goods) == 5
+    assert sorted(mapped.goods) == ['apples', 'bread', 'crème', 'milk',
+                                    'soup']
+    p = mapped.goods['crème']
+    assert (p.name, p.price, p.unit) == ('crème', 150, 'pot')
+    assert p.sku == product.intern_sku('crème')
+    assert mapped.goods['crème'] is p
+    assert 'pie' not in mapped.goods
+    assert mapped.goods.get('pie') is None
+    with pytest.raises(KeyError):
+        mapped.goods['pie']  # pylint: disable=pointless-statement
+
+
+def test_goods_lazy(mapped):
+    mapped.goods['milk']  # pylint: disable=pointless-statement
+    assert list(mapped._products) == ['milk']
+
+
+def test_offers(mapped):
+    assert len(mapped.offers) == 4
+    o = mapped.offers[1]
+    assert o.offer_id == 'two'
+    assert o.title == '2 tins soup get you a half price loaf'
+    assert (o.qualifying_product, o.qualifying_qty) == ('soup', 2)
+    assert (o.discounted_product, o.discount_percent) == ('bread', 50.0)
+    assert mapped.offers[-1].discount_percent == 12.5
+    assert [o.offer_id for o in mapped.offers[:2]] == [1, 'two']
+    with pytest.raises(IndexError):
+        mapped.offers[4]  # pylint: disable=pointless-statement
+
+
+def test_offer_positions(mapped):
+    assert mapped.offer_positions('apples') == ((0, 3), (0,))
+    assert mapped.offer_positions('soup') == ((1,), (3,))
+    assert mapped.offer_positions('milk') == ((), ())
+    assert mapped.offer_positions('pie') == ((), ())
+
+
+@pytest.mark.parametrize('items', [
+    ['apples', 'milk'],
+    ['soup', 'soup', 'bread', 'apples', 'Crème'],
+    ['soup', 'apples', 'apples', 'soup', 'bread', 'bread', 'pie'],
+    [],
+])
+def test_prices_match(mapped, items):
+    shop = catalogue.Catalogue(make_goods(), make_offers())
+    expected = shop.new_basket()
+    actual = mapped.new_basket()
+    actual.debug = True
+    for item in items:
+        assert actual.add(item) == expected.add(item)
+    expected.calculate_discounts()
+    actual.calculate_discounts()
+    assert actual.subtotal == expected.subtotal
+    assert actual.total == expected.total
+    assert ([p.discount_message for p in actual.discounted_items] ==
+            [p.discount_message for p in expected.discounted_items])
+    priced = mapped.price([(item, 1) for item in items])
+    assert priced.total == expected.total
+    assert priced.discounts == [p.discount_message
+                                for p in expected.discounted_items]
+
+
+@pytest.mark.parametrize('strategy', ['best', 'exclusive'])
+def test_strategy(catalogue_file, strategy):
+    items = ['apples', 'apples', 'soup', 'soup', 'soup', 'bread']
+    shop = catalogue.Catalogue(make_goods(), make_offers(),
+                               strategy=strategy)
+    expected = shop.new_basket()
+    mapped = binary.load(catalogue_file, strategy)
+    assert mapped.plan.strategy == strategy
+    actual = mapped.new_basket()
+    actual.debug = True
+    for item in items:
+        assert actual.add(item) == expected.add(item)
+    expected.calculate_discounts()
+    actual.calculate_discounts()
+    assert actual.total == expected.total
+    mapped.close()
+
+
+def test_load_unknown_strategy(catalogue_file):
+    with pytest.raises(ValueError):
+        binary.load(catalogue_file, 'cheapest')
+
+
+def test_current(mapped):
+    assert mapped.current() is mapped
+    assert mapped.version == 1
+
+
+def test_empty_catalogue(tmpdir):
+    path = str(tmpdir.join('empty.bin'))
+    binary.write_catalogue(path, {}, [])
+    shop = binary.load(path)
+    assert len(shop.goods) == 0
+    assert len(shop.offers) == 0
+    b = shop.new_basket()
+    assert not b.add('apples')
+
+
+def test_rewrite_keeps_open_catalogue(catalogue_file):
+    shop = binary.load(catalogue_file)
+    binary.write_catalogue(catalogue_file, {}, [])
+    assert shop.goods['milk'].price == 130
+    assert len(binary.load(catalogue_file).goods) == 0
+
+
+def test_write_failure_removes_temp(tmpdir, monkeypatch):
+    def fail(src, dst):
+        raise OSError('Disk full')
+    monkeypatch.setattr(binary.os, 'replace', fail)
+    with pytest.raises(OSError):
+        binary.write_catalogue(str(tmpdir.join('catalogue.bin')),
+                               make_goods(), make_offers())
+    assert tmpdir.listdir() == []
+
+
+@pytest.mark.parametrize('data, message', [
+    (b'', 'Not a catalogue file'),
+    (b'BSKT', 'Not a catalogue file'),
+    (b'[{"name": "Soup", "price": 65, "unit": "Tin"}]',
+     'Not a catalogue file'),
+    (binary.HEADER.pack(binary.MAGIC, 99, 0, 0, 0, 0, 0, 0, 0),
+     'Unsupported catalogue file version 99'),
+])
+def test_load_bad(tmpdir, data, message):
+    path = tmpdir.join('bad.bin')
+    path.write_binary(data)
+    with pytest.raises(ValueError) as e:
+        binary.load(str(path))
+    assert message in str(e.value)
+
+
+@pytest.mark.parametrize('section', [0, 1, 2])
+def test_load_truncated(catalogue_file, section):
+    with open(catalogue_file, 'rb') as f:
+        data = f.read()
+    # Part way through the goods, offers or offer index
+    size = binary.HEADER.unpack_from(data)[6 + section] - 2
+    with open(catalogue_file, 'wb') as f:
+        f.write(data[:size])
+    with pytest.raises(ValueError) as e:
+        binary.load(catalogue_file)
+    assert str(e.value) == 'Corrupt catalogue file: ' + catalogue_file
+
+
+def test_corrupt_records(catalogue_file):
+    with open(catalogue_file, 'rb') as f:
+        data = bytearray(f.read())
+    goods_offset = binary.HEADER.unpack_from(data)[5]
+    last = goods_offset + binary.GOOD.size * (len(make_goods()) - 1)
+    # Point the first product's name past the end of the file, and the last
+    # product's qualifying offers past the end of the offer index
+    binary.NAME.pack_into(data, goods_offset, len(data), 5)
+    binary.INDEX.pack_into(data, last + binary.GOOD.size - 16, 1000)
+    with open(catalogue_file, 'wb') as f:
+        f.write(data)
+    shop = binary.load(catalogue_file)
+    try:
+        with pytest.raises(ValueError) as e:
+            list(shop.goods)
+        assert str(e.value) == 'Corrupt catalogue file: ' + catalogue_file
+        with pytest.raises(ValueError):
+            shop.offer_positions('soup')
+    finally:
+        shop.close()
+
+
+def test_string_table():
+    strings = binary.StringTable()
+    assert strings.add('tin') == (0, 3)
+    assert strings.add('crème') == (3, 6)
+    assert strings.add('tin') == (0, 3)
+    assert bytes(strings.data) == 'tincrème'.encode('utf-8')
@@ -0,0 +1,133 @@
+import pytest
+
+import basket.batch as batch
+import basket.cache as cache
+import basket.catalogue as catalogue
+import basket.offer as offer
+from basket.testing import make_goods
+
+
+def make_shop(version=1, apples_discount=10):
+    goods = make_goods()
+    offers = [
+        offer.Offer({'id': 1,
+                     'title': 'Apples {}% off'.format(apples_discount),
+                     'qualifying_product': 'apples',
+                     'qualifying_qty': 1,
+                     'discounted_product': 'apples',
+                     'discount_percent': apples_discount}),
+        offer.Offer({'id': 2, 'title': '2 tins soup get you a half price loaf',
+                     'qualifying_product': 'soup',
+                     'qualifying_qty': 2,
+                     'discounted_product': 'bread',
+                     'discount_percent': 50})]
+    return catalogue.Catalogue(goods, offers, version)
+
+
+@pytest.fixture
+def shop():
+    return make_shop()
+
+
+@pytest.fixture
+def pricing_cache():
+    return cache.PricingCache(maxsize=2)
+
+
+@pytest.mark.parametrize('items', [
+    [('milk', 1), ('soup', 2), ('bread', 1), ('apples', 2), ('pie', 1)],
+    [('Bread', 1), ('soup', 1), ('APPLES', 1), ('soup', 1), ('apples', 1)],
+    [('soup', 3), ('bread', 2)],
+    [('pie', 2)],
+    [],
+])
+def test_price(shop, pricing_cache, items):
+    expected = batch.price(shop, items)
+    assert pricing_cache.price(shop, items) == expected
+    assert pricing_cache.price(shop, items) == expected
+    assert (pricing_cache.hits, pricing_cache.misses) == (1, 1)
+
+
+def test_price_any_order(shop, pricing_cache):
+    first = [('apples', 1), ('soup', 2), ('bread', 1)]
+    second = [('bread', 1), ('soup', 1), ('apples', 1), ('soup', 1)]
+    pricing_cache.price(shop, first)
+    result = pricing_cache.price(shop, second)
+    assert pricing_cache.hits == 1
+    # The discounts are listed in the order of the basket priced
+    assert result == batch.price(shop, second)
+    assert result['discounts'] == [
+        '2 tins soup get you a half price loaf: -40p',
+        'Apples 10% off: -10p']
+
+
+def test_price_interleaved(shop, pricing_cache):
+    items = [('apples', 1), ('soup', 1), ('soup', 1), ('bread', 1),
+             ('apples', 1)]
+    expected = batch.price(shop, items)
+    # The discounts are listed in the order the units were given, not
+    # grouped by item, whether priced or found in the cache
+    assert expected['discounts'] == [
+        'Apples 10% off: -10p',
+        '2 tins soup get you a half price loaf: -40p',
+        'Apples 10% off: -10p']
+    assert pricing_cache.price(shop, items) == expected
+    assert pricing_cache.price(shop, items) == expected
+    assert pricing_cache.hits == 1
+
+
+def test_price_unknown_items(shop, pricing_cache):
+    pricing_cache.price(shop, [('milk', 1)])
+    result = pricing_cache.price(shop, [('pie', 1), ('milk', 1)])
+    assert pricing_cache.hits == 1
+    assert result['unknown'] == ['pie']
+    assert result['total'] == 130
+
+
+def test_eviction(shop, pricing_cache):
+    pricing_cache.price(shop, [('milk', 1)])
+    pricing_cache.price(shop, [('soup', 1)])
+    pricing_cache.price(shop, [('milk', 1)])
+    pricing_cache.price(shop, [('bread', 1)])  # Evicts soup
+    assert len(pricing_cache) == 2
+    pricing_cache.price(shop, [('milk', 1)])
+    assert pricing_cache.hits == 2
+    pricing_cache.price(shop, [('soup', 1)])
+    assert pricing_cache.misses == 4
+
+
+def test_new_version(pricing_cache):
+    old = make_shop(1, 10)
+    new = make_shop(2, 20)
+    assert pricing_cache.price(old, [('apples', 1)])['total'] == 90
+    assert pricing_cache.price(new, [('apples', 1)])['total'] == 80
+    assert pricing_cache.catalogue is new
+    assert pricing_cache.misses == 2
+    assert len(pricing_cache) == 1
+
+
+def test_old_version_bypasses_cache(pricing_cache):
+    old = make_shop(1, 10)
+    new = make_shop(2, 20)
+    pricing_cache.price(new, [('apples', 1)])
+    assert pricing_cache.price(old, [('apples', 1)])['total'] == 90
+    assert pricing_cache.price(old, [('apples', 1)])['total'] == 90
+    assert pricing_cache.catalogue is new
+    assert pricing_cache.hits == 0
+    assert pricing_cache.price(new, [('apples', 1)])['total'] == 80
+    assert pricing_cache.hits == 1
+
+
+def test_clear(shop, pricing_cache):
+    pricing_cache.price(shop, [('milk', 1)])
+    pricing_cache.clear()
+    assert len(pricing_cache) == 0
+    pricing_cache.price(shop, [('milk', 1)])
+    assert pricing_cache.misses == 2
+
+
+def test_price_counts(shop):
+    subtotal, total, messages = cache.price_counts(
+        shop, {'apples': 2, 'milk': 1})
+    assert (subtotal, total) == (330, 310)
+    assert messages == {'apples': (('Apples 10% off: -10p', 2),)}
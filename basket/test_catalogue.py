@@ -0,0 +1,262 @@
+import json
+import os
+
+import pytest
+
+import basket.catalogue as catalogue
+import basket.offer as offer
+import basket.product as product
+
+
+@pytest.fixture
+def goods():
+    return {
+      'soup': product.Product('soup', 65, 'tin'),
+      'apples': product.Product('apples', 100, 'bag'), }
+
+
+@pytest.fixture
+def offers():
+    return [offer.Offer({'id': 1, 'title': 'Apples 10% off',
+                         'qualifying_product': 'apples',
+                         'qualifying_qty': 1,
+                         'discounted_product': 'apples',
+                         'discount_percent': 10})]
+
+
+def test_catalogue(goods, offers):
+    c = catalogue.Catalogue(goods, offers)
+    assert c.goods == goods
+    assert c.offers == tuple(offers)
+    assert [rule.offer for rule in c.plan.rules] == list(offers)
+    assert c.version == 1
+    assert c.current() is c
+
+
+def test_catalogue_frozen(goods, offers):
+    c = catalogue.Catalogue(goods, offers, version=3)
+    assert c.version == 3
+    goods.clear()
+    offers.clear()
+    assert len(c.goods) == 2
+    assert len(c.offers) == 1
+    with pytest.raises(TypeError):
+        c.goods['bread'] = product.Product('bread', 80, 'loaf')
+
+
+def test_catalogue_strategy(goods, offers):
+    assert catalogue.Catalogue(goods, offers).plan.strategy == 'ordered'
+    c = catalogue.Catalogue(goods, offers, strategy='exclusive')
+    assert c.plan.strategy == 'exclusive'
+    b = c.new_basket()
+    assert b.add('apples', 2)
+    b.calculate_discounts()
+    assert b.total == 180
+
+
+def test_price(goods, offers):
+    c = catalogue.Catalogue(goods, offers)
+    priced = c.price([('Apples', 2), ('soup', 1), ('eggs', 1)])
+    assert priced.subtotal == 265
+    assert priced.total == 245
+    assert priced.discounts == ['Apples 10% off: -10p'] * 2
+    assert priced.unknown == ('eggs',)
+
+
+def test_new_basket(goods, offers):
+    c = catalogue.Catalogue(goods, offers)
+    b1 = c.new_basket()
+    b2 = c.new_basket()
+    assert b1 is not b2
+    assert b1.goods is c.goods
+    assert b1.plan is c.plan
+    assert b2.plan is c.plan
+    assert b1.add('apples')
+    b1.calculate_discounts()
+    assert b1.total == 90
+    assert b2.items == {}
+
+
+def write_json(path, data, mtime=None):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def load_goods(path):
+    with open(path) as f:
+        try:
+            data = json.load(f)
+        except ValueError:
+            return None
+    return {p['name']: product.Product(p['name'], p['price'], p['unit'])
+            for p in data}
+
+
+def load_offers(path):
+    with open(path) as f:
+        try:
+            data = json.load(f)
+        except ValueError:
+            return None
+    return [offer.Offer(o) for o in data]
+
+
+@pytest.fixture
+def files(tmpdir):
+    goods_path = str(tmpdir.join('goods.json'))
+    offers_path = str(tmpdir.join('offers.json'))
+    write_json(goods_path, [{'name': 'apples', 'price': 100, 'unit': 'bag'}],
+               1000)
+    write_json(offers_path, [{'id': 1, 'title': 'Apples 10% off',
+                              'qualifying_product': 'apples',
+                              'qualifying_qty': 1,
+                              'discounted_product': 'apples',
+                              'discount_percent': 10}], 1000)
+    return goods_path, offers_path
+
+
+@pytest.fixture
+def manager(files):
+    loads = []
+
+    def counting(loader):
+        def load(path):
+            loads.append(os.path.basename(path))
+            return loader(path)
+        return load
+
+    m = catalogue.CatalogueManager(files[0], files[1], counting(load_goods),
+                                   counting(load_offers), check_interval=0)
+    m.loads = loads
+    return m
+
+
+def test_file_signature(files, tmpdir):
+    signature = catalogue.file_signature(files[0])
+    assert signature == (os.stat(files[0]).st_ino, 1000 * 10 ** 9,
+                         os.path.getsize(files[0]))
+    assert catalogue.file_signature(str(tmpdir.join('foo.json'))) is None
+
+
+def test_manager(manager):
+    c = manager.current()
+    assert c.version == 1
+    assert manager.loads == ['goods.json', 'offers.json']
+    b = c.new_basket()
+    assert b.add('apples')
+    b.calculate_discounts()
+    assert b.total == 90
+
+
+def test_manager_strategy(files):
+    m = catalogue.CatalogueManager(files[0], files[1], load_goods,
+                                   load_offers, check_interval=0,
+                                   strategy='best')
+    assert m.current().plan.strategy == 'best'
+    with open(files[1], 'w') as f:
+        f.write('[]')
+    os.utime(files[1], (2000, 2000))
+    assert m.reload()
+    assert m.current().plan.strategy == 'best'
+
+
+def test_manager_unchanged(manager):
+    c = manager.current()
+    assert manager.reload() is False
+    assert manager.current() is c
+    assert manager.loads == ['goods.json', 'offers.json']
+
+
+def test_manager_offers_changed(manager, files):
+    old = manager.current()
+    in_flight = old.new_basket()
+    assert in_flight.add('apples')
+    write_json(files[1], [{'id': 1, 'title': 'Apples 50% off',
+                           'qualifying_product': 'apples',
+                           'qualifying_qty': 1,
+                           'discounted_product': 'apples',
+                           'discount_percent': 50}], 2000)
+    new = manager.current()
+    assert new is not old
+    assert new.version == 2
+    assert new.goods is old.goods
+    assert manager.loads == ['goods.json', 'offers.json', 'offers.json']
+    b = new.new_basket()
+    assert b.add('apples')
+    b.calculate_discounts()
+    assert b.total == 50
+    in_flight.calculate_discounts()
+    assert in_flight.total == 90
+
+
+def test_manager_goods_replaced(manager, files):
+    old = manager.current()
+    replacement = files[0] + '.new'
+    write_json(replacement, [{'name': 'apples', 'price': 200, 'unit': 'bag'}],
+               1000)
+    os.replace(replacement, files[0])
+    new = manager.current()
+    assert new.version == 2
+    assert new.offers is old.offers
+    assert new.goods['apples'].price == 200
+    assert manager.loads == ['goods.json', 'offers.json', 'goods.json']
+
+
+def test_manager_truncated(manager, files):
+    old = manager.current()
+    with open(files[1]) as f:
+        text = f.read()
+    # Part way through being written
+    with open(files[1], 'w') as f:
+        f.write(text[:len(text) // 2])
+    os.utime(files[1], (2000, 2000))
+    assert manager.reload() is False
+    assert manager.current() is old
+    b = manager.current().new_basket()
+    assert b.add('apples')
+    b.calculate_discounts()
+    assert b.total == 90
+    # The file is loaded again at each check until it can be
+    loads = len(manager.loads)
+    assert manager.reload() is False
+    assert manager.loads[loads:] == ['offers.json']
+    assert manager.loads.count('goods.json') == 1
+    with open(files[1], 'w') as f:
+        f.write(text)
+    os.utime(files[1], (3000, 3000))
+    assert manager.reload() is True
+    assert manager.current().version == 2
+    assert len(manager.current().offers) == 1
+
+
+def test_manager_truncated_first(files):
+    with open(files[1], 'w') as f:
+        f.write('[{"id": 1')
+    m = catalogue.CatalogueManager(files[0], files[1], load_goods,
+                                   load_offers, check_interval=0)
+    assert m.current().offers == ()
+    assert len(m.current().goods) == 1
+    write_json(files[1], [], 2000)
+    assert m.reload() is True
+    assert m.current().version == 2
+
+
+def test_manager_check_interval(manager, files):
+    manager.check_interval = 3600
+    manager.reload()
+    c = manager.current()
+    write_json(files[1], [], 2000)
+    assert manager.current() is c
+    assert manager.reload() is True
+    assert manager.current().offers == ()
+
+
+def test_manager_reload_in_progress(manager, files):
+    c = manager.current()
+    write_json(files[1], [], 2000)
+    with manager._lock:
+        assert manager.reload() is False
+        assert manager.current() is c
+    assert manager.current() is not c
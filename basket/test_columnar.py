@@ -0,0 +1,103 @@
+import csv
+import io
+
+import pytest
+
+import basket.catalogue as catalogue
+import basket.columnar as columnar
+import basket.logs as logs
+import basket.offer as offer
+from basket.testing import make_goods
+
+
+@pytest.fixture
+def shop():
+    goods = make_goods()
+    offers = [
+        offer.Offer({'id': 1, 'title': 'Apples 10% off',
+                     'qualifying_product': 'apples',
+                     'qualifying_qty': 1,
+                     'discounted_product': 'apples',
+                     'discount_percent': 10}),
+        offer.Offer({'id': 'soup', 'title': 'Half price loaf',
+                     'qualifying_product': 'soup',
+                     'qualifying_qty': 2,
+                     'discounted_product': 'bread',
+                     'discount_percent': 50})]
+    return catalogue.Catalogue(goods, offers)
+
+
+HEADER = ['id', 'subtotal', 'discount', 'total', 'offer_1_units',
+          'offer_1_discount', 'offer_soup_units', 'offer_soup_discount']
+
+
+def test_column_names(shop):
+    assert columnar.column_names(shop.offers) == HEADER
+    offers = list(shop.offers) * 2
+    assert columnar.column_names(offers)[-4:] == [
+        'offer_1_2_units', 'offer_1_2_discount', 'offer_soup_3_units',
+        'offer_soup_3_discount']
+
+
+def test_offer_columns(shop):
+    apples, soup = shop.offers
+    assert columnar.offer_columns(shop.offers) == {apples: 4, soup: 6}
+
+
+def test_price_rows(shop, capsys):
+    lines = [(1, '["apples", "apples", "pie"]'), (2, 'foo'),
+             (3, '{"id": "b3", "items": {"soup": 4, "bread": 3}}'),
+             (4, '[]')]
+    with logs.verbosity(logs.WARNING):
+        rows = columnar.price_rows(shop, lines,
+                                   columnar.offer_columns(shop.offers))
+    assert rows == [
+        [1, 200, 20, 180, 2, 20, 0, 0],
+        ['b3', 500, 80, 420, 0, 0, 2, 80],
+        [4, 0, 0, 0, 0, 0, 0, 0]]
+    stdout, _ = capsys.readouterr()
+    assert 'Items not in stock in basket 1: pie' in stdout
+    assert 'Failed to parse basket on line 2' in stdout
+
+
+@pytest.mark.parametrize('output_format, delimiter', [('csv', ','),
+                                                      ('tsv', '\t')])
+def test_writer_delimited(output_format, delimiter):
+    out = io.StringIO()
+    with columnar.ColumnarWriter(out, ['id', 'total'], output_format,
+                                 chunk_size=2) as writer:
+        writer.write_rows([[1, 10]])
+        assert out.getvalue() == 'id{}total\n'.format(delimiter)
+        writer.write_rows([['a,b', 20], [3, 30]])
+        assert writer.rows_written == 3
+        writer.write_rows([[4, 40]])
+    assert writer.rows_written == 4
+    assert list(csv.reader(io.StringIO(out.getvalue()),
+                           delimiter=delimiter)) == [
+        ['id', 'total'], ['1', '10'], ['a,b', '20'], ['3', '30'],
+        ['4', '40']]
+
+
+def test_writer_unknown_format():
+    with pytest.raises(ValueError):
+        columnar.ColumnarWriter(io.StringIO(), ['id'], 'xlsx')
+
+
+@pytest.mark.parametrize('output_format', columnar.BINARY_FORMATS)
+def test_writer_arrow(shop, output_format):
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.ipc  # pylint: disable=import-outside-toplevel
+    import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+    out = io.BytesIO()
+    rows = [[1, 200, 20, 180, 2, 20, 0, 0], ['b3', 500, 80, 420, 0, 0, 2, 80]]
+    with columnar.ColumnarWriter(out, HEADER, output_format,
+                                 chunk_size=1) as writer:
+        writer.write_rows(rows)
+    out.seek(0)
+    if output_format == 'parquet':
+        table = pyarrow.parquet.read_table(out)
+    else:
+        table = pyarrow.ipc.open_file(out).read_all()
+    assert table.column_names == HEADER
+    assert table.column('id').to_pylist() == ['1', 'b3']
+    assert table.column('offer_soup_discount').to_pylist() == [0, 80]
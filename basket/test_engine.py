@@ -0,0 +1,325 @@
+import random
+import types
+
+import pytest
+
+import basket.engine as engine
+import basket.product as product
+from basket.testing import make_offer
+
+
+@pytest.fixture
+def offers():
+    return [make_offer(1, 'apples', 1, 'apples', 10),
+            make_offer(2, 'soup', 2, 'bread', 50),
+            make_offer(3, 'pie', 1, 'apples', 10),
+            make_offer(4, 'apples', 1, 'soup', 33)]
+
+
+def sku(name):
+    return product.intern_sku(name)
+
+
+def test_plan_sku_beyond_goods(goods, offers):
+    # Offers for products interned after the goods are left out
+    late = [make_offer(5, 'late_{}'.format(product.sku_count()), 1,
+                       'apples', 10)]
+    plan = engine.compile_offers(goods, offers + late)
+    assert len(plan.prices) == max(p.sku for p in goods.values()) + 1
+    assert [rule.position for rule in plan.rules] == [0, 1, 3]
+
+
+def test_plan_no_goods():
+    plan = engine.compile_offers({}, [make_offer(1, 'apples', 1, 'apples',
+                                                 10)])
+    assert plan.prices == []
+    assert plan.rules == []
+    assert plan.allocate({}) == {}
+
+
+def test_plan(goods, offers):
+    plan = engine.compile_offers(goods, offers)
+    # Sized by the goods, not by every SKU id interned
+    assert len(plan.prices) == max(p.sku for p in goods.values()) + 1
+    assert [plan.prices[sku(name)] for name in goods] == [65, 80, 130, 100]
+    assert [rule.offer for rule in plan.rules] == [offers[0], offers[1],
+                                                   offers[3]]
+    assert [rule.position for rule in plan.rules] == [0, 1, 3]
+    assert plan.by_qualifying[sku('apples')] == (0, 2)
+    assert plan.by_qualifying[sku('soup')] == (1,)
+    assert plan.by_discounted[sku('apples')] == (0,)
+    assert plan.by_discounted[sku('bread')] == (1,)
+    assert plan.by_discounted[sku('soup')] == (2,)
+    assert plan.by_discounted[sku('milk')] == ()
+    assert plan.by_pair == {(sku('apples'), sku('apples')): (0,),
+                            (sku('soup'), sku('bread')): (1,),
+                            (sku('apples'), sku('soup')): (2,)}
+    assert plan.shadowed == {}
+
+
+def test_rule(goods, offers):
+    plan = engine.compile_offers(goods, offers)
+    rule = plan.rules[2]
+    assert rule.qualifying == sku('apples')
+    assert rule.qualifying_qty == 1
+    assert rule.discounted == sku('soup')
+    assert rule.unit_discount == 21
+
+
+def test_plan_empty(goods):
+    plan = engine.compile_offers(goods, [])
+    assert plan.rules == []
+    assert plan.allocate({sku('soup'): 1, sku('apples'): 2}) == {}
+    assert engine.compile_offers({}, []).allocate({}) == {}
+
+
+def test_allocate(goods, offers):
+    plan = engine.compile_offers(goods, offers)
+    rules = plan.rules
+    soup, bread, milk, apples = (sku(name) for name in goods)
+    assert plan.allocate({apples: 2}) == {apples: [(rules[0], 2)]}
+    assert plan.allocate({soup: 5, bread: 1, apples: 1}) == {
+        soup: [(rules[2], 1)], bread: [(rules[1], 1)],
+        apples: [(rules[0], 1)]}
+    assert plan.allocate({soup: 1, bread: 1}) == {}
+    assert plan.allocate({milk: 1}) == {}
+
+
+def test_allocate_override(goods):
+    offers = [make_offer(1, 'apples', 1, 'apples', 10),
+              make_offer(2, 'apples', 2, 'apples', 50)]
+    plan = engine.compile_offers(goods, offers)
+    first, second = plan.rules
+    apples = sku('apples')
+    assert plan.allocate({apples: 5}) == {apples: [(second, 2), (first, 3)]}
+    assert plan.allocate({apples: 1}) == {apples: [(first, 1)]}
+
+
+@pytest.mark.parametrize('strategy, expected', [
+    # 2 and 3 are replaced on every unit by 4, which needs no more apples
+    (engine.ORDERED, {1: 3, 2: 3}),
+    # 5 gives nothing
+    (engine.BEST, {4: None}),
+    # 2 and 4 need as many apples as 3 for less discount
+    (engine.EXCLUSIVE, {1: 2, 3: 2, 4: None}),
+])
+def test_shadowed(goods, strategy, expected):
+    offers = [make_offer(1, 'apples', 1, 'apples', 10),
+              make_offer(2, 'apples', 2, 'apples', 10),
+              make_offer(3, 'apples', 2, 'apples', 50),
+              make_offer(4, 'apples', 2, 'apples', 20),
+              make_offer(5, 'soup', 1, 'bread', 0),
+              make_offer(6, 'soup', 2, 'bread', 50)]
+    plan = engine.compile_offers(goods, offers, strategy)
+    assert engine.shadowed(plan.rules, strategy) == expected
+    assert plan.shadowed == expected
+    # Shadowed rules are kept, but never evaluated
+    assert len(plan.rules) == 6
+    indices = plan.by_qualifying[sku('apples')] + plan.by_qualifying[
+        sku('soup')]
+    assert sorted(indices) == [i for i in range(6) if i not in expected]
+
+
+def test_relevant(goods):
+    offers = [make_offer(1, 'apples', 1, 'soup', 10),
+              make_offer(2, 'apples', 1, 'bread', 10),
+              make_offer(3, 'apples', 1, 'milk', 10),
+              make_offer(4, 'apples', 2, 'apples', 10),
+              make_offer(5, 'soup', 1, 'apples', 10)]
+    plan = engine.compile_offers(goods, offers)
+    soup, bread, apples = sku('soup'), sku('bread'), sku('apples')
+    # Apples qualify for more rules than there are products in the basket,
+    # so only those discounting products in the basket are looked up
+    assert plan.relevant({apples: 2, soup: 1}) == [0, 3, 4]
+    assert plan.relevant({apples: 1, soup: 1, bread: 1, sku('milk'): 1}) == [
+        0, 1, 2, 3, 4]
+    assert plan.relevant({soup: 1}) == [4]
+    assert plan.relevant({}) == []
+    assert set(plan.involving(apples, {apples: 2, soup: 1})) == {
+        0, 1, 2, 3, 4}
+    assert sorted(plan.involving(apples, {soup: 1})) == [0, 3, 4]
+    assert sorted(plan.involving(soup, {apples: 1})) == [0, 4]
+
+
+@pytest.mark.parametrize('strategy', engine.STRATEGIES)
+def test_pruning_unchanged(goods, strategy, monkeypatch):
+    # Pricing gives the same allocations as evaluating every rule would
+    rng = random.Random(0)
+    names = list(goods)
+    offers = [make_offer(i, rng.choice(names), rng.randint(1, 3),
+                         rng.choice(names), rng.choice([0, 10, 25, 50]))
+              for i in range(40)]
+    plan = engine.compile_offers(goods, offers, strategy)
+    assert plan.shadowed
+    with monkeypatch.context() as m:
+        m.setattr(engine, 'shadowed', lambda rules, strategy: {})
+        unpruned = engine.compile_offers(goods, offers, strategy)
+        unpruned.by_pair = None
+    for _ in range(200):
+        counts = {sku(name): rng.randint(1, 6)
+                  for name in rng.sample(names, rng.randint(1, 3))}
+        allocations = positions(plan.allocate(counts))
+        assert allocations == positions(unpruned.allocate(counts))
+        allocator = plan.new_allocator()
+        for sku_id, quantity in counts.items():
+            allocator.set_quantity(sku_id, quantity)
+        allocator.settle()
+        assert positions(allocator.allocations) == allocations
+        allocator.set_quantity(rng.choice(list(counts)), 0)
+        allocator.settle()
+        assert positions(allocator.allocations) == positions(
+            unpruned.allocate(allocator.counts))
+
+
+def positions(allocations):
+    return {sku_id: [(rule.position, quantity)
+                     for rule, quantity in allocation]
+            for sku_id, allocation in allocations.items()}
+
+
+def test_cover():
+    assert engine.cover([]) == []
+    assert engine.cover([(3, 'a'), (2, 'b')]) == [('b', 2), ('a', 1)]
+    assert engine.cover([(2, 'a'), (3, 'b')]) == [('b', 3)]
+    assert engine.cover([(1, 'a'), (4, 'b'), (2, 'c')]) == [('c', 2),
+                                                           ('b', 2)]
+
+
+def test_discount_and_subtotal(goods, offers):
+    plan = engine.compile_offers(goods, offers)
+    counts = {sku('soup'): 2, sku('bread'): 1, sku('apples'): 3}
+    allocations = plan.allocate(counts)
+    assert plan.subtotal(counts) == 510
+    assert plan.discount(allocations) == 30 + 40 + 42
+
+
+def test_allocator(goods, offers):
+    plan = engine.compile_offers(goods, offers)
+    allocator = engine.Allocator(plan)
+    soup, bread, apples = sku('soup'), sku('bread'), sku('apples')
+    assert allocator.set_quantity(soup, 3) == set()
+    assert allocator.set_quantity(bread, 1) == {bread}
+    assert allocator.discount == 40
+    assert allocator.set_quantity(apples, 1) == {apples, soup}
+    assert allocator.allocations == plan.allocate({soup: 3, bread: 1,
+                                                   apples: 1})
+    assert allocator.discount == 40 + 10 + 21
+    assert allocator.set_quantity(soup, 1) == {bread}
+    assert allocator.set_quantity(apples, 0) == {apples, soup}
+    assert allocator.counts == {soup: 1, bread: 1}
+    assert allocator.allocations == {}
+    assert allocator.earned == {}
+    assert allocator.discount == 0
+
+
+def test_allocator_counts_work(goods, offers):
+    allocator = engine.Allocator(engine.compile_offers(goods, offers))
+    allocator.set_quantity(sku('apples'), 1)
+    allocator.set_quantity(sku('milk'), 1)
+    allocator.set_quantity(sku('soup'), 2)
+    assert allocator.updates == 3
+    # Rules 1 and 4 for apples, none for milk, rules 2 and 4 for soup
+    assert allocator.evaluated == 5
+
+
+def test_allocator_unaffected(goods, offers):
+    allocator = engine.Allocator(engine.compile_offers(goods, offers))
+    assert allocator.set_quantity(sku('milk'), 4) == set()
+    assert allocator.set_quantity(sku('milk'), 0) == set()
+    assert allocator.counts == {}
+
+
+def test_discount_function(goods, offers):
+    rules = engine.compile_offers(goods, offers).rules
+    assert engine.discount([]) == 0
+    assert engine.discount([(rules[0], 2), (rules[1], 1)]) == 60
+
+
+def test_plan_strategy(goods, offers):
+    assert engine.compile_offers(goods, offers).strategy == engine.ORDERED
+    plan = engine.compile_offers(goods, offers, engine.BEST)
+    assert plan.strategy == engine.BEST
+    assert isinstance(plan.new_allocator(), engine.Allocator)
+    plan = engine.compile_offers(goods, offers, engine.EXCLUSIVE)
+    assert isinstance(plan.new_allocator(), engine.SolvingAllocator)
+    with pytest.raises(ValueError):
+        engine.compile_offers(goods, offers, 'cheapest')
+
+
+def test_allocate_best(goods):
+    offers = [make_offer(1, 'apples', 1, 'apples', 50),
+              make_offer(2, 'apples', 1, 'apples', 10),
+              make_offer(3, 'soup', 1, 'bread', 50),
+              make_offer(4, 'apples', 1, 'bread', 25)]
+    ordered = engine.compile_offers(goods, offers)
+    best = engine.compile_offers(goods, offers, engine.BEST)
+    rules = best.rules
+    soup, bread, apples = sku('soup'), sku('bread'), sku('apples')
+    counts = {soup: 1, bread: 2, apples: 2}
+    # In order the later offers replace the earlier ones
+    assert ordered.discount(ordered.allocate(counts)) == 20 + 40
+    assert best.allocate(counts) == {apples: [(rules[0], 2)],
+                                     bread: [(rules[2], 1), (rules[3], 1)]}
+    assert best.discount(best.allocate(counts)) == 100 + 60
+
+
+def test_allocate_exclusive(goods):
+    offers = [make_offer(1, 'apples', 1, 'apples', 10),
+              make_offer(2, 'apples', 2, 'bread', 50)]
+    plan = engine.compile_offers(goods, offers, engine.EXCLUSIVE)
+    first, second = plan.rules
+    bread, apples = sku('bread'), sku('apples')
+    # The apples qualify for the bread, or are discounted, but not both
+    assert plan.allocate({apples: 2, bread: 1}) == {bread: [(second, 1)]}
+    assert plan.allocate({apples: 3, bread: 1}) == {bread: [(second, 1)],
+                                                    apples: [(first, 1)]}
+    assert plan.allocate({apples: 2}) == {apples: [(first, 2)]}
+
+
+def test_best_cover():
+    plan = engine.compile_offers({}, [])
+    high, low, none = (types.SimpleNamespace(unit_discount=d)
+                       for d in (50, 10, 0))
+    assert engine.best_cover([], 3) == []
+    assert engine.best_cover([(2, low), (2, high)], 3) == [(high, 2),
+                                                          (low, 1)]
+    assert engine.best_cover([(1, high), (1, low)], 5) == [(high, 1),
+                                                          (low, 1)]
+    assert engine.best_cover([(2, none), (1, low)], 3) == [(low, 1)]
+    assert plan.cover([(2, low), (2, high)], 3) == [(high, 2)]
+
+
+def test_allocator_best(goods):
+    offers = [make_offer(1, 'soup', 1, 'bread', 50),
+              make_offer(2, 'apples', 1, 'bread', 25)]
+    plan = engine.compile_offers(goods, offers, engine.BEST)
+    allocator = plan.new_allocator()
+    soup, bread, apples = sku('soup'), sku('bread'), sku('apples')
+    allocator.set_quantity(soup, 1)
+    allocator.set_quantity(apples, 1)
+    assert allocator.set_quantity(bread, 1) == {bread}
+    assert allocator.discount == 40
+    # Both offers have been earned already, but a second loaf takes one
+    assert allocator.set_quantity(bread, 2) == {bread}
+    assert allocator.discount == 60
+    assert allocator.allocations == plan.allocate(allocator.counts)
+    assert allocator.settle() == set()
+
+
+def test_solving_allocator(goods):
+    offers = [make_offer(1, 'apples', 1, 'apples', 10),
+              make_offer(2, 'apples', 2, 'bread', 50)]
+    plan = engine.compile_offers(goods, offers, engine.EXCLUSIVE)
+    allocator = plan.new_allocator()
+    bread, apples = sku('bread'), sku('apples')
+    assert allocator.set_quantity(apples, 2) == set()
+    assert allocator.allocations == {}
+    assert allocator.settle() == {apples}
+    assert allocator.discount == 20
+    allocator.set_quantity(bread, 1)
+    assert allocator.settle() == {apples, bread}
+    assert allocator.allocations == {bread: [(plan.rules[1], 1)]}
+    assert allocator.discount == 40
+    assert allocator.settle() == set()
+    assert allocator.updates == 2
+    assert allocator.evaluated == 2 + 2
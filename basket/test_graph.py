@@ -0,0 +1,51 @@
+import pytest
+
+import basket.engine as engine
+import basket.graph as graph
+import basket.product as product
+from basket.testing import make_offer
+
+
+@pytest.fixture
+def offers():
+    return [make_offer(1, 'apples', 1, 'apples', 10),
+            make_offer(2, 'soup', 2, 'bread', 50),
+            make_offer(3, 'pie', 1, 'apples', 10),
+            make_offer(4, 'apples', 1, 'apples', 20),
+            make_offer(5, 'apples', 1, 'bread', 0),
+            make_offer(6, 'milk', 1, 'soup', 10)]
+
+
+def sku(name):
+    return product.intern_sku(name)
+
+
+def test_graph(goods, offers):
+    g = graph.OfferGraph(goods, offers)
+    assert g.unavailable == [2]
+    assert g.shadowed == {0: 3}
+    assert g.conflicts == {sku('bread'): (1, 4)}
+
+
+def test_graph_exclusive(goods, offers):
+    g = graph.OfferGraph(goods, offers, engine.EXCLUSIVE)
+    assert g.shadowed == {0: 3, 4: None}
+    # Soup is used both to qualify for one offer and be discounted by
+    # another
+    assert g.conflicts == {sku('soup'): (1, 5)}
+
+
+def test_report(goods, offers):
+    assert graph.OfferGraph(goods, offers).report() == {
+        'offers': 6,
+        'applicable': 4,
+        'unavailable': [{'id': 3, 'title': 'Offer 3', 'missing': ['pie']}],
+        'shadowed': [{'id': 1, 'title': 'Offer 1', 'shadowed_by': 4}],
+        'conflicts': [{'product': 'bread', 'offers': [2, 5]}],
+    }
+
+
+def test_report_empty(goods):
+    assert graph.OfferGraph(goods, []).report() == {
+        'offers': 0, 'applicable': 0, 'unavailable': [], 'shadowed': [],
+        'conflicts': []}
@@ -0,0 +1,223 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import basket.logs as logs
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Unformattable:
+
+    def __str__(self):
+        raise AssertionError('Formatted while logging was off')
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    clock = FakeClock()
+    rate_limiter = logs.RateLimiter(burst=2, interval=10.0, clock=clock)
+    monkeypatch.setattr(logs, '_LIMITER', rate_limiter)
+    return clock
+
+
+def test_log(capsys):
+    with logs.verbosity(logs.INFO):
+        logs.info('foo %s', 'bar')
+    stdout, _ = capsys.readouterr()
+    assert isinstance(time.strptime(stdout[:19], '%Y-%m-%d %H:%M:%S'),
+                      time.struct_time)
+    assert 'INFO: foo bar' in stdout
+
+
+def test_log_error(capsys):
+    with logs.verbosity(logs.INFO):
+        logs.error('foo')
+    stdout, _ = capsys.readouterr()
+    assert 'ERROR: foo' in stdout
+
+
+def test_log_quiet(capsys):
+    logs.info('foo')
+    logs.error('foo')
+    stdout, _ = capsys.readouterr()
+    assert not len(stdout)
+
+
+def test_log_below_level(capsys):
+    with logs.verbosity(logs.WARNING):
+        logs.info('foo')
+        logs.debug('foo')
+        logs.warning('bar')
+    stdout, _ = capsys.readouterr()
+    assert 'foo' not in stdout
+    assert 'WARNING: bar' in stdout
+
+
+def test_log_deferred_formatting(capsys):
+    logs.info('foo %s', Unformattable())
+    with logs.verbosity(logs.ERROR):
+        logs.warning('foo %s', Unformattable())
+        logs.warning_limited('foo %s', Unformattable())
+    stdout, _ = capsys.readouterr()
+    assert not len(stdout)
+
+
+def test_verbosity():
+    assert logs.level() == logs.OFF
+    assert not logs.enabled(logs.CRITICAL)
+    with logs.verbosity(logs.INFO):
+        assert logs.level() == logs.INFO
+        assert logs.enabled(logs.INFO)
+        assert not logs.enabled(logs.DEBUG)
+        with logs.verbosity(logs.DEBUG):
+            assert logs.enabled(logs.DEBUG)
+        assert logs.level() == logs.INFO
+    assert logs.level() == logs.OFF
+
+
+def test_verbosity_per_thread():
+    levels = []
+
+    def run():
+        levels.append(logs.level())
+        logs.set_verbosity(logs.ERROR)
+        levels.append(logs.level())
+
+    with logs.verbosity(logs.DEBUG):
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        assert logs.level() == logs.DEBUG
+    assert levels == [logs.OFF, logs.ERROR]
+
+
+def test_output_to(capsys):
+    with logs.verbosity(logs.INFO):
+        with logs.output_to('stderr'):
+            assert logs.output() == 'stderr'
+            logs.info('foo')
+        logs.info('bar')
+    assert logs.output() == 'stdout'
+    stdout, stderr = capsys.readouterr()
+    assert 'INFO: foo' in stderr
+    assert 'INFO: bar' in stdout
+    assert 'foo' not in stdout
+
+
+def test_output_per_thread(capsys):
+    outputs = []
+
+    def run():
+        outputs.append(logs.output())
+        logs.set_output('stderr')
+        outputs.append(logs.output())
+
+    with logs.output_to('stderr'):
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        assert logs.output() == 'stderr'
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    assert logs.output() == 'stdout'
+    assert outputs == ['stdout', 'stderr', 'stdout', 'stderr']
+
+
+def test_output_to_unknown():
+    with pytest.raises(ValueError):
+        with logs.output_to('stdin'):
+            pass
+    assert logs.output() == 'stdout'
+
+
+def test_set_output_unknown():
+    with pytest.raises(ValueError):
+        logs.set_output('stdin')
+    assert logs.output() == 'stdout'
+
+
+class TestRateLimiter:
+
+    def test_burst(self):
+        clock = FakeClock()
+        limiter = logs.RateLimiter(burst=3, interval=10.0, clock=clock)
+        assert [limiter.allow('a') for _ in range(5)] == [0, 0, 0, None,
+                                                          None]
+        assert limiter.allow('b') == 0
+
+    def test_new_interval(self):
+        clock = FakeClock()
+        limiter = logs.RateLimiter(burst=1, interval=10.0, clock=clock)
+        assert limiter.allow('a') == 0
+        assert limiter.allow('a') is None
+        assert limiter.allow('a') is None
+        clock.now = 9.9
+        assert limiter.allow('a') is None
+        clock.now = 10.0
+        assert limiter.allow('a') == 3
+        assert limiter.allow('a') is None
+        clock.now = 20.0
+        assert limiter.allow('a') == 1
+        clock.now = 30.0
+        assert limiter.allow('a') == 0
+
+
+def test_warning_limited(capsys, limiter):
+    with logs.verbosity(logs.WARNING):
+        for i in range(5):
+            logs.warning_limited('Item %d not in stock', i, key='unknown')
+        logs.warning_limited('Failed to parse basket')
+        limiter.now = 10.0
+        logs.warning_limited('Item %d not in stock', 5, key='unknown')
+    stdout, _ = capsys.readouterr()
+    lines = stdout.splitlines()
+    assert len(lines) == 4
+    assert lines[0].endswith('WARNING: Item 0 not in stock')
+    assert lines[1].endswith('WARNING: Item 1 not in stock')
+    assert lines[2].endswith('WARNING: Failed to parse basket')
+    assert lines[3].endswith(
+        'WARNING: Item 5 not in stock (3 similar messages suppressed)')
+
+
+def test_warning_limited_off(capsys, limiter):
+    for _ in range(5):
+        logs.warning_limited('foo')
+    with logs.verbosity(logs.WARNING):
+        logs.warning_limited('foo')
+    stdout, _ = capsys.readouterr()
+    # Nothing is counted while warnings are off
+    assert stdout.splitlines()[0].endswith('WARNING: foo')
+
+
+def test_get_logger():
+    logger = logs.get_logger()
+    assert logger is logs.get_logger()
+    assert logger.name == 'basket'
+    # Set up by configure, as the tests log as the command line does
+    assert logs.configured()
+    assert not logger.propagate
+
+
+def test_get_logger_unconfigured():
+    # Left to the application unless configure is called
+    code = ('import logging; from basket import logs; '
+            'logger = logs.get_logger(); '
+            'print(logger.handlers, logger.level, logger.propagate); '
+            'logs.configure(); logs.configure(); '
+            'print(len(logger.handlers), logger.level, logger.propagate)')
+    result = subprocess.run([sys.executable, '-c', code],
+                            stdout=subprocess.PIPE, check=True)
+    assert result.stdout.decode('utf-8').splitlines() == [
+        '[] 0 True', '1 10 False']
@@ -1,8 +1,18 @@
-import time
+import io
+import json
+import os
+import subprocess
+import sys
 
 import pytest
 
 import basket.__main__ as main
+import basket.async_server as async_server
+import basket.binary as binary
+import basket.catalogue as catalogue
+import basket.columnar as columnar
+import basket.logs as logs
+import basket.server as server
 
 
 @pytest.fixture
@@ -138,27 +148,10 @@ def empty_json_file(tmpdir, empty_json):
     return str(tmpfile)
 
 
-def test_log(capsys):
-    main.LOGGING = True
-    main.log('foo')
-    stdout, _ = capsys.readouterr()
-    assert isinstance(time.strptime(stdout[:19], '%Y-%m-%d %H:%M:%S'),
-                      time.struct_time)
-    assert 'INFO: foo' in stdout
-
-
-def test_log_error(capsys):
-    main.LOGGING = True
-    main.log('foo', level=main.ERROR)
-    stdout, _ = capsys.readouterr()
-    assert 'ERROR: foo' in stdout
-
-
-def test_log_quiet(capsys):
-    main.LOGGING = False
-    main.log('foo')
-    stdout, _ = capsys.readouterr()
-    assert not len(stdout)
+@pytest.fixture
+def verbose():
+    with logs.verbosity(logs.INFO):
+        yield
 
 
 class TestParseArgs:
@@ -185,30 +178,92 @@ class TestParseArgs:
         args = main.parse_args(['--offers=foo.json', 'apple'])
         assert args.offers == 'foo.json'
 
+    def test_strategy(self):
+        assert main.parse_args(['apple']).strategy == 'ordered'
+        args = main.parse_args(['--strategy', 'exclusive', 'apple'])
+        assert args.strategy == 'exclusive'
+        with pytest.raises(SystemExit):
+            main.parse_args(['--strategy', 'cheapest', 'apple'])
+
     def test_verbose(self):
         args = main.parse_args(['--verbose', 'apple'])
         assert args.verbose is True
 
+    def test_log_level(self):
+        assert main.parse_args(['apple']).log_level is None
+        args = main.parse_args(['--log-level', 'warning', 'apple'])
+        assert args.log_level == 'warning'
 
-def test_load_json(ok_json_file):
-    assert main.load_json(ok_json_file) is not None
+    def test_log_level_unknown(self):
+        with pytest.raises(SystemExit):
+            main.parse_args(['--log-level', 'loud', 'apple'])
+
+
+@pytest.mark.parametrize('argv', [
+    ['apple'],
+    ['apple', 'Milk', ''],
+    ['--goods', 'foo.json', 'apple', 'milk'],
+    ['apple', '--offers=foo.json', '--goods=', '--goods', 'bar.json'],
+    ['--verbose', 'apple', '--expand-discounts'],
+])
+def test_parse_plain_items(argv):
+    assert vars(main.parse_plain_items(argv)) == vars(main.parse_args(argv))
+
+
+@pytest.mark.parametrize('argv', [
+    [],
+    ['--goods', 'foo.json'],
+    ['apple', '--goods'],
+    ['apple', '--goods', '--verbose'],
+    ['apple', '--verbose', 'milk'],
+    ['apple', '--strategy', 'best'],
+    ['apple', '--verb'],
+    ['--verbose=1', 'apple'],
+    ['-', 'apple'],
+    ['--', 'apple'],
+])
+def test_parse_plain_items_other(argv):
+    assert main.parse_plain_items(argv) is None
+
+
+def test_load_array(ok_json_file):
+    elements = []
+    assert main.load_array(ok_json_file, lambda element, reader:
+                           elements.append((element['int'],
+                                            main.stream.position(reader))))
+    assert elements == [(10, 'line 2 column 5')]
+
+
+def test_load_json(ok_json, ok_json_file, bad_json_file, capsys, verbose):
+    assert main.load_json(ok_json_file) == json.loads(ok_json)
+    assert main.load_json(bad_json_file) is None
+    stdout, _ = capsys.readouterr()
+    assert 'Failed to parse data file' in stdout
 
 
-def test_load_json_no_file(capsys):
-    main.LOGGING = True
-    assert main.load_json('foo.json') is None
+def test_load_array_no_file(capsys, verbose):
+    assert not main.load_array('foo.json', None)
     stdout, _ = capsys.readouterr()
     assert 'ERROR: No such file or directory: foo.json' in stdout
 
 
-def test_load_json_bad_file(bad_json_file, capsys):
-    main.LOGGING = True
-    assert main.load_json(bad_json_file) is None
+def test_load_array_bad_file(bad_json_file, capsys, verbose):
+    assert not main.load_array(bad_json_file, None)
     stdout, _ = capsys.readouterr()
     assert 'ERROR: Failed to parse data file' in stdout
     assert 'bad.json' in stdout
 
 
+def test_load_goods_bad_file(tmpdir, goods_json, capsys, verbose):
+    # Nothing is loaded from a file that cannot be parsed to the end
+    tmpfile = tmpdir.join('truncated.json')
+    tmpfile.write(goods_json[:-10])
+    assert main.load_goods(str(tmpfile)) is None
+    stdout, _ = capsys.readouterr()
+    assert 'Failed to parse data file' in stdout
+    assert 'line 12 column 47' in stdout
+
+
 def test_load_goods(goods_json_file):
     products = main.load_goods(goods_json_file)
     assert products
@@ -230,11 +285,10 @@ def test_load_goods_no_stock(empty_json_file):
     assert len(products) is 0
 
 
-def test_load_goods_bad_item(faulty_goods_json_file, capsys):
-    main.LOGGING = True
+def test_load_goods_bad_item(faulty_goods_json_file, capsys, verbose):
     products = main.load_goods(faulty_goods_json_file)
     stdout, _ = capsys.readouterr()
-    assert 'Failed to load a product with data' in stdout
+    assert 'Failed to load a product with data at line 2 column 5' in stdout
     assert '(invalid literal for int() with base 10: \'100.0\'' in stdout
     assert len(products) is 0
 
@@ -249,15 +303,51 @@ def test_load_offers(offers_json_file):
     assert offers[1].title == '2 tins soup get you a half price loaf'
 
 
-def test_load_offers_bad_item(faulty_offers_json_file, capsys):
-    main.LOGGING = True
+def test_load_goods_names(goods_json_file):
+    products = main.load_goods(goods_json_file, {'soup', 'apples', 'pie'})
+    assert sorted(products) == ['apples', 'soup']
+
+
+def test_load_offers_names(offers_json_file):
+    assert [o.offer_id for o in main.load_offers(
+        offers_json_file, {'apples', 'bread'})] == [1]
+    assert [o.offer_id for o in main.load_offers(
+        offers_json_file, {'soup', 'bread'})] == [2]
+    assert main.load_offers(offers_json_file, {'soup'}) == []
+
+
+def test_load_offers_bad_item(faulty_offers_json_file, capsys, verbose):
     offers = main.load_offers(faulty_offers_json_file)
     stdout, _ = capsys.readouterr()
-    assert 'Failed to load offer with data' in stdout
+    assert 'Failed to load offer with data at line 2 column 5' in stdout
     assert '(Unacceptable value for qualifying_qty)' in stdout
     assert len(offers) is 0
 
 
+def test_load_goods_sku_limit(tmpdir, monkeypatch, capsys, verbose):
+    goods_file = tmpdir.join('goods.json')
+    goods_file.write('[{"name": "apples", "price": 100, "unit": "bag"}]')
+    offers_file = tmpdir.join('offers.json')
+    offers_file.write('[]')
+    manager = catalogue.CatalogueManager(
+        str(goods_file), str(offers_file), main.load_goods, main.load_offers,
+        check_interval=0)
+    monkeypatch.setattr(main.product, 'MAX_SKUS',
+                        main.product.sku_count())
+    # A new product name cannot be interned, so the whole file fails and
+    # the current version is kept rather than one missing the product
+    goods_file.write('[{"name": "apples", "price": 90, "unit": "bag"}, '
+                     '{"name": "test-sku-limit-pie", "price": 300, '
+                     '"unit": "each"}]')
+    os.utime(str(goods_file), (2000, 2000))
+    assert manager.reload() is False
+    assert manager.current().version == 1
+    assert manager.current().goods['apples'].price == 100
+    stdout, _ = capsys.readouterr()
+    assert 'Too many product names interned' in stdout
+    assert 'keeping version 1' in stdout
+
+
 def test_main(capsys):
     main.main(['apples'])
     stdout, _ = capsys.readouterr()
@@ -265,9 +355,459 @@ def test_main(capsys):
     assert expectd_op in stdout
 
 
+def test_main_expand_discounts(capsys):
+    main.main(['apples', 'apples', 'milk'])
+    stdout, _ = capsys.readouterr()
+    assert ('Subtotal: £3.30\nApples 10% off: -10p ×2\n'
+            'Total: £3.10') in stdout
+    main.main(['apples', 'apples', 'milk', '--expand-discounts'])
+    stdout, _ = capsys.readouterr()
+    assert ('Subtotal: £3.30\nApples 10% off: -10p\nApples 10% off: -10p\n'
+            'Total: £3.10') in stdout
+    # In the order the items were given
+    main.main(['apples', 'bread', 'soup', 'soup', 'apples',
+               '--expand-discounts'])
+    stdout, _ = capsys.readouterr()
+    assert ('Apples 10% off: -10p\n'
+            '2 tins soup get you a half price loaf: -40p\n'
+            'Apples 10% off: -10p\n') in stdout
+
+
+def test_main_cold_path():
+    # Pricing one basket does not import what only the other modes need
+    code = ('import sys\n'
+            'import basket.__main__ as main\n'
+            'main.main(["apples", "milk"])\n'
+            'print(" ".join(sorted(sys.modules)))\n')
+    result = subprocess.run([sys.executable, '-c', code],
+                            stdout=subprocess.PIPE, check=True)
+    stdout = result.stdout.decode('utf-8')
+    assert 'Total: £2.20' in stdout
+    modules = set(stdout.split())
+    for name in ('argparse', 'asyncio', 'http.server', 'logging',
+                 'multiprocessing', 'mmap', 'cProfile', 'basket.async_server',
+                 'basket.batch', 'basket.binary', 'basket.cache',
+                 'basket.catalogue', 'basket.server'):
+        assert name not in modules
+
+
+def test_main_strategy(tmpdir, capsys):
+    offers = tmpdir.join('offers.json')
+    offers.write(json.dumps([
+        {'id': 1, 'title': 'Apples 50% off', 'qualifying_product': 'apples',
+         'qualifying_qty': 1, 'discounted_product': 'apples',
+         'discount_percent': 50},
+        {'id': 2, 'title': 'Apples 10% off', 'qualifying_product': 'apples',
+         'qualifying_qty': 1, 'discounted_product': 'apples',
+         'discount_percent': 10}]))
+    main.main(['apples', '--offers', str(offers)])
+    stdout, _ = capsys.readouterr()
+    assert 'Total: £0.90' in stdout
+    main.main(['apples', '--offers', str(offers), '--strategy', 'best'])
+    stdout, _ = capsys.readouterr()
+    assert 'Apples 50% off: -50p\nTotal: £0.50' in stdout
+
+
+def test_main_check_offers(tmpdir, capsys):
+    offers = tmpdir.join('offers.json')
+    offers.write(json.dumps([
+        {'id': 1, 'title': 'Apples 10% off', 'qualifying_product': 'apples',
+         'qualifying_qty': 1, 'discounted_product': 'apples',
+         'discount_percent': 10},
+        {'id': 2, 'title': 'Apples 50% off', 'qualifying_product': 'apples',
+         'qualifying_qty': 1, 'discounted_product': 'apples',
+         'discount_percent': 50},
+        {'id': 3, 'title': 'Pie 50% off', 'qualifying_product': 'pie',
+         'qualifying_qty': 1, 'discounted_product': 'pie',
+         'discount_percent': 50}]))
+    main.main(['--check-offers', '--offers', str(offers)])
+    stdout, _ = capsys.readouterr()
+    report = json.loads(stdout)
+    assert (report['offers'], report['applicable']) == (3, 1)
+    assert report['unavailable'] == [
+        {'id': 3, 'title': 'Pie 50% off', 'missing': ['pie']}]
+    assert report['shadowed'] == [
+        {'id': 1, 'title': 'Apples 10% off', 'shadowed_by': 2}]
+    assert report['conflicts'] == []
+
+
 def test_main_unknown_prod(capsys):
     main.main(['pie', '--verbose'])
     stdout, _ = capsys.readouterr()
     expectd_op = ('INFO: Item \'pie\' not in stock\nSubtotal: £0.00\n'
                   '(No offers available)\nTotal: £0.00')
     assert expectd_op in stdout
+
+
+def test_main_log_level(capsys):
+    main.main(['pie', '--log-level', 'error'])
+    stdout, _ = capsys.readouterr()
+    assert 'not in stock' not in stdout
+    main.main(['pie', '--verbose', '--log-level', 'off'])
+    stdout, _ = capsys.readouterr()
+    assert 'not in stock' not in stdout
+    assert logs.level() == logs.OFF
+
+
+class TestParseArgsBatch:
+
+    def test_batch(self):
+        args = main.parse_args(['--batch', 'baskets.jsonl'])
+        assert args.batch == 'baskets.jsonl'
+        assert args.items == []
+
+    def test_batch_default(self):
+        args = main.parse_args(['apple'])
+        assert args.batch is None
+
+    def test_no_items(self, capsys):
+        with pytest.raises(SystemExit):
+            main.parse_args([])
+        _, stderr = capsys.readouterr()
+        assert 'at least one item is required' in stderr
+
+    def test_batch_and_items(self, capsys):
+        with pytest.raises(SystemExit):
+            main.parse_args(['--batch', '-', 'apple'])
+        _, stderr = capsys.readouterr()
+        assert 'items cannot be given with --batch' in stderr
+
+
+@pytest.fixture
+def baskets_jsonl_file(tmpdir):
+    tmpfile = tmpdir.join('baskets.jsonl')
+    with tmpfile.open('w') as f:
+        f.write('["apples", "milk"]\n'
+                '{"id": "b2", "items": ["milk", "soup", "soup", "bread"]}\n')
+    return str(tmpfile)
+
+
+def test_main_batch(baskets_jsonl_file, capsys):
+    main.main(['--batch', baskets_jsonl_file])
+    stdout, _ = capsys.readouterr()
+    results = [json.loads(line) for line in stdout.splitlines()]
+    assert results == [
+        {'id': 1, 'subtotal': 230, 'discounts': ['Apples 10% off: -10p'],
+         'total': 220, 'unknown': []},
+        {'id': 'b2', 'subtotal': 340,
+         'discounts': ['2 tins soup get you a half price loaf: -40p'],
+         'total': 300, 'unknown': []}]
+
+
+def test_main_batch_stdin(monkeypatch, capsys):
+    stdin = io.StringIO('["apples"]\n')
+    monkeypatch.setattr('sys.stdin', stdin)
+    main.main(['--batch', '-'])
+    stdout, _ = capsys.readouterr()
+    assert json.loads(stdout)['total'] == 90
+    assert not stdin.closed
+
+
+def test_main_batch_no_file(capsys):
+    main.main(['--batch', 'foo.jsonl', '--verbose'])
+    stdout, _ = capsys.readouterr()
+    assert 'ERROR: No such file or directory: foo.jsonl' in stdout
+
+
+def test_main_batch_log_level(tmpdir, capsys):
+    baskets = tmpdir.join('baskets.jsonl')
+    baskets.write('["apples", "pie"]\nfoo\n')
+    main.main(['--batch', str(baskets), '--log-level', 'warning'])
+    stdout, stderr = capsys.readouterr()
+    # Messages go to stderr, leaving stdout to the results
+    assert [json.loads(line)['id'] for line in stdout.splitlines()] == [
+        1, None]
+    assert 'WARNING: Items not in stock in basket 1: pie' in stderr
+    assert 'WARNING: Failed to parse basket on line 2' in stderr
+
+
+def test_main_batch_workers(baskets_jsonl_file, capsys):
+    main.main(['--batch', baskets_jsonl_file])
+    expected, _ = capsys.readouterr()
+    main.main(['--batch', baskets_jsonl_file, '--workers', '2',
+               '--chunk-size', '1'])
+    stdout, _ = capsys.readouterr()
+    assert stdout == expected
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_main_batch_csv(baskets_jsonl_file, workers, capsys):
+    main.main(['--batch', baskets_jsonl_file, '--output-format', 'csv',
+               '--workers', workers, '--chunk-size', '1'])
+    stdout, _ = capsys.readouterr()
+    assert stdout.splitlines() == [
+        'id,subtotal,discount,total,offer_1_units,offer_1_discount,'
+        'offer_2_units,offer_2_discount',
+        '1,230,10,220,1,10,0,0',
+        'b2,340,40,300,0,0,1,40']
+
+
+def test_output_formats():
+    assert main.OUTPUT_FORMATS == ('jsonl',) + columnar.FORMATS
+
+
+def test_main_profile(capsys):
+    main.main(['apples', 'soup', '--profile'])
+    stdout, stderr = capsys.readouterr()
+    assert 'Total: £1.55' in stdout
+    phases = {line.split()[0] for line in stderr.splitlines()[1:8]}
+    assert phases == {'load_json', 'build_products', 'build_offers',
+                      'compile_offers', 'add_items', 'calculate_discounts',
+                      'format_output'}
+    assert 'baskets: 1' in stderr
+    assert 'Apples 10% off' in stderr
+    assert main.profiling.ACTIVE is None
+
+
+def test_main_batch_profile(baskets_jsonl_file, tmpdir, capsys):
+    main.main(['--batch', baskets_jsonl_file])
+    expected, _ = capsys.readouterr()
+    path = str(tmpdir.join('basket.prof'))
+    main.main(['--batch', baskets_jsonl_file, '--profile-output', path])
+    stdout, stderr = capsys.readouterr()
+    assert stdout == expected
+    assert 'calculate_discounts' in stderr
+    assert main.profiling.ACTIVE is None
+    assert os.path.exists(path)
+
+
+@pytest.fixture
+def catalogue_file(tmpdir):
+    path = str(tmpdir.join('catalogue.bin'))
+    main.main(['--compile', path])
+    return path
+
+
+def test_main_catalogue(catalogue_file, capsys):
+    main.main(['milk', 'soup', 'soup', 'bread', 'apples'])
+    expected, _ = capsys.readouterr()
+    main.main(['--catalogue', catalogue_file, 'milk', 'soup', 'soup',
+               'bread', 'apples'])
+    stdout, _ = capsys.readouterr()
+    assert stdout == expected
+    assert 'Total: £3.90' in stdout
+
+
+def test_main_batch_catalogue(catalogue_file, baskets_jsonl_file, capsys):
+    main.main(['--batch', baskets_jsonl_file])
+    expected, _ = capsys.readouterr()
+    for workers in ('1', '2'):
+        main.main(['--batch', baskets_jsonl_file, '--catalogue',
+                   catalogue_file, '--workers', workers])
+        stdout, _ = capsys.readouterr()
+        assert stdout == expected
+
+
+@pytest.mark.parametrize('output_format', ['jsonl', 'csv'])
+def test_main_batch_catalogue_opened_once(catalogue_file, baskets_jsonl_file,
+                                          monkeypatch, output_format):
+    opened = []
+    load = binary.load
+    monkeypatch.setattr(binary, 'load',
+                        lambda *args: opened.append(args) or load(*args))
+    main.main(['--batch', baskets_jsonl_file, '--catalogue', catalogue_file,
+               '--workers', '1', '--output-format', output_format])
+    assert len(opened) == 1
+
+
+def test_main_catalogue_truncated(catalogue_file, baskets_jsonl_file,
+                                  capsys):
+    with open(catalogue_file, 'rb') as f:
+        data = f.read()
+    with open(catalogue_file, 'wb') as f:
+        f.write(data[:100])
+    main.main(['--batch', baskets_jsonl_file, '--catalogue', catalogue_file,
+               '--verbose'])
+    stdout, stderr = capsys.readouterr()
+    assert 'Corrupt catalogue file: ' + catalogue_file in stdout + stderr
+    assert '"total"' not in stdout
+
+
+def test_main_simulate(baskets_jsonl_file, tmpdir, capsys):
+    new_offers = tmpdir.join('new_offers.json')
+    new_offers.write(json.dumps([{
+        'id': 3, 'title': 'Milk makes soup free',
+        'qualifying_product': 'milk', 'qualifying_qty': 1,
+        'discounted_product': 'soup', 'discount_percent': 100}]))
+    main.main(['--batch', baskets_jsonl_file, '--simulate', str(new_offers)])
+    stdout, _ = capsys.readouterr()
+    report = json.loads(stdout)
+    # Apples 10% off is removed, and the second basket gets a free tin of
+    # soup in place of 40p off bread
+    assert report['baskets'] == 2
+    assert report['repriced'] == 2
+    assert report['total_delta'] == 10 - 25
+    assert {(o['id'], o['status'], o['discount_delta'])
+            for o in report['offers']} == {(1, 'removed', -10),
+                                           (2, 'removed', -40),
+                                           (3, 'added', 65)}
+
+
+def test_main_serve_catalogue(catalogue_file, monkeypatch):
+    served = []
+    monkeypatch.setattr(server, 'serve',
+                        lambda *args: served.append(args))
+    main.main(['--serve', '--catalogue', catalogue_file])
+    shop = served[0][0]
+    assert isinstance(shop, binary.MappedCatalogue)
+    assert shop.goods['milk'].price == 130
+
+
+@pytest.mark.parametrize('file_name, message', [
+    ('foo.bin', 'ERROR: No such file or directory: '),
+    ('goods.json', 'ERROR: Failed to open catalogue file '),
+])
+def test_main_catalogue_bad(file_name, message, capsys):
+    main.main(['--catalogue', file_name, 'apples', '--verbose'])
+    stdout, _ = capsys.readouterr()
+    assert message in stdout
+    assert 'Total' not in stdout
+
+
+def test_parse_args_profile():
+    args = main.parse_args(['--batch', '-', '--profile-output', 'out.prof'])
+    assert args.profile is True
+    assert args.cache_size == 0
+    assert main.parse_args(['apple']).profile is False
+
+
+@pytest.mark.parametrize('argv, message', [
+    (['--compile', 'c.bin', 'apple'],
+     '--compile cannot be used with items, --batch or --serve'),
+    (['--compile', 'c.bin', '--serve'],
+     '--compile cannot be used with items, --batch or --serve'),
+    (['--compile', 'c.bin', '--catalogue', 'c.bin'],
+     '--compile cannot be used with --catalogue'),
+    (['--batch', '-', '--workers', '2', '--profile'],
+     '--profile can only be used with a single worker'),
+    (['--batch', '-', '--workers', '-1'], '--workers cannot be negative'),
+    (['--batch', '-', '--chunk-size', '0'], '--chunk-size must be at least 1'),
+    (['--simulate', 'o.json', 'apple'], '--simulate requires --batch'),
+    (['--batch', '-', '--simulate', 'o.json', '--catalogue', 'c.bin'],
+     '--simulate cannot be used with --catalogue'),
+    (['--check-offers', 'apple'],
+     '--check-offers cannot be used with items, --batch, --serve, '
+     '--compile or --catalogue'),
+    (['--check-offers', '--catalogue', 'c.bin'],
+     '--check-offers cannot be used with items, --batch, --serve, '
+     '--compile or --catalogue'),
+    (['--batch', '-', '--expand-discounts'],
+     '--expand-discounts cannot be used with --batch, --serve or --compile'),
+    (['--output-format', 'csv', 'apple'],
+     '--output-format can only be used with --batch'),
+    (['--batch', '-', '--simulate', 'o.json', '--output-format', 'tsv'],
+     '--output-format can only be used with --batch'),
+])
+def test_parse_args_batch_bad(argv, message, capsys):
+    with pytest.raises(SystemExit):
+        main.parse_args(argv)
+    _, stderr = capsys.readouterr()
+    assert message in stderr
+
+
+def test_load_catalogue(goods_json_file, offers_json_file):
+    shop = main.load_catalogue(goods_json_file, offers_json_file)
+    assert len(shop.goods) == 4
+    assert len(shop.offers) == 2
+
+
+class TestParseArgsServe:
+
+    def test_serve(self):
+        args = main.parse_args(['--serve'])
+        assert args.serve is True
+        assert args.host == '127.0.0.1'
+        assert args.port == 8080
+
+    def test_serve_address(self):
+        args = main.parse_args(['--serve', '--host=0.0.0.0', '--port=9000'])
+        assert args.host == '0.0.0.0'
+        assert args.port == 9000
+
+    @pytest.mark.parametrize('argv, message', [
+        (['--serve', 'apple'], 'items cannot be given with --serve'),
+        (['--serve', '--batch', '-'], '--batch cannot be used with --serve'),
+    ])
+    def test_serve_bad(self, argv, message, capsys):
+        with pytest.raises(SystemExit):
+            main.parse_args(argv)
+        _, stderr = capsys.readouterr()
+        assert message in stderr
+
+
+def test_main_serve(monkeypatch):
+    served = []
+    monkeypatch.setattr(server, 'serve',
+                        lambda *args: served.append(args))
+    main.main(['--serve', '--port', '9000'])
+    shop, host, port, pricing_cache, log_level = served[0]
+    assert isinstance(shop, catalogue.CatalogueManager)
+    assert shop.check_interval == 1.0
+    assert len(shop.current().goods) == 5
+    assert (host, port) == ('127.0.0.1', 9000)
+    assert pricing_cache.maxsize == 10000
+    assert log_level == logs.OFF
+
+
+def test_main_serve_log_level(monkeypatch):
+    served = []
+    monkeypatch.setattr(server, 'serve',
+                        lambda *args: served.append(args))
+    main.main(['--serve', '--log-level', 'warning'])
+    assert served[0][-1] == logs.WARNING
+
+
+def test_main_serve_no_cache(monkeypatch):
+    served = []
+    monkeypatch.setattr(server, 'serve',
+                        lambda *args: served.append(args))
+    main.main(['--serve', '--cache-size', '0'])
+    assert served[0][3] is None
+
+
+def test_cache_size_bad(capsys):
+    with pytest.raises(SystemExit):
+        main.parse_args(['--batch', '-', '--cache-size=-1'])
+    _, stderr = capsys.readouterr()
+    assert '--cache-size cannot be negative' in stderr
+
+
+class TestParseArgsAsyncio:
+
+    def test_asyncio_defaults(self):
+        args = main.parse_args(['--serve', '--asyncio'])
+        assert args.asyncio is True
+        assert args.max_batch == 128
+        assert args.batch_window == 2.0
+        assert args.max_in_flight == 1024
+
+    @pytest.mark.parametrize('argv, message', [
+        (['--asyncio', 'apple'], '--asyncio can only be used with --serve'),
+        (['--serve', '--max-batch=0'], '--max-batch must be at least 1'),
+        (['--serve', '--reload-interval=-1'],
+         '--reload-interval cannot be negative'),
+        (['--serve', '--batch-window=-1'],
+         '--batch-window cannot be negative'),
+        (['--serve', '--max-in-flight=0'],
+         '--max-in-flight must be at least 1'),
+    ])
+    def test_asyncio_bad(self, argv, message, capsys):
+        with pytest.raises(SystemExit):
+            main.parse_args(argv)
+        _, stderr = capsys.readouterr()
+        assert message in stderr
+
+
+def test_main_serve_asyncio(monkeypatch):
+    served = []
+    monkeypatch.setattr(async_server, 'serve',
+                        lambda *args: served.append(args))
+    main.main(['--serve', '--asyncio', '--batch-window', '5',
+               '--reload-interval', '0'])
+    (shop, host, port, max_batch, batch_window, max_in_flight,
+     pricing_cache) = served[0]
+    assert isinstance(shop, catalogue.Catalogue)
+    assert len(shop.goods) == 5
+    assert (host, port) == ('127.0.0.1', 8080)
+    assert (max_batch, batch_window, max_in_flight) == (128, 0.005, 1024)
+    assert pricing_cache.maxsize == 10000
@@ -1,6 +1,7 @@
 import pytest
 
 import basket.offer as offer
+import basket.product as product
 
 
 @pytest.mark.parametrize('qualifying_product', ['apples', 'Apples', 'appLeS'])
@@ -22,6 +23,8 @@ def test_offer(qualifying_product, qualifying_qty, discounted_product,
     assert o.qualifying_qty == 1
     assert o.discounted_product == 'apples'
     assert o.discount_percent == 10
+    assert o.qualifying_sku == o.discounted_sku
+    assert product.sku_name(o.qualifying_sku) == 'apples'
 
 
 def test_bad_offer():
@@ -34,3 +37,14 @@ def test_bad_offer():
     with pytest.raises(ValueError) as e:
         offer.Offer(offer_def)
     assert 'Unacceptable value for qualifying_qty' in str(e)
+
+
+def test_offer_compact():
+    o = offer.Offer({'id': 1,
+                     'title': 'Apples 10% off',
+                     'qualifying_product': 'Apples',
+                     'qualifying_qty': 1,
+                     'discounted_product': 'Apples',
+                     'discount_percent': 10})
+    assert not hasattr(o, '__dict__')
+    assert o.qualifying_product is o.discounted_product
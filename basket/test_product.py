@@ -28,6 +28,7 @@ def test_apply_offer(prod_offer):
     prod = product.Product('apples', 100, 'bag')
     prod.apply_offer(prod_offer)
     assert prod._offer is prod_offer
+    assert prod.offer is prod_offer
     assert prod.has_offer is True
     assert prod.discounted_price == 90
     assert prod.discount_amount == 10
@@ -52,3 +53,49 @@ def test_clear_offer(prod_offer):
     assert prod.discounted_price == 100
     assert prod.discount_amount == 0
     assert prod.discount_message is None
+
+
+def test_discount_message():
+    assert product.discount_message('Apples 10% off', 10) == (
+        'Apples 10% off: -10p')
+    assert product.discount_message('Half price milk', 150) == (
+        'Half price milk: -£1.50')
+    # The same message is formatted once
+    assert product.discount_message('Half price milk', 150) is (
+        product.discount_message('Half price milk', 150))
+
+
+def test_sku():
+    apples = product.Product('Apples', 100, 'bag')
+    assert apples.sku == product.intern_sku('apples')
+    assert product.Product('apples', 90, 'bag').sku == apples.sku
+    assert product.Product('pears', 90, 'bag').sku != apples.sku
+    assert product.sku_name(apples.sku) == 'apples'
+
+
+def test_intern_sku():
+    sku = product.intern_sku('test-intern-sku')
+    assert product.intern_sku('test-intern-sku') == sku
+    assert product.sku_count() == sku + 1
+    assert product.intern_sku('test-intern-sku-2') == sku + 1
+    assert product.sku_name(sku + 1) == 'test-intern-sku-2'
+
+
+def test_intern_sku_limit(monkeypatch):
+    sku = product.intern_sku('test-intern-sku-limit')
+    monkeypatch.setattr(product, 'MAX_SKUS', product.sku_count())
+    # Names already interned keep their ids, new names are refused
+    assert product.intern_sku('test-intern-sku-limit') == sku
+    with pytest.raises(product.SkuLimitError) as e:
+        product.Product('test-intern-sku-limit-2', 100, 'bag')
+    assert e.value.__cause__ is None
+    assert isinstance(e.value, ValueError)
+
+
+def test_prod_compact():
+    prod = product.Product('apples', 100, 'bag')
+    assert not hasattr(prod, '__dict__')
+    assert prod.name is product.Product('Apples', 90, 'bag').name
+    assert prod.unit is product.Product('pears', 90, 'Bag').unit
+    with pytest.raises(AttributeError):
+        prod.colour = 'green'
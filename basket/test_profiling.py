@@ -0,0 +1,139 @@
+import pstats
+
+import pytest
+
+import basket.catalogue as catalogue
+import basket.offer as offer
+import basket.product as product
+import basket.profiling as profiling
+
+
+@pytest.fixture
+def shop():
+    goods = {
+      'soup': product.Product('soup', 65, 'tin'),
+      'bread': product.Product('bread', 80, 'loaf'),
+      'apples': product.Product('apples', 100, 'bag'), }
+    offers = [
+        offer.Offer({'id': 1, 'title': 'Apples 10% off',
+                     'qualifying_product': 'apples',
+                     'qualifying_qty': 1,
+                     'discounted_product': 'apples',
+                     'discount_percent': 10}),
+        offer.Offer({'id': 2, 'title': '2 tins soup get you a half price loaf',
+                     'qualifying_product': 'soup',
+                     'qualifying_qty': 2,
+                     'discounted_product': 'bread',
+                     'discount_percent': 50})]
+    return catalogue.Catalogue(goods, offers)
+
+
+def test_start_stop():
+    assert profiling.ACTIVE is None
+    with profiling.Profile() as outer:
+        assert profiling.ACTIVE is outer
+        with profiling.Profile() as inner:
+            assert profiling.ACTIVE is inner
+        assert profiling.ACTIVE is outer
+    assert profiling.ACTIVE is None
+
+
+def test_phase():
+    with profiling.Profile() as profile:
+        for _ in range(3):
+            with profiling.phase('load_json'):
+                pass
+    with profiling.phase('load_json'):
+        pass
+    calls, seconds = profile.phases['load_json']
+    assert calls == 3
+    assert seconds >= 0
+
+
+def test_phase_inactive():
+    with profiling.phase('load_json'):
+        pass
+
+
+def test_phase_exception():
+    profile = profiling.Profile()
+    with pytest.raises(ValueError):
+        with profile.phase('build_offers'):
+            raise ValueError
+    assert profile.phases['build_offers'][0] == 1
+
+
+def test_record_basket(shop):
+    profile = profiling.Profile()
+    for items in (['apples', 'soup', 'soup', 'bread'], ['apples']):
+        shopping_basket = shop.new_basket()
+        for item in items:
+            shopping_basket.add(item)
+        profile.record_basket(shopping_basket)
+    report = profile.report()
+    assert report['baskets'] == 2
+    assert report['counters'] == {'items_scanned': 5,
+                                  'offers_evaluated': 7}
+    assert report['per_basket'] == {'items_scanned': 2.5,
+                                    'offers_evaluated': 3.5}
+    assert report['offers_applied'] == {
+        1: {'title': 'Apples 10% off', 'baskets': 2},
+        2: {'title': '2 tins soup get you a half price loaf', 'baskets': 1}}
+
+
+def test_summary(shop):
+    profile = profiling.Profile()
+    profile.add_time('add_items', 0.003)
+    profile.add_time('calculate_discounts', 0.001)
+    shopping_basket = shop.new_basket()
+    shopping_basket.add('apples')
+    profile.record_basket(shopping_basket)
+    lines = profile.summary().splitlines()
+    assert lines[0].split() == ['phase', 'calls', 'total', 'ms', 'mean',
+                                'us', '%']
+    assert lines[1].split() == ['add_items', '1', '3.000', '3000.000',
+                                '75.0']
+    assert lines[2].split()[0] == 'calculate_discounts'
+    assert 'baskets: 1' in lines
+    assert 'items_scanned: 1 (1.0 per basket)' in lines
+    assert lines[-1].split() == ['1', '1:', 'Apples', '10%', 'off']
+
+
+def test_offers_sharing_a_title():
+    goods = {'apples': product.Product('apples', 100, 'bag'),
+             'pears': product.Product('pears', 50, 'bag')}
+    offers = [offer.Offer({'id': offer_id, 'title': 'Fruit 10% off',
+                           'qualifying_product': name,
+                           'qualifying_qty': 1,
+                           'discounted_product': name,
+                           'discount_percent': 10})
+              for offer_id, name in ((1, 'apples'), (2, 'pears'))]
+    shop = catalogue.Catalogue(goods, offers)
+    profile = profiling.Profile()
+    shopping_basket = shop.new_basket()
+    shopping_basket.add('apples')
+    shopping_basket.add('pears')
+    profile.record_basket(shopping_basket)
+    assert profile.report()['offers_applied'] == {
+        1: {'title': 'Fruit 10% off', 'baskets': 1},
+        2: {'title': 'Fruit 10% off', 'baskets': 1}}
+    lines = profile.summary().splitlines()
+    assert lines[-2:] == ['          1  1: Fruit 10% off',
+                          '          1  2: Fruit 10% off']
+
+
+def test_summary_empty():
+    assert profiling.Profile().summary().splitlines()[1:] == ['baskets: 0']
+
+
+def test_dump_stats(tmpdir):
+    path = str(tmpdir.join('basket.prof'))
+    with profiling.Profile(cprofile=True) as profile:
+        sorted(range(100))
+    profile.dump_stats(path)
+    assert pstats.Stats(path).total_calls > 0
+
+
+def test_dump_stats_not_enabled(tmpdir):
+    with pytest.raises(ValueError):
+        profiling.Profile().dump_stats(str(tmpdir.join('basket.prof')))
@@ -0,0 +1,165 @@
+import concurrent.futures
+import random
+
+import pytest
+
+import basket.basket as basket
+import basket.catalogue as catalogue
+import basket.engine as engine
+import basket.offer as offer
+import basket.receipt as receipt
+
+
+@pytest.fixture
+def offers():
+    return [
+        offer.Offer({'id': 1, 'title': 'Apples 10% off',
+                     'qualifying_product': 'apples',
+                     'qualifying_qty': 1,
+                     'discounted_product': 'apples',
+                     'discount_percent': 10}),
+        offer.Offer({'id': 2,
+                     'title': '2 tins soup get you a half price loaf',
+                     'qualifying_product': 'soup',
+                     'qualifying_qty': 2,
+                     'discounted_product': 'bread',
+                     'discount_percent': 50})]
+
+
+def price(goods, offers, items, strategy=engine.ORDERED):
+    plan = engine.compile_offers(goods, offers, strategy)
+    return receipt.price(goods, plan, items)
+
+
+def test_price(goods, offers):
+    priced = price(goods, offers, [('bread', 2), ('SOUP', 2), ('apples', 1),
+                                   ('soup', 2), ('eggs', 3)])
+    assert priced.subtotal == 520
+    assert priced.discount == 90
+    assert priced.total == 430
+    assert priced.unknown == ('eggs',)
+    bread, apples = priced.lines
+    assert bread.product is goods['bread']
+    assert bread.offer is offers[1]
+    assert (bread.quantity, bread.unit_discount, bread.amount) == (2, 40, 80)
+    assert bread.message == '2 tins soup get you a half price loaf: -40p'
+    assert apples.product is goods['apples']
+    assert priced.discounts == [bread.message, bread.message,
+                                'Apples 10% off: -10p']
+
+
+def test_price_unit_order(goods, offers):
+    priced = price(goods, offers, [('apples', 1), ('bread', 1), ('soup', 2),
+                                   ('apples', 2)])
+    assert [(line.product.name, line.quantity) for line in priced.lines] == [
+        ('apples', 1), ('bread', 1), ('apples', 2)]
+    assert priced.render() == [
+        'Apples 10% off: -10p ×3',
+        '2 tins soup get you a half price loaf: -40p']
+
+
+def test_unit_order():
+    allocations = {'a': [('x', 2), ('y', 1)], 'b': [('z', 1)]}
+    assert receipt.unit_order([('a', 1), ('b', 2), ('a', 3)],
+                              allocations) == [
+        ['a', 'x', 1], ['b', 'z', 1], ['a', 'x', 1], ['a', 'y', 1]]
+    assert receipt.unit_order([('a', 4)], allocations) == [
+        ['a', 'x', 2], ['a', 'y', 1]]
+    assert receipt.unit_order([('c', 1)], allocations) == []
+
+
+def test_render(goods, offers):
+    priced = price(goods, offers, [('apples', 200), ('soup', 2),
+                                   ('bread', 1)])
+    assert priced.render() == [
+        'Apples 10% off: -10p ×200',
+        '2 tins soup get you a half price loaf: -40p']
+    assert priced.render(expand=True) == priced.discounts
+    assert len(priced.discounts) == 201
+
+
+def test_render_discounts(goods, offers):
+    # Identical lines are rendered once, whichever product they discount
+    half_price = offer.Offer({'id': 3, 'title': 'Half price',
+                              'qualifying_product': 'milk',
+                              'qualifying_qty': 1,
+                              'discounted_product': 'milk',
+                              'discount_percent': 50})
+    lines = [
+        receipt.DiscountLine(goods['apples'], offers[0], 2, 10),
+        receipt.DiscountLine(goods['milk'], half_price, 1, 40),
+        receipt.DiscountLine(goods['bread'], half_price, 2, 40),
+        receipt.DiscountLine(goods['apples'], offers[0], 1, 20)]
+    assert receipt.render_discounts(lines) == [
+        'Apples 10% off: -10p ×2', 'Half price: -40p ×3',
+        'Apples 10% off: -20p']
+    assert receipt.render_discounts(lines, expand=True) == [
+        'Apples 10% off: -10p', 'Apples 10% off: -10p', 'Half price: -40p',
+        'Half price: -40p', 'Half price: -40p', 'Apples 10% off: -20p']
+    assert receipt.render_discounts([]) == []
+
+
+def test_price_empty(goods, offers):
+    priced = price(goods, offers, [])
+    assert (priced.subtotal, priced.total) == (0, 0)
+    assert priced.lines == ()
+    assert priced.discounts == []
+    assert priced.unknown == ()
+
+
+@pytest.mark.parametrize('quantity', [0, -1, 1.5, '2', None, True])
+def test_price_bad_quantity(goods, offers, quantity):
+    for item in ('apples', 'eggs'):
+        with pytest.raises(ValueError) as e:
+            price(goods, offers, [('bread', 1), (item, quantity)])
+        assert str(e.value) == 'Unacceptable quantity for {}: {!r}'.format(
+            item, quantity)
+
+
+def test_catalogue_price_bad_quantity(goods, offers):
+    with pytest.raises(ValueError):
+        catalogue.Catalogue(goods, offers).price([('apples', 0)])
+
+
+def test_price_leaves_catalogue_unchanged(goods, offers):
+    priced = price(goods, offers, [('apples', 3)])
+    assert priced.lines[0].product is goods['apples']
+    assert not goods['apples'].has_offer
+
+
+@pytest.mark.parametrize('strategy', engine.STRATEGIES)
+def test_price_matches_basket(goods, offers, strategy):
+    offers.append(offer.Offer({'id': 3, 'title': 'Milk makes apples free',
+                               'qualifying_product': 'milk',
+                               'qualifying_qty': 1,
+                               'discounted_product': 'apples',
+                               'discount_percent': 100}))
+    rng = random.Random(0)
+    names = list(goods) + ['eggs']
+    for _ in range(50):
+        items = [(rng.choice(names), rng.randint(1, 3))
+                 for _ in range(rng.randint(0, 8))]
+        b = basket.Basket(goods, offers,
+                          engine.compile_offers(goods, offers, strategy))
+        for item, quantity in items:
+            b.add(item, quantity)
+        b.calculate_discounts()
+        priced = price(goods, offers, items, strategy)
+        assert priced.subtotal == b.subtotal
+        assert priced.total == b.total
+        assert priced.discounts == [p.discount_message
+                                    for p in b.discounted_items]
+
+
+def test_price_threads(goods, offers):
+    # One catalogue shared by many threads gives each the same prices
+    shop = catalogue.Catalogue(goods, offers)
+    rng = random.Random(1)
+    baskets = [[(rng.choice(list(goods)), rng.randint(1, 3))
+                for _ in range(rng.randint(1, 6))] for _ in range(400)]
+    expected = [(p.total, p.discounts)
+                for p in (shop.price(items) for items in baskets)]
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        actual = [(p.total, p.discounts)
+                  for p in pool.map(shop.price, baskets)]
+    assert actual == expected
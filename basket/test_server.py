@@ -0,0 +1,219 @@
+import http.client
+import json
+import socket
+import threading
+
+import pytest
+
+import basket.catalogue as catalogue
+import basket.logs as logs
+import basket.offer as offer
+import basket.product as product
+import basket.server as server
+
+
+@pytest.fixture
+def shop():
+    goods = {
+      'soup': product.Product('soup', 65, 'tin'),
+      'milk': product.Product('milk', 130, 'bottle'),
+      'apples': product.Product('apples', 100, 'bag'), }
+    offers = [offer.Offer({'id': 1, 'title': 'Apples 10% off',
+                           'qualifying_product': 'apples',
+                           'qualifying_qty': 1,
+                           'discounted_product': 'apples',
+                           'discount_percent': 10})]
+    return catalogue.Catalogue(goods, offers)
+
+
+@pytest.fixture
+def pricing_server(shop):
+    s = server.PricingServer(('127.0.0.1', 0), shop)
+    thread = threading.Thread(target=s.serve_forever, args=(0.01,))
+    thread.start()
+    yield s
+    s.shutdown()
+    thread.join()
+    s.server_close()
+
+
+@pytest.fixture
+def conn(pricing_server):
+    c = http.client.HTTPConnection(*pricing_server.server_address)
+    yield c
+    c.close()
+
+
+def request(conn, method, path, body=None):
+    conn.request(method, path, body)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_price_request(shop):
+    result = server.price_request(shop, b'{"id": 3, "items": ["apples"]}')
+    assert result == {'id': 3, 'subtotal': 100,
+                      'discounts': ['Apples 10% off: -10p'], 'total': 90,
+                      'unknown': []}
+
+
+@pytest.mark.parametrize('body, message', [
+    (b'\xff', 'Basket is not UTF-8 encoded'),
+    (b'foo', 'Expecting value'),
+    (b'{}', 'Basket has no list of items'),
+    (b'{"items": {"apples": 5000000000}}', 'Basket holds more than'),
+])
+def test_price_request_bad(shop, body, message):
+    with pytest.raises(ValueError) as e:
+        server.price_request(shop, body)
+    assert message in str(e.value)
+
+
+def test_price(conn):
+    status, result = request(conn, 'POST', '/price', '["apples", "milk"]')
+    assert status == 200
+    assert result == {'id': None, 'subtotal': 230,
+                      'discounts': ['Apples 10% off: -10p'], 'total': 220,
+                      'unknown': []}
+
+
+def test_price_keep_alive(conn):
+    for _ in range(3):
+        status, result = request(conn, 'POST', '/price',
+                                 '{"items": {"apples": 2, "pie": 1}}')
+        assert status == 200
+        assert result['total'] == 180
+        assert result['unknown'] == ['pie']
+
+
+def test_price_bad_basket(conn):
+    status, result = request(conn, 'POST', '/price', 'foo')
+    assert status == 400
+    assert 'Expecting value' in result['error']
+
+
+def test_price_too_large(conn, monkeypatch):
+    monkeypatch.setattr(server, 'MAX_BODY_SIZE', 10)
+    status, result = request(conn, 'POST', '/price', '["apples", "milk"]')
+    assert status == 413
+    assert result == {'error': 'Basket too large'}
+
+
+def test_price_no_length(conn):
+    conn.putrequest('POST', '/price')
+    conn.endheaders()
+    response = conn.getresponse()
+    assert response.status == 411
+
+
+def test_price_negative_length(conn):
+    conn.putrequest('POST', '/price')
+    conn.putheader('Content-Length', '-1')
+    conn.endheaders()
+    response = conn.getresponse()
+    assert response.status == 400
+    assert json.loads(response.read()) == {'error': 'Invalid Content-Length'}
+
+
+def test_not_found(conn):
+    assert request(conn, 'GET', '/price')[0] == 404
+    assert request(conn, 'POST', '/foo', '[]')[0] == 404
+
+
+def test_health(conn):
+    assert request(conn, 'GET', '/health') == (200, {'status': 'ok'})
+
+
+def test_price_current_catalogue(shop):
+    class Source:
+        catalogue = shop
+
+        def current(self):
+            return self.catalogue
+
+    source = Source()
+    s = server.PricingServer(('127.0.0.1', 0), source)
+    thread = threading.Thread(target=s.serve_forever, args=(0.01,))
+    thread.start()
+    try:
+        c = http.client.HTTPConnection(*s.server_address)
+        assert request(c, 'POST', '/price', '["apples"]')[1]['total'] == 90
+        source.catalogue = catalogue.Catalogue(shop.goods, [])
+        assert request(c, 'POST', '/price', '["apples"]')[1]['total'] == 100
+        c.close()
+    finally:
+        s.shutdown()
+        thread.join()
+        s.server_close()
+
+
+@pytest.mark.parametrize('log_level', [None, logs.WARNING])
+def test_handler_log_level(shop, log_level):
+    seen = []
+
+    class Source:
+
+        def current(self):
+            seen.append((logs.level(), logs.output()))
+            return shop
+
+    with logs.verbosity(logs.INFO), logs.output_to('stderr'):
+        s = server.PricingServer(('127.0.0.1', 0), Source(),
+                                 log_level=log_level)
+    thread = threading.Thread(target=s.serve_forever, args=(0.01,))
+    thread.start()
+    try:
+        c = http.client.HTTPConnection(*s.server_address)
+        assert request(c, 'POST', '/price', '["apples"]')[0] == 200
+        c.close()
+    finally:
+        s.shutdown()
+        thread.join()
+        s.server_close()
+    assert seen == [(log_level or logs.INFO, 'stderr')]
+
+
+def test_price_failure(shop):
+    class Source:
+
+        def current(self):
+            raise RuntimeError('catalogue unavailable')
+
+    s = server.PricingServer(('127.0.0.1', 0), Source())
+    thread = threading.Thread(target=s.serve_forever, args=(0.01,))
+    thread.start()
+    try:
+        c = http.client.HTTPConnection(*s.server_address)
+        assert request(c, 'POST', '/price', '["apples"]') == (
+            500, {'error': 'Failed to price basket'})
+        assert request(c, 'GET', '/health')[0] == 200
+        c.close()
+    finally:
+        s.shutdown()
+        thread.join()
+        s.server_close()
+
+
+def test_request_timeout(pricing_server, monkeypatch):
+    monkeypatch.setattr(server.PricingHandler, 'timeout', 0.1)
+    with socket.create_connection(pricing_server.server_address) as sock:
+        sock.settimeout(5)
+        sock.sendall(b'POST /price HTTP/1.1\r\nContent-Length: 10\r\n\r\n')
+        assert sock.recv(1024) == b''
+
+
+@pytest.mark.parametrize('log_level, logged', [
+    (logs.INFO, True), (logs.WARNING, False)])
+def test_log_requests(shop, capsys, log_level, logged):
+    s = server.PricingServer(('127.0.0.1', 0), shop, log_level=log_level)
+    thread = threading.Thread(target=s.serve_forever, args=(0.01,))
+    thread.start()
+    try:
+        c = http.client.HTTPConnection(*s.server_address)
+        assert request(c, 'GET', '/health')[0] == 200
+        c.close()
+    finally:
+        s.shutdown()
+        thread.join()
+        s.server_close()
+    assert ('"GET /health HTTP/1.1" 200' in capsys.readouterr().out) is logged
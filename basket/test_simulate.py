@@ -0,0 +1,151 @@
+import random
+
+import pytest
+
+import basket.engine as engine
+import basket.product as product
+import basket.simulate as simulate
+from basket.testing import make_offer
+
+
+def sku(name):
+    return product.intern_sku(name)
+
+
+def test_history():
+    history = simulate.History()
+    assert history.add('a', {sku('soup'): 2, sku('bread'): 1}) == 0
+    assert history.add('b', {sku('soup'): 1}) == 1
+    assert history.add('c', {}) == 2
+    assert history.add('d', {sku('bread'): 3, sku('soup'): 1}) == 3
+    assert len(history) == 4
+    assert history.ids == ['a', 'b', 'c', 'd']
+    assert history.counts(0) == {sku('soup'): 2, sku('bread'): 1}
+    assert history.counts(2) == {}
+    assert history.holding([sku('soup')]) == {0, 1, 3}
+    assert history.holding([sku('soup'), sku('bread')]) == {0, 3}
+    assert history.holding([sku('soup'), sku('milk')]) == set()
+    assert history.holding([]) == set()
+
+
+def test_history_large_quantity(goods):
+    history = simulate.History()
+    history.add('a', {sku('soup'): 2 ** 40})
+    assert history.counts(0) == {sku('soup'): 2 ** 40}
+    # Baskets parsed from lines are skipped if they hold too many units
+    history = simulate.load_history(
+        goods, ['{"items": {"apples": 5000000000}}\n', '["milk"]\n'])
+    assert history.ids == [2]
+
+
+def test_load_history(goods):
+    lines = ['["apples", "Apples", "eggs"]\n', '\n', 'foo\n',
+             '{"id": "b4", "items": {"milk": 2}}\n']
+    history = simulate.load_history(goods, lines)
+    assert history.ids == [1, 'b4']
+    assert history.counts(0) == {sku('apples'): 2}
+    assert history.counts(1) == {sku('milk'): 2}
+
+
+def test_offer_keys():
+    offers = [make_offer(1, 'soup', 1, 'soup', 10),
+              make_offer('1', 'soup', 1, 'soup', 10),
+              make_offer(1, 'soup', 1, 'soup', 10)]
+    assert simulate.offer_keys(offers) == [('1', 0), ("'1'", 0), ('1', 1)]
+
+
+def test_diff_offers():
+    old = [make_offer(1, 'soup', 1, 'soup', 10),
+           make_offer(2, 'soup', 2, 'bread', 50),
+           make_offer(3, 'milk', 1, 'apples', 10),
+           make_offer(4, 'apples', 1, 'apples', 10),
+           make_offer(5, 'bread', 1, 'bread', 10)]
+    new = [make_offer(4, 'apples', 1, 'apples', 10),
+           make_offer(1, 'soup', 1, 'soup', 10),
+           make_offer(2, 'soup', 2, 'bread', 25),
+           make_offer(3, 'milk', 1, 'apples', 10),
+           make_offer(6, 'milk', 1, 'milk', 10)]
+    keys = {key[0]: key
+            for key in simulate.offer_keys(old) + simulate.offer_keys(new)}
+    assert simulate.diff_offers(old, new) == {
+        keys['1']: simulate.UNCHANGED,
+        keys['2']: simulate.CHANGED,
+        keys['3']: simulate.UNCHANGED,
+        keys['4']: simulate.MOVED,
+        keys['5']: simulate.REMOVED,
+        keys['6']: simulate.ADDED,
+    }
+
+
+@pytest.mark.parametrize('values, longest', [
+    ([], 0), ([3], 1), ([0, 1, 2], 3), ([2, 1, 0], 1), ([3, 0, 4, 1, 2], 3)])
+def test_increasing(values, longest):
+    positions = sorted(simulate._increasing(values))
+    assert len(positions) == longest
+    run = [values[i] for i in positions]
+    assert run == sorted(run)
+
+
+def test_simulate(goods):
+    old = [make_offer(1, 'apples', 1, 'apples', 10),
+           make_offer(2, 'soup', 2, 'bread', 50)]
+    new = [make_offer(1, 'apples', 1, 'apples', 20, 'Apples 20% off'),
+           make_offer(2, 'soup', 2, 'bread', 50)]
+    history = simulate.History()
+    history.add(1, {sku('apples'): 2, sku('milk'): 1})
+    history.add(2, {sku('soup'): 2, sku('bread'): 1})
+    history.add(3, {sku('apples'): 1, sku('soup'): 2, sku('bread'): 1})
+    report = simulate.simulate(goods, old, new, history)
+    assert report['baskets'] == 3
+    assert report['repriced'] == 2
+    assert report['changed'] == 2
+    # Only the baskets holding apples are repriced
+    assert report['total_before'] == 310 + 260
+    assert report['total_after'] == 290 + 250
+    assert report['total_delta'] == -30
+    assert report['offers'] == [{
+        'id': 1, 'title': 'Apples 20% off', 'status': simulate.CHANGED,
+        'units_before': 3, 'units_after': 3, 'discount_before': 30,
+        'discount_after': 60, 'discount_delta': 30,
+    }, {
+        'id': 2, 'title': 'Offer 2', 'status': simulate.UNCHANGED,
+        'units_before': 1, 'units_after': 1, 'discount_before': 40,
+        'discount_after': 40, 'discount_delta': 0,
+    }]
+
+
+@pytest.mark.parametrize('strategy', engine.STRATEGIES)
+def test_simulate_matches_full_repricing(goods, strategy):
+    rng = random.Random(0)
+    names = list(goods)
+
+    def random_offer(offer_id):
+        return make_offer(offer_id, rng.choice(names), rng.randint(1, 3),
+                          rng.choice(names), rng.choice([10, 25, 50]))
+
+    def full_total(offers, history):
+        plan = engine.compile_offers(goods, offers, strategy)
+        total = 0
+        for number in range(len(history)):
+            counts = history.counts(number)
+            total += plan.subtotal(counts) - plan.discount(
+                plan.allocate(counts))
+        return total
+
+    for _ in range(30):
+        history = simulate.History()
+        for number in range(40):
+            history.add(number, {
+                sku(name): rng.randint(1, 4)
+                for name in rng.sample(names, rng.randint(0, 3))})
+        old = [random_offer(offer_id) for offer_id in range(5)]
+        new = list(old)
+        if rng.random() < 0.5:
+            new[0], new[1] = new[1], new[0]
+        new[2] = random_offer(2)
+        new.pop(rng.randrange(len(new)))
+        new.insert(rng.randrange(len(new) + 1), random_offer(9))
+        report = simulate.simulate(goods, old, new, history, strategy)
+        assert report['total_delta'] == (full_total(new, history) -
+                                         full_total(old, history))
+        assert report['repriced'] <= len(history)
@@ -0,0 +1,154 @@
+import itertools
+import random
+
+import basket.engine as engine
+import basket.product as product
+import basket.solver as solver
+from basket.testing import make_offer
+
+
+def sku(name):
+    return product.intern_sku(name)
+
+
+def exhaustive(rules, counts):
+    """The largest discount, trying every number of applications."""
+    rules = [rule for rule in rules if solver.most(rule, counts)]
+    best = 0
+    for applied in itertools.product(*[
+            range(solver.most(rule, counts) + 1) for rule in rules]):
+        left = dict(counts)
+        for rule, applications in zip(rules, applied):
+            for name, units in solver.uses(rule, applications):
+                left[name] -= units
+        if min(left.values()) >= 0:
+            best = max(best, sum(rule.unit_discount * applications
+                                 for rule, applications in zip(rules,
+                                                               applied)))
+    return best
+
+
+def test_most(goods):
+    plan = engine.compile_offers(goods, [
+        make_offer(1, 'soup', 3, 'soup', 50),
+        make_offer(2, 'soup', 2, 'bread', 50)])
+    same, other = plan.rules
+    assert solver.most(same, {sku('soup'): 7}) == 2
+    assert solver.most(other, {sku('soup'): 7}) == 0
+    assert solver.most(other, {sku('soup'): 7, sku('bread'): 2}) == 2
+    assert solver.uses(same, 2) == [(sku('soup'), 6)]
+    assert solver.uses(other, 2) == [(sku('soup'), 4), (sku('bread'), 2)]
+
+
+def test_candidates(goods):
+    plan = engine.compile_offers(goods, [
+        make_offer(1, 'soup', 2, 'bread', 25),
+        make_offer(2, 'soup', 2, 'bread', 50),
+        make_offer(3, 'soup', 3, 'bread', 50),
+        make_offer(4, 'soup', 3, 'bread', 75),
+        make_offer(5, 'soup', 1, 'bread', 0),
+        make_offer(6, 'apples', 1, 'milk', 10)], engine.EXCLUSIVE)
+    rules = plan.rules
+    counts = {sku('soup'): 3, sku('bread'): 1, sku('apples'): 1}
+    # 1 and 3 are dominated by 2, 5 gives nothing and 6 has no milk
+    assert solver.candidates(plan, counts) == [rules[1], rules[3]]
+
+
+def test_components(goods):
+    plan = engine.compile_offers(goods, [
+        make_offer(1, 'soup', 1, 'bread', 10),
+        make_offer(2, 'apples', 1, 'milk', 10),
+        make_offer(3, 'milk', 1, 'soup', 10),
+        make_offer(4, 'apples', 1, 'apples', 10)])
+    rules = plan.rules
+    everything = {sku(name) for name in goods}
+    assert solver.components(rules, everything) == [[0, 1, 2, 3]]
+    # Only shared contested SKUs join rules
+    assert solver.components([rules[0], rules[1], rules[3]],
+                             {sku('bread'), sku('apples')}) == [[0], [1, 2]]
+
+
+def test_solve_uncontested(goods):
+    plan = engine.compile_offers(goods, [
+        make_offer(1, 'apples', 1, 'apples', 10),
+        make_offer(2, 'soup', 2, 'bread', 50)])
+    counts = {sku('apples'): 3, sku('soup'): 4, sku('bread'): 1}
+    assert solver.solve(plan.rules, counts) == [3, 1]
+
+
+def test_solve_contested(goods):
+    plan = engine.compile_offers(goods, [
+        make_offer(1, 'soup', 1, 'soup', 20),
+        make_offer(2, 'soup', 3, 'bread', 50),
+        make_offer(3, 'soup', 2, 'milk', 50)])
+    counts = {sku('soup'): 5, sku('bread'): 1, sku('milk'): 1}
+    # 13p a tin, or 40p for 3 tins, or 65p for 2 tins
+    assert solver.solve(plan.rules, counts) == [0, 1, 1]
+    assert solver.greedy(plan.rules, counts) == [0, 1, 1]
+
+
+def test_greedy(goods):
+    plan = engine.compile_offers(goods, [
+        make_offer(1, 'soup', 4, 'milk', 50),
+        make_offer(2, 'soup', 1, 'bread', 50)])
+    counts = {sku('soup'): 4, sku('bread'): 4, sku('milk'): 1}
+    # Largest discount per tin beats largest discount
+    assert solver.greedy(plan.rules, counts) == [0, 4]
+
+
+def test_allocate(goods):
+    plan = engine.compile_offers(goods, [
+        make_offer(1, 'apples', 1, 'bread', 50),
+        make_offer(2, 'soup', 1, 'bread', 25),
+        make_offer(3, 'apples', 1, 'apples', 10)])
+    rules = plan.rules
+    allocations = solver.allocate(plan, {sku('apples'): 3, sku('soup'): 1,
+                                         sku('bread'): 2})
+    # Rather than the soup's 20p off a loaf, and 10p off each of 2 apples
+    assert allocations == {sku('bread'): [(rules[0], 2)],
+                           sku('apples'): [(rules[2], 1)]}
+    assert solver.allocate(plan, {}) == {}
+
+
+def test_allocate_matches_exhaustive(goods):
+    rng = random.Random(0)
+    names = list(goods)
+    for _ in range(200):
+        offers = []
+        for offer_id in range(rng.randint(1, 6)):
+            qualifying = rng.choice(names)
+            discounted = (qualifying if rng.random() < 0.4
+                          else rng.choice(names))
+            offers.append(make_offer(offer_id, qualifying, rng.randint(1, 3),
+                                     discounted, rng.choice([10, 25, 50])))
+        plan = engine.compile_offers(goods, offers, engine.EXCLUSIVE)
+        counts = {sku(name): rng.randint(1, 5)
+                  for name in rng.sample(names, rng.randint(1, 4))}
+        allocations = solver.allocate(plan, counts)
+        left = dict(counts)
+        for allocation in allocations.values():
+            for rule, applications in allocation:
+                for name, units in solver.uses(rule, applications):
+                    left[name] -= units
+        assert min(left.values()) >= 0
+        assert plan.discount(allocations) == exhaustive(plan.rules, counts)
+
+
+def test_search_state_limit(goods, monkeypatch):
+    monkeypatch.setattr(solver, 'MAX_STATES', 0)
+    rng = random.Random(1)
+    names = list(goods)
+    offers = [make_offer(offer_id, rng.choice(names), rng.randint(1, 3),
+                         rng.choice(names), rng.choice([10, 25, 50]))
+              for offer_id in range(12)]
+    plan = engine.compile_offers(goods, offers)
+    counts = {sku(name): 9 for name in names}
+    rules = solver.candidates(plan, counts)
+
+    def discount(applied):
+        return sum(rule.unit_discount * applications
+                   for rule, applications in zip(rules, applied))
+
+    # Never worse than greedy when states are dropped
+    assert discount(solver.solve(rules, counts)) >= discount(
+        solver.greedy(rules, counts))
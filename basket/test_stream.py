@@ -0,0 +1,143 @@
+import io
+import json
+import random
+
+import pytest
+
+import basket.stream as stream
+
+
+def read(text, chunk_size=stream.CHUNK_SIZE, **kwargs):
+    return list(stream.ArrayReader(io.StringIO(text), chunk_size, **kwargs))
+
+
+def syntax_error(text, chunk_size=stream.CHUNK_SIZE):
+    with pytest.raises(ValueError) as excinfo:
+        read(text, chunk_size)
+    return str(excinfo.value)
+
+
+@pytest.mark.parametrize('text', [
+    '[]', ' [ ] \n', '[1]', '[1, 2.5, -3e2]', '["a", "b,]", null, true]',
+    '[{"name": "Soup", "price": 65}, {"list": [1, [2, {}]]}]',
+    '\n[\n  {"a": "\\u00e9\\"]"},\n  12345678901234567890\n]\n'])
+def test_read(text):
+    for chunk_size in (1, 2, 3, 7, stream.CHUNK_SIZE):
+        assert read(text, chunk_size) == json.loads(text)
+
+
+def test_read_random():
+    rng = random.Random(0)
+
+    def value(depth):
+        kind = rng.randrange(6 if depth < 3 else 4)
+        if kind == 0:
+            return rng.randint(-10 ** 6, 10 ** 6)
+        if kind == 1:
+            return rng.random() * 100
+        if kind == 2:
+            return ''.join(rng.choice('ab ,[]{}"\\\né')
+                           for _ in range(rng.randrange(8)))
+        if kind == 3:
+            return rng.choice([None, True, False])
+        if kind == 4:
+            return [value(depth + 1) for _ in range(rng.randrange(4))]
+        return {str(i): value(depth + 1) for i in range(rng.randrange(4))}
+
+    for _ in range(100):
+        data = [value(0) for _ in range(rng.randrange(6))]
+        text = json.dumps(data, indent=rng.choice([None, 2]))
+        assert read(text, rng.randint(1, 16)) == data
+
+
+def test_position():
+    text = '[\n  {"a": 1},\n\n    {"b": 2}, 3\n]'
+    reader = stream.ArrayReader(io.StringIO(text), 2)
+    positions = [(reader.line, reader.column, reader.offset)
+                 for _ in reader]
+    assert positions == [(2, 3, 4), (4, 5, 19), (4, 15, 29)]
+    assert stream.position(reader) == 'line 4 column 15'
+
+
+def check_positions(text, chunk_size):
+    decoder = json.JSONDecoder()
+    reader = stream.ArrayReader(io.StringIO(text), chunk_size)
+    count = 0
+    for element in reader:
+        offset = reader.offset
+        assert decoder.raw_decode(text, offset)[0] == element
+        assert reader.line == text.count('\n', 0, offset) + 1
+        assert reader.column == offset - text.rfind('\n', 0, offset)
+        count += 1
+    return count
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 64, stream.CHUNK_SIZE])
+def test_position_parsed_together(chunk_size):
+    elements = [{'name': 'soup{}'.format(i), 'price': i, 'tags': [i, {}]}
+                for i in range(200)]
+    for indent in (None, 2):
+        text = json.dumps(elements, indent=indent)
+        assert check_positions(text, chunk_size) == len(elements)
+
+
+def test_position_random():
+    rng = random.Random(1)
+    for _ in range(50):
+        data = [rng.choice([1, 'a,]}', [2, [3]], {'b': {'c': '}, '}}, None])
+                for _ in range(rng.randrange(20))]
+        text = json.dumps(data, indent=rng.choice([None, 1]))
+        assert check_positions(text, rng.randint(1, 32)) == len(data)
+
+
+def test_parsed_together():
+    text = json.dumps([{'name': 'soup', 'price': i} for i in range(100)])
+    reader = stream.ArrayReader(io.StringIO(text))
+    assert next(reader) == {'name': 'soup', 'price': 0}
+    assert next(reader) == {'name': 'soup', 'price': 1}
+    # The rest of the elements whole in the buffer were parsed at once
+    assert len(reader._batch) == 98
+    assert list(reader) == [{'name': 'soup', 'price': i}
+                            for i in range(2, 100)]
+
+
+@pytest.mark.parametrize('text', [
+    '', '[', '[1', '[1,', '[1,]', '[1 2]', '[1]]', '[1] x',
+    '[{"a": 1}, {"a": }]', '[\n  {"a": 1},\n  {"a": "b}\n]'])
+def test_syntax_error(text):
+    # Reported at the same place as json does
+    with pytest.raises(ValueError) as excinfo:
+        json.loads(text)
+    position = str(excinfo.value).rsplit(': ', 1)[-1]
+    for chunk_size in (1, 3, stream.CHUNK_SIZE):
+        assert syntax_error(text, chunk_size).endswith(position)
+
+
+@pytest.mark.parametrize('text', ['{}', '1', '"[]"'])
+def test_not_array(text):
+    assert syntax_error(text) == "Expecting '[': line 1 column 1 (char 0)"
+
+
+def test_syntax_error_after_elements():
+    reader = stream.ArrayReader(io.StringIO('[1, 2, x]'))
+    assert next(reader) == 1
+    assert next(reader) == 2
+    with pytest.raises(ValueError):
+        next(reader)
+    with pytest.raises(StopIteration):
+        next(reader)
+
+
+def test_max_element_size():
+    text = '[[1, 2, 3], "{}"]'.format('x' * 100)
+    assert len(read(text, 8, max_element_size=110)) == 2
+    with pytest.raises(ValueError) as excinfo:
+        read(text, 8, max_element_size=64)
+    assert 'line 1 column 13' in str(excinfo.value)
+
+
+def test_compacts_buffer():
+    text = '[{}]'.format(', '.join(['{"name": "Soup", "price": 65}'] * 1000))
+    reader = stream.ArrayReader(io.StringIO(text), 64)
+    for _ in reader:
+        assert len(reader._buffer) < 128
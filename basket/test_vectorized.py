@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+import basket.basket as basket
+import basket.engine as engine
+import basket.product as product
+from basket.testing import make_offer
+
+numpy = pytest.importorskip('numpy')
+vectorized = pytest.importorskip('basket.vectorized')
+
+
+@pytest.fixture
+def goods():
+    return {
+      'soup': product.Product('soup', 65, 'tin'),
+      'bread': product.Product('bread', 80, 'loaf'),
+      'milk': product.Product('milk', 130, 'bottle'),
+      'apples': product.Product('apples', 99, 'bag'), }
+
+
+@pytest.fixture
+def offers():
+    return [make_offer(1, 'apples', 1, 'apples', 10),
+            make_offer(2, 'soup', 2, 'bread', 50),
+            make_offer(3, 'pie', 1, 'milk', 10)]
+
+
+def test_ordered_only(goods, offers):
+    plan = engine.compile_offers(goods, offers, engine.BEST)
+    with pytest.raises(ValueError):
+        vectorized.BatchPricer(goods, offers, plan)
+
+
+def test_count_matrix(goods, offers):
+    pricer = vectorized.BatchPricer(goods, offers)
+    counts = pricer.count_matrix([['apples', 'Soup', 'apples'], [],
+                                  ['pie', 'milk']])
+    assert counts.tolist() == [[1, 0, 0, 2], [0, 0, 0, 0], [0, 0, 1, 0]]
+    assert pricer.count_matrix([]).shape == (0, 4)
+
+
+def test_price(goods, offers):
+    pricer = vectorized.BatchPricer(goods, offers)
+    prices = pricer.price(pricer.count_matrix([
+        ['apples', 'milk'],
+        ['milk', 'soup', 'soup', 'bread', 'apples'],
+        ['soup', 'soup', 'soup', 'soup', 'bread'],
+        []]))
+    assert prices.offers == offers[:2]
+    assert prices.subtotals.tolist() == [229, 439, 340, 0]
+    # Apples 10% off 99p is 9p when truncated
+    assert prices.totals.tolist() == [220, 390, 300, 0]
+    assert prices.discount_counts.tolist() == [[1, 0], [1, 1], [0, 1],
+                                               [0, 0]]
+    assert prices.discount_amounts.tolist() == [[9, 0], [9, 40], [0, 40],
+                                                [0, 0]]
+
+
+def test_price_matches_basket(goods):
+    rnd = random.Random(1)
+    names = list(goods) + ['pie']
+    offers = [make_offer(i, rnd.choice(names), rnd.randint(1, 3),
+                         rnd.choice(names), rnd.choice([0, 5, 33, 50, 100]))
+              for i in range(12)]
+    baskets = [[rnd.choice(names) for _ in range(rnd.randint(0, 20))]
+               for _ in range(300)]
+    pricer = vectorized.BatchPricer(goods, offers)
+    prices = pricer.price(pricer.count_matrix(baskets))
+    for row, items in enumerate(baskets):
+        b = basket.Basket(goods, offers, pricer.plan)
+        for item in items:
+            b.add(item)
+        b.calculate_discounts()
+        assert prices.subtotals[row] == b.subtotal
+        assert prices.totals[row] == b.total
+        assert prices.discount_counts[row].sum() == len(b.discounted_items)
+
+
+def test_no_numpy(goods, offers, monkeypatch):
+    monkeypatch.setattr(vectorized, 'numpy', None)
+    with pytest.raises(ImportError) as e:
+        vectorized.BatchPricer(goods, offers)
+    assert 'NumPy is required' in str(e.value)
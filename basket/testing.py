@@ -0,0 +1,39 @@
+"""Testing module.
+
+Goods and offers shared by the tests.
+"""
+
+from basket import offer
+from basket import product
+
+
+def make_goods():
+    """Make the goods most tests price against.
+
+    :return dict: Dictionary of product.Product instances.
+    """
+    return {
+      'soup': product.Product('soup', 65, 'tin'),
+      'bread': product.Product('bread', 80, 'loaf'),
+      'milk': product.Product('milk', 130, 'bottle'),
+      'apples': product.Product('apples', 100, 'bag'), }
+
+
+def make_offer(offer_id, qualifying_product, qualifying_qty,
+               discounted_product, discount_percent, title=None):
+    """Make an offer.
+
+    :param offer_id: Id of the offer.
+    :param str qualifying_product: Name of the product qualifying.
+    :param int qualifying_qty: Units of it needed for each discount.
+    :param str discounted_product: Name of the product discounted.
+    :param discount_percent: Discount given, as a percentage.
+    :param str title: Title of the offer, by default from its id.
+    :return: ``offer.Offer`` instance.
+    """
+    return offer.Offer({'id': offer_id,
+                        'title': title or 'Offer {}'.format(offer_id),
+                        'qualifying_product': qualifying_product,
+                        'qualifying_qty': qualifying_qty,
+                        'discounted_product': discounted_product,
+                        'discount_percent': discount_percent})
@@ -0,0 +1,135 @@
+"""Vectorized module.
+
+Prices many baskets at once using NumPy array operations rather than a
+``basket.Basket`` per basket.  Baskets are held as a count matrix with a
+row per basket and a column per product in the goods.  The results are
+exactly those ``Basket.subtotal`` and ``Basket.total`` give, including
+offers applied in order with later offers replacing earlier ones on the
+same units, and discounts truncated to whole pence per unit as in
+``product.Product.discount_amount``.
+
+NumPy is an optional dependency, needed only by this module.
+"""
+
+from basket import engine
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+class BatchPricer:
+    """Class that prices a batch of baskets with array operations."""
+
+    def __init__(self, goods, offers, plan=None):
+        """
+        :param dict goods: The goods available.
+        :param list offers: The offers available.
+        :param plan: Optional ``engine.PricingPlan`` compiled from ``goods``
+          and ``offers``.
+        :raises: ImportError if NumPy is not installed, or ValueError if the
+          plan's strategy is not ``engine.ORDERED``.
+        """
+        if numpy is None:
+            raise ImportError('NumPy is required for vectorized pricing')
+        if plan is None:
+            plan = engine.compile_offers(goods, offers)
+        if plan.strategy != engine.ORDERED:
+            raise ValueError('Vectorized pricing allocates offers in order '
+                             'only')
+        self.goods = goods
+        self.plan = plan
+        self.columns = {name: column for column, name in enumerate(goods)}
+        sku_columns = {p.sku: column
+                       for column, p in enumerate(goods.values())}
+        self.prices = numpy.array([p.price for p in goods.values()],
+                                  dtype=numpy.int64)
+        self.offers = [rule.offer for rule in plan.rules]
+        self.qualifying = [sku_columns[rule.qualifying]
+                           for rule in plan.rules]
+        self.discounted = [sku_columns[rule.discounted]
+                           for rule in plan.rules]
+        self.unit_discounts = numpy.array(
+            [rule.unit_discount for rule in plan.rules], dtype=numpy.int64)
+
+        # Rules grouped by the column of their discounted product, in order
+        self.groups = {}
+        for index, column in enumerate(self.discounted):
+            self.groups.setdefault(column, []).append(index)
+
+    def count_matrix(self, baskets):
+        """Build the count matrix of a batch of baskets.
+
+        :param baskets: Iterable of baskets, each an iterable of item names
+          as accepted by ``basket.Basket.add``.  Items not in the goods are
+          ignored.
+        :return: NumPy integer array of shape (baskets, goods).
+        """
+        rows = []
+        columns = []
+        num_baskets = 0
+        for row, items in enumerate(baskets):
+            num_baskets = row + 1
+            for item in items:
+                column = self.columns.get(item.lower())
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+        counts = numpy.zeros((num_baskets, len(self.columns)),
+                             dtype=numpy.int64)
+        numpy.add.at(counts, (numpy.array(rows, dtype=numpy.intp),
+                              numpy.array(columns, dtype=numpy.intp)), 1)
+        return counts
+
+    def price(self, counts):
+        """Price a batch of baskets.
+
+        :param counts: Count matrix of the baskets, as from
+          ``count_matrix``.
+        :return: ``BatchPrices`` instance.
+        """
+        counts = numpy.asarray(counts, dtype=numpy.int64)
+        num_baskets = counts.shape[0]
+        subtotals = counts @ self.prices
+        applied = numpy.zeros((num_baskets, len(self.offers)),
+                              dtype=numpy.int64)
+        for column, indices in self.groups.items():
+            # Each unit ends up with the last rule applied to it (see
+            # engine.cover), so work back from the last rule
+            available = counts[:, column]
+            covered = numpy.zeros(num_baskets, dtype=numpy.int64)
+            for index in reversed(indices):
+                qualifying = counts[:, self.qualifying[index]]
+                earned = numpy.minimum(
+                    qualifying // self.plan.rules[index].qualifying_qty,
+                    available)
+                applied[:, index] = numpy.maximum(earned - covered, 0)
+                covered = numpy.maximum(covered, earned)
+        amounts = applied * self.unit_discounts
+        return BatchPrices(self.offers, subtotals,
+                           subtotals - amounts.sum(axis=1), applied, amounts)
+
+
+class BatchPrices:
+    """Class that encapsulates the prices of a batch of baskets.
+
+    All prices are in pence, with a row per basket.
+    """
+
+    def __init__(self, offers, subtotals, totals, discount_counts,
+                 discount_amounts):
+        """
+        :param list offers: The ``offer.Offer`` of each discount column.
+        :param subtotals: Array of basket prices without discounts applied.
+        :param totals: Array of basket prices with discounts applied.
+        :param discount_counts: Array of the number of units each offer is
+          applied to, with a column per offer.
+        :param discount_amounts: Array of the discount given by each offer,
+          with a column per offer.
+        """
+        self.offers = offers
+        self.subtotals = subtotals
+        self.totals = totals
+        self.discount_counts = discount_counts
+        self.discount_amounts = discount_amounts